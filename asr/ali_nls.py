@@ -1,14 +1,12 @@
-from threading import Thread
+import threading
 from threading import Lock
-import websocket
 import json
 import time
-import ssl
 import wave
-import _thread as thread
 from aliyunsdkcore.client import AcsClient
 from aliyunsdkcore.request import CommonRequest
 
+from asr.asr_pool import AsrConnectionPool
 from core import wsa_server
 from scheduler.thread_manager import MyThread
 from utils import util
@@ -19,6 +17,15 @@ __running = True
 __my_thread = None
 _token = ''
 
+NLS_URL = 'wss://nls-gateway-cn-shenzhen.aliyuncs.com/ws/v1'
+# 与阿里云保持的空闲常驻连接数（一条连接同一时刻只进行一个识别任务）
+NLS_POOL_SIZE = 2
+# 发出StopTranscription后等待TranscriptionCompleted的时间（秒），超时后重连再归还连接
+NLS_RELEASE_TIMEOUT = 10
+
+__pool = None
+__pool_lock = Lock()
+
 
 def __post_token():
     global _token
@@ -52,21 +59,46 @@ def start():
     MyThread(target=__runnable).start()
 
 
+def _nls_url():
+    return NLS_URL + '?token=' + _token
+
+
+def _on_pool_message(connection, message):
+    owner = connection.owner
+    if owner is not None:
+        owner.on_message(connection, message)
+
+
+def _on_pool_disconnect(connection):
+    owner = connection.owner
+    if owner is not None:
+        owner.on_disconnect(connection)
+
+
+def get_pool():
+    global __pool
+    with __pool_lock:
+        if __pool is None:
+            __pool = AsrConnectionPool("aliyun asr", _nls_url, _on_pool_message, _on_pool_disconnect,
+                                       size=NLS_POOL_SIZE, exclusive=True)
+        return __pool
+
+
 class ALiNls:
     # 初始化
     def __init__(self, username):
-        self.__URL = 'wss://nls-gateway-cn-shenzhen.aliyuncs.com/ws/v1'
-        self.__ws = None
-        self.__frames = []
+        self.__connection = None
         self.started = False
-        self.__closing = False
+        self.__started_event = threading.Event()
         self.__task_id = ''
         self.done = False
         self.finalResults = ""
         self.username = username
         self.data = b''
         self.__endding = False
-        self.__is_close = False
+        self.__released = False
+        self.__sent_at = None
+        self.latency = None  # 发出StopTranscription到收到最终结果的耗时（秒）
         self.lock = Lock()
 
     def __create_header(self, name):
@@ -81,22 +113,38 @@ class ALiNls:
         }
         return header
 
+    def __set_started(self):
+        self.started = True
+        self.__started_event.set()
+
+    def wait_started(self, timeout=None):
+        """
+        等待识别任务开始（收到TranscriptionStarted）
+        """
+        return self.__started_event.wait(timeout)
+
     # 收到websocket消息的处理
-    def on_message(self, ws, message):
+    def on_message(self, connection, message):
         try:
             data = json.loads(message)
             header = data['header']
             name = header['name']
-            
+            if header.get('task_id') and header['task_id'] != self.__task_id:
+                # 连接上一个任务的迟到消息
+                return
+
             # 添加详细的ASR调试日志
             print(f"[ASR][{self.username}] 收到消息类型: {name}")
-            
+
             if name == 'TranscriptionStarted':
-                self.started = True
+                self.__set_started()
                 print(f"[ASR][{self.username}] 语音识别已开始")
             elif name == 'SentenceEnd':
-                self.done = True
+                if self.done:
+                    return
                 self.finalResults = data['payload']['result']
+                self.done = True
+                self.__record_latency()
                 print(f"[ASR][{self.username}] 语音识别完成: {self.finalResults}")
                 # 只推送最终结果到前端，不推送中间结果
                 if wsa_server.get_web_instance().is_connected(self.username):
@@ -104,8 +152,9 @@ class ALiNls:
                 if wsa_server.get_instance().is_connected(self.username):
                     content = {'Topic': 'human', 'Data': {'Key': 'log', 'Value': self.finalResults}, 'Username' : self.username}
                     wsa_server.get_instance().add_cmd(content)
-                ws.close()#TODO
             elif name == 'TranscriptionResultChanged':
+                if self.done:
+                    return
                 self.finalResults = data['payload']['result']
                 print(f"[ASR][{self.username}] 语音识别中间结果: {self.finalResults}")
                 # 注释掉中间结果的推送，避免前端显示片段
@@ -116,6 +165,8 @@ class ALiNls:
                 #     wsa_server.get_instance().add_cmd(content)
             elif name == 'TranscriptionCompleted':
                 print(f"[ASR][{self.username}] 语音识别会话完成")
+                # 任务结束，连接可以给下一句话使用
+                self.__release()
             elif name == 'TaskFailed':
                 error_msg = data.get('payload', {}).get('message', '未知错误')
                 print(f"[ASR][{self.username}] 语音识别失败: {error_msg}")
@@ -123,70 +174,50 @@ class ALiNls:
                 self.started = False
                 self.done = False
                 self.finalResults = ""
+                self.__started_event.set()  # 避免recorder一直等待start状态返回
+                self.__release(reconnect=True)
 
         except Exception as e:
             print(e)
         # print("### message:", message)
 
-    # 收到websocket的关闭要求
-    def on_close(self, ws, code, msg):
-        self.__endding = True
-        self.__is_close = True
+    # 连接断开的处理
+    def on_disconnect(self, connection):
+        print("aliyun asr 连接断开")
+        self.__set_started()  # 避免在aliyun asr出错时，recorder一直等待start状态返回
+        self.__release()
 
-    # 收到websocket错误的处理
-    def on_error(self, ws, error):
-        print("aliyun asr error:", error)
-        self.started = True #避免在aliyun asr出错时，recorder一直等待start状态返回
+    def __record_latency(self):
+        if self.__sent_at is not None and self.latency is None:
+            self.latency = time.time() - self.__sent_at
+            get_pool().record_latency(self.latency)
+            util.log(1, f"aliyun asr识别耗时: {int(self.latency * 1000)} ms, task_id: {self.__task_id}")
 
-    # 收到websocket连接建立的处理
-    def on_open(self, ws):
-        self.__endding = False
-        #为了兼容多路asr，关闭过程数据
-        def run(*args):
-            while self.__endding == False:
-                try: 
-                    if len(self.__frames) > 0:
-                        with self.lock:
-                            frame = self.__frames.pop(0)
-                        if isinstance(frame, dict):
-                            ws.send(json.dumps(frame))
-                        elif isinstance(frame, bytes):
-                            ws.send(frame, websocket.ABNF.OPCODE_BINARY)
-                            self.data += frame
-                    else:
-                        time.sleep(0.001)  # 避免忙等
-                except Exception as e:
-                    print(e)
-                    break
-            if self.__is_close == False:
-                for frame in self.__frames:
-                    ws.send(frame, websocket.ABNF.OPCODE_BINARY)
-                frame = {"header": self.__create_header('StopTranscription')}
-                ws.send(json.dumps(frame))
-        thread.start_new_thread(run, ())
-
-    def __connect(self):
-        self.finalResults = ""
-        self.done = False
+    def __release(self, reconnect=False):
         with self.lock:
-            self.__frames.clear()
-        self.__ws = websocket.WebSocketApp(self.__URL + '?token=' + _token, on_message=self.on_message)
-        self.__ws.on_open = self.on_open
-        self.__ws.on_error = self.on_error
-        self.__ws.on_close = self.on_close
-        self.__ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
+            if self.__released or self.__connection is None:
+                return
+            self.__released = True
+            connection = self.__connection
+        if reconnect:
+            connection.reconnect()
+        get_pool().release(connection)
+
+    def __release_timeout(self):
+        # 迟迟没有收到TranscriptionCompleted，连接状态不确定，重连后再归还
+        self.__release(reconnect=True)
 
     def send(self, buf):
-        with self.lock:
-            self.__frames.append(buf)
-            # 添加音频数据调试日志
-            if isinstance(buf, bytes):
-                print(f"[ASR][{self.username}] 接收音频数据: {len(buf)} 字节")
-            else:
-                print(f"[ASR][{self.username}] 接收控制数据: {type(buf)}")
+        if self.__endding or self.__connection is None:
+            return
+        if isinstance(buf, bytes):
+            self.data += buf
+        self.__connection.send(buf)
 
     def start(self):
-        Thread(target=self.__connect, args=[]).start()
+        # 从连接池取一条已建立的连接，只需发送StartTranscription，不再为每句话重新握手
+        self.__connection = get_pool().acquire()
+        self.__connection.owner = self
         data = {
             'header': self.__create_header('StartTranscription'),
             "payload": {
@@ -200,10 +231,22 @@ class ALiNls:
                 "max_end_silence": 3000        # 增加到3秒，与录音器_RELEASE保持一致
             }
         }
-        self.send(data)
+        self.__connection.send(data)
+        return self.__task_id
 
     def end(self):
+        if self.__endding:
+            return
         self.__endding = True
+        if self.__connection is not None and not self.__released:
+            self.__sent_at = time.time()
+            self.__connection.send({"header": self.__create_header('StopTranscription')})
+            timer = threading.Timer(NLS_RELEASE_TIMEOUT, self.__release_timeout)
+            timer.daemon = True
+            timer.start()
+            if self.done:
+                # 阿里云已先于录音器判定句子结束
+                self.__record_latency()
         with wave.open('cache_data/input2.wav', 'wb') as wf:
             # 设置音频参数
             n_channels = 1  # 单声道
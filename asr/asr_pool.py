@@ -0,0 +1,296 @@
+"""
+常驻ASR连接池
+
+每句话不再单独建立WebSocket连接：连接在后台建立并保持，断线后按退避间隔自动重连，
+通过ping检测连接是否存活。发送经过队列由连接自己的线程完成，调用方不会被网络阻塞。
+"""
+import json
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from queue import Queue, Empty, Full
+
+import websocket
+
+from scheduler.thread_manager import MyThread
+from utils import util
+
+# 等待连接建立的超时（秒）
+CONNECT_TIMEOUT = 5
+# 重连退避间隔上限（秒）
+MAX_RECONNECT_DELAY = 30
+# 心跳间隔与超时（秒）
+PING_INTERVAL = 20
+PING_TIMEOUT = 15
+# 发送队列长度上限；队列满时send最多等待SEND_TIMEOUT秒，仍然满则丢弃该帧
+SEND_QUEUE_SIZE = 256
+SEND_TIMEOUT = 2
+# 连续的小音频帧合并成一条二进制消息发送，每条消息的字节数上限
+COALESCE_BYTES = 64000
+
+
+class AsrConnection:
+    """
+    一条常驻的ASR WebSocket连接
+
+    url_factory在每次(重新)连接时调用，便于使用最新的token；
+    on_message(connection, message)在连接线程中回调，on_disconnect(connection)在连接断开时回调。
+    """
+
+    def __init__(self, name, url_factory, on_message, on_disconnect=None):
+        self.name = name
+        self.url_factory = url_factory
+        self.url = None
+        self.on_message = on_message
+        self.on_disconnect = on_disconnect
+        self.connected = threading.Event()
+        self.owner = None  # 独占使用时的当前使用者
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()  # 共用时在途的请求：request_id -> 请求方，按发送顺序排列
+        self.__ws = None
+        self.__running = True
+        self.__reconnect_now = False
+        self.__queue = Queue(maxsize=SEND_QUEUE_SIZE)
+        self.dropped = 0  # 因发送队列满而丢弃的帧数
+        MyThread(target=self.__run).start()
+        MyThread(target=self.__send_loop).start()
+
+    def __run(self):
+        delay = 1
+        while self.__running:
+            self.url = self.url_factory()
+            ws = websocket.WebSocketApp(self.url,
+                                        on_open=self.__on_open,
+                                        on_message=self.__on_message,
+                                        on_error=self.__on_error,
+                                        on_close=self.__on_close)
+            self.__ws = ws
+            opened_at = time.time()
+            try:
+                ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE},
+                               ping_interval=PING_INTERVAL, ping_timeout=PING_TIMEOUT)
+            except Exception as e:
+                util.log(1, f"{self.name}连接异常: {str(e)}")
+            self.connected.clear()
+            if self.on_disconnect is not None:
+                try:
+                    self.on_disconnect(self)
+                except Exception as e:
+                    util.log(1, f"{self.name}断开处理异常: {str(e)}")
+            if not self.__running:
+                break
+            if self.__reconnect_now:
+                # 主动重连，不等待
+                self.__reconnect_now = False
+                continue
+            # 连接保持过一段时间说明服务正常，从最短间隔重新开始退避
+            if time.time() - opened_at > MAX_RECONNECT_DELAY:
+                delay = 1
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def __on_open(self, ws):
+        self.connected.set()
+
+    def __on_message(self, ws, message):
+        try:
+            self.on_message(self, message)
+        except Exception as e:
+            util.log(1, f"{self.name}消息处理异常: {str(e)}")
+
+    def __on_error(self, ws, error):
+        self.connected.clear()
+
+    def __on_close(self, ws, code, msg):
+        self.connected.clear()
+
+    def __send_loop(self):
+        while self.__running:
+            try:
+                frame = self.__queue.get(timeout=1)
+            except Empty:
+                continue
+            # 取出当前已排队的全部数据一起发送，不做额外等待
+            items = list(frame) if isinstance(frame, list) else [frame]
+            while True:
+                try:
+                    frame = self.__queue.get_nowait()
+                except Empty:
+                    break
+                items.extend(frame if isinstance(frame, list) else [frame])
+            if not self.connected.wait(CONNECT_TIMEOUT):
+                util.log(1, f"{self.name}未连接，丢弃待发送数据")
+                continue
+            try:
+                for message in self.__coalesce(items):
+                    if isinstance(message, dict):
+                        self.__ws.send(json.dumps(message))
+                    else:
+                        self.__ws.send(message, websocket.ABNF.OPCODE_BINARY)
+            except Exception as e:
+                util.log(1, f"{self.name}发送失败: {str(e)}")
+
+    @staticmethod
+    def __coalesce(items):
+        """
+        相邻的二进制帧合并为不超过COALESCE_BYTES的消息，JSON帧保持原位置作为分界
+        """
+        audio = bytearray()
+        for item in items:
+            if isinstance(item, dict):
+                if audio:
+                    yield bytes(audio)
+                    audio.clear()
+                yield item
+                continue
+            item = memoryview(item).cast('B')
+            while len(item):
+                take = min(len(item), COALESCE_BYTES - len(audio))
+                audio += item[:take]
+                item = item[take:]
+                if len(audio) >= COALESCE_BYTES:
+                    yield bytes(audio)
+                    audio.clear()
+        if audio:
+            yield bytes(audio)
+
+    def __put(self, frame):
+        # 有界队列：发送跟不上时让调用方稍等，而不是无限堆积
+        try:
+            self.__queue.put(frame, timeout=SEND_TIMEOUT)
+            return True
+        except Full:
+            self.dropped += 1
+            util.log(1, f"{self.name}发送队列已满，丢弃数据")
+            return False
+
+    def send(self, frame):
+        """
+        发送一帧：dict按JSON文本发送，bytes按二进制发送（相邻的二进制帧可能被合并发送）
+        :return: 队列已满、等待超时后丢弃时返回False
+        """
+        return self.__put(frame)
+
+    def send_all(self, frames):
+        """
+        连续发送多帧，中间不会插入其他send的数据
+        """
+        return self.__put(list(frames))
+
+    def is_healthy(self):
+        return self.__running and self.connected.is_set()
+
+    def reconnect(self):
+        """
+        断开当前连接，由连接线程立即重新建立（例如token已更新）
+        """
+        self.__reconnect_now = True
+        self.connected.clear()
+        ws = self.__ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    def close(self):
+        self.__running = False
+        self.connected.clear()
+        ws = self.__ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+
+class AsrConnectionPool:
+    """
+    ASR连接池
+
+    shared模式：固定数量的连接被所有话语共用（协议带请求id，可以在一条连接上并发多句话），按轮询分配；
+    独占模式：一条连接同一时刻只服务一句话，用完归还，空闲连接最多保留size条，多出的用完即关闭。
+    """
+
+    def __init__(self, name, url_factory, on_message, on_disconnect=None, size=2, exclusive=False):
+        self.name = name
+        self.url_factory = url_factory
+        self.on_message = on_message
+        self.on_disconnect = on_disconnect
+        self.exclusive = exclusive
+        self.lock = threading.Lock()
+        self.__connections = []
+        self.__next = 0
+        self.__idle = Queue(maxsize=size)
+        self.__latency_count = 0
+        self.__latency_total = 0.0
+        self.__latency_max = 0.0
+        self.__latency_last = 0.0
+        # 预先建立连接，第一句话不必等待握手
+        for _ in range(size):
+            connection = self.__new_connection()
+            if exclusive:
+                self.__idle.put_nowait(connection)
+            else:
+                self.__connections.append(connection)
+
+    def __new_connection(self):
+        return AsrConnection(self.name, self.url_factory, self.on_message, self.on_disconnect)
+
+    def acquire(self, timeout=CONNECT_TIMEOUT):
+        """
+        取一条可用连接（会等待连接建立，最多timeout秒）
+        """
+        if not self.exclusive:
+            with self.lock:
+                connections = self.__connections[self.__next:] + self.__connections[:self.__next]
+                self.__next = (self.__next + 1) % len(self.__connections)
+            for connection in connections:
+                if connection.is_healthy():
+                    return connection
+            connection = connections[0]
+            connection.connected.wait(timeout)
+            return connection
+
+        try:
+            connection = self.__idle.get_nowait()
+        except Empty:
+            connection = self.__new_connection()
+        else:
+            # 健康检查：连接参数（token）已变化时重新连接；已断开的连接由其线程自动重连
+            if connection.url != self.url_factory():
+                connection.reconnect()
+        connection.connected.wait(timeout)
+        return connection
+
+    def release(self, connection):
+        """
+        归还独占连接
+        """
+        if not self.exclusive:
+            return
+        connection.owner = None
+        try:
+            self.__idle.put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def record_latency(self, seconds):
+        with self.lock:
+            self.__latency_count += 1
+            self.__latency_total += seconds
+            self.__latency_last = seconds
+            self.__latency_max = max(self.__latency_max, seconds)
+
+    def stats(self):
+        with self.lock:
+            count = self.__latency_count
+            return {
+                'utterances': count,
+                'avg_latency_ms': int(self.__latency_total / count * 1000) if count else 0,
+                'last_latency_ms': int(self.__latency_last * 1000),
+                'max_latency_ms': int(self.__latency_max * 1000),
+                'connected': sum(1 for c in self.__connections if c.is_healthy()) if not self.exclusive
+                else self.__idle.qsize()
+            }
@@ -1,143 +1,221 @@
 """
 感谢北京中科大脑神经算法工程师张聪聪提供funasr集成代码
 """
-from threading import Thread
-import websocket
 import json
+import os
+import threading
 import time
-import ssl
-import _thread as thread
 
+from asr.asr_pool import AsrConnectionPool
 from core import wsa_server
 from utils import config_util as cfg
 from utils import util
 
+# 与funasr服务保持的常驻连接数，每条连接可以同时承载多句话（按request_id区分）
+FUNASR_POOL_SIZE = 2
+# 流式识别时每段音频的字节数（600ms，与服务端流式模型的chunk_size一致）
+STREAM_CHUNK_BYTES = 19200
+# 中间结果的稳定前缀至少这么长、且比上次触发时多出这么多字才触发预取
+STABLE_PREFIX_MIN_CHARS = 4
+STABLE_PREFIX_MIN_GROWTH = 4
+
+__pool = None
+__pool_lock = threading.Lock()
+
+
+def _funasr_url():
+    return "ws://{}:{}".format(cfg.local_asr_ip, cfg.local_asr_port)
+
+
+def _on_pool_message(connection, message):
+    # 新协议返回{"request_id", "text"}；旧版服务只返回文本，按发送顺序对应
+    request_id = None
+    text = message
+    partial = False
+    try:
+        data = json.loads(message)
+        if isinstance(data, dict) and 'request_id' in data:
+            request_id = data['request_id']
+            text = data.get('text', '')
+            partial = data.get('partial', False)
+    except ValueError:
+        pass
+    if partial:
+        # 流式识别的中间结果，请求仍在进行中
+        with connection.lock:
+            client = connection.pending.get(request_id)
+        if client is not None:
+            client.on_partial(text)
+        return
+    with connection.lock:
+        if request_id is not None:
+            client = connection.pending.pop(request_id, None)
+        elif connection.pending:
+            client = connection.pending.popitem(last=False)[1]
+        else:
+            client = None
+    if client is not None:
+        client.on_result(text)
+
+
+def _on_pool_disconnect(connection):
+    # 连接断开，正在等待结果的话语直接结束，不再等到超时
+    with connection.lock:
+        clients = list(connection.pending.values())
+        connection.pending.clear()
+    for client in clients:
+        client.on_result("")
+
+
+def get_pool():
+    global __pool
+    with __pool_lock:
+        if __pool is None:
+            __pool = AsrConnectionPool("funasr", _funasr_url, _on_pool_message, _on_pool_disconnect,
+                                       size=FUNASR_POOL_SIZE)
+        return __pool
+
+
 class FunASR:
     # 初始化
-    def __init__(self, username):
-        self.__URL = "ws://{}:{}".format(cfg.local_asr_ip, cfg.local_asr_port)
-        self.__ws = None
-        self.__connected = False
-        self.__frames = []
-        self.__state = 0
-        self.__closing = False
-        self.__task_id = ''
+    def __init__(self, username, pcm=True):
+        self.__connection = None
+        self.__request_id = util.random_hex(32)
+        self.__sent_at = None
         self.done = False
         self.finalResults = ""
-        self.__reconnect_delay = 1
-        self.__reconnecting = False
         self.username = username
         self.started = True
-
-    
-    # 收到websocket消息的处理
-    def on_message(self, ws, message):
+        self.latency = None  # 发出识别请求到收到结果的耗时（秒）
+        self.pcm = pcm  # 服务是否支持内存音频（send_pcm/流式识别），否则只能用send_url
+        self.streaming = False  # 流式识别：边说边发送，服务端返回中间结果
+        self.partialResults = ""
+        self.on_stable_text = None  # 中间结果出现稳定前缀时的回调on_stable_text(text)
+        self.__stream_buffer = bytearray()
+        self.__stable_len = 0
+        self.__awaiting = False  # 音频已全部发出，正在等待最终结果
+        self.__registered = False  # 请求已登记在连接的pending中
+
+    # 收到识别结果的处理
+    def on_result(self, text):
+        if self.__sent_at is not None:
+            self.latency = time.time() - self.__sent_at
+            get_pool().record_latency(self.latency)
+            util.log(1, f"funasr识别耗时: {int(self.latency * 1000)} ms, request_id: {self.__request_id}")
         try:
+            self.finalResults = text
             self.done = True
-            self.finalResults = message
             if wsa_server.get_web_instance().is_connected(self.username):
                 wsa_server.get_web_instance().add_cmd({"panelMsg": self.finalResults, "Username" : self.username})
             if wsa_server.get_instance().is_connected(self.username):
                 content = {'Topic': 'human', 'Data': {'Key': 'log', 'Value': self.finalResults}, 'Username' : self.username}
                 wsa_server.get_instance().add_cmd(content)
-   
         except Exception as e:
             print(e)
 
-        if self.__closing:
-            try:
-                self.__ws.close()
-            except Exception as e:
-                print(e)
-
-    # 收到websocket错误的处理
-    def on_close(self, ws, code, msg):
-        self.__connected = False
-        # util.printInfo(1, self.username, f"### CLOSE:{msg}")
-        self.__ws = None
-
-    # 收到websocket错误的处理
-    def on_error(self, ws, error):
-        self.__connected = False
-        # util.printInfo(1, self.username, f"### error:{error}")
-        self.__ws = None
-
-    #重连
-    def __attempt_reconnect(self):
-        if not self.__reconnecting:
-            self.__reconnecting = True
-            # util.log(1, "尝试重连funasr...")
-            while not self.__connected:
-                time.sleep(self.__reconnect_delay)
-                self.start()
-                self.__reconnect_delay *= 2  
-            self.__reconnect_delay = 1  
-            self.__reconnecting = False
-
-
-    # 收到websocket连接建立的处理
-    def on_open(self, ws):
-        self.__connected = True
-
-        def run(*args):
-            while self.__connected:
-                try:
-                    if len(self.__frames) > 0:
-                        frame = self.__frames[0]
-
-                        self.__frames.pop(0)
-                        if type(frame) == dict:
-                            ws.send(json.dumps(frame))
-                        elif type(frame) == bytes:
-                            ws.send(frame, websocket.ABNF.OPCODE_BINARY)
-                        # print('发送 ------> ' + str(type(frame)))
-                except Exception as e:
-                    print(e)
-                time.sleep(0.04)
-
-        thread.start_new_thread(run, ())
-
-    def __connect(self):
-        self.finalResults = ""
-        self.done = False
-        self.__frames.clear()
-        websocket.enableTrace(False)
-        self.__ws = websocket.WebSocketApp(self.__URL, on_message=self.on_message,on_close=self.on_close,on_error=self.on_error)
-        self.__ws.on_open = self.on_open
+    # 收到流式识别中间结果的处理
+    def on_partial(self, text):
+        if self.done:
+            return
+        previous = self.partialResults
+        self.partialResults = text
+        try:
+            if wsa_server.get_web_instance().is_connected(self.username):
+                wsa_server.get_web_instance().add_cmd({"panelMsg": text, "Username" : self.username, "partial" : True})
+        except Exception as e:
+            print(e)
+        # 前后两次中间结果的公共前缀视为已稳定，足够长时提前开始检索
+        stable = os.path.commonprefix([previous, text])
+        if len(stable) >= max(STABLE_PREFIX_MIN_CHARS, self.__stable_len + STABLE_PREFIX_MIN_GROWTH):
+            self.__stable_len = len(stable)
+            self.__notify_stable(stable)
+
+    def __notify_stable(self, text):
+        if self.on_stable_text is None:
+            return
+        try:
+            self.on_stable_text(text)
+        except Exception as e:
+            util.log(1, f"处理识别中间结果失败: {str(e)}")
 
-        self.__ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
+    def wait_started(self, timeout=None):
+        return True
 
     def add_frame(self, frame):
-        self.__frames.append(frame)
+        self.__connection.send(frame)
 
     def send(self, buf):
-        self.__frames.append(buf)
+        # 非流式识别时整句话在结束后一次发送（send_pcm），这里不需要发送
+        if not self.streaming:
+            return
+        self.__stream_buffer.extend(buf)
+        if len(self.__stream_buffer) >= STREAM_CHUNK_BYTES:
+            self.__send_chunk(False)
+
+    def __send_chunk(self, is_final, cancel=False):
+        pcm = b'' if cancel else bytes(self.__stream_buffer)
+        self.__stream_buffer.clear()
+        header = {'audio' : 'chunk', 'request_id' : self.__request_id, 'sample_rate' : 16000,
+                  'bytes' : len(pcm), 'is_final' : is_final}
+        if cancel:
+            header['cancel'] = True
+        self.__connection.send_all([header, pcm] if pcm else [header])
+
+    def finish_stream(self):
+        """
+        流式识别：发送剩余音频并请求最终结果（服务端对整句话做第二遍识别）
+        """
+        self.__sent_at = time.time()
+        self.__awaiting = True
+        self.__send_chunk(True)
+        # 用完整的中间结果再预取一次，最终结果通常与其一致
+        if self.partialResults and len(self.partialResults) > self.__stable_len:
+            self.__stable_len = len(self.partialResults)
+            self.__notify_stable(self.partialResults)
+
+    def __register(self):
+        connection = self.__connection
+        with connection.lock:
+            connection.pending[self.__request_id] = self
+        self.__registered = True
+        self.__sent_at = time.time()
+        return connection
 
     def send_url(self, url):
-        frame = {'url' : url}
-        self.__ws.send(json.dumps(frame))
+        self.__awaiting = True
+        self.__register().send({'url' : url, 'request_id' : self.__request_id})
+
+    def send_pcm(self, pcm, sample_rate=16000):
+        """
+        直接发送整句话的16bit单声道PCM数据进行识别，音频不落盘
+        """
+        pcm = memoryview(pcm).cast('B')
+        header = {'audio' : 'pcm', 'request_id' : self.__request_id,
+                  'sample_rate' : sample_rate, 'bytes' : len(pcm)}
+        # 头信息和音频作为整体发送，同一连接上其他话语的数据不会插入其中；
+        # 音频由连接的发送线程按COALESCE_BYTES切分成多条二进制消息，不做节流
+        self.__awaiting = True
+        self.__register().send_all([header, pcm])
 
     def start(self):
-        Thread(target=self.__connect, args=[]).start()
-        data = {
-                'vad_need':False,
-                'state':'StartTranscription'
-        }
-        self.add_frame(data)
+        # 从连接池取一条已建立的连接，不再为每句话重新握手
+        self.finalResults = ""
+        self.done = False
+        self.__connection = get_pool().acquire()
+        self.streaming = self.pcm and cfg.config['source']['record'].get('asr_streaming', False)
+        if self.streaming:
+            # 流式识别开始即登记请求，中间结果按request_id送回
+            self.__register()
 
     def end(self):
-        if self.__connected:
-            try:
-                for frame in self.__frames:
-                    self.__frames.pop(0)
-                    if type(frame) == dict:
-                        self.__ws.send(json.dumps(frame))
-                    elif type(frame) == bytes:
-                        self.__ws.send(frame, websocket.ABNF.OPCODE_BINARY)
-                self.__frames.clear()
-                frame = {'vad_need':False,'state':'StopTranscription'}
-                self.__ws.send(json.dumps(frame))
-            except Exception as e:
-                print(e)
-        self.__closing = True
-        self.__connected = False
+        # 放弃这句话：等待结果超时，或流式识别中途中止（未调用finish_stream）。
+        # 请求从pending中移除，迟到的结果不再处理
+        connection = self.__connection
+        if connection is None or self.done or not self.__registered:
+            return
+        with connection.lock:
+            connection.pending.pop(self.__request_id, None)
+        self.__registered = False
+        if self.streaming and not self.__awaiting:
+            # 通知服务端丢弃已收到的音频，不再做第二遍识别
+            self.__send_chunk(True, cancel=True)
@@ -3,7 +3,11 @@ import websockets
 import argparse
 import json
 import logging
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
 from funasr import AutoModel
+import numpy as np
 import os
 
 # 设置日志级别
@@ -15,27 +19,111 @@ parser = argparse.ArgumentParser()
 parser.add_argument("--host", type=str, default="0.0.0.0", help="host ip, localhost, 0.0.0.0")
 parser.add_argument("--port", type=int, default=10197, help="grpc server port")
 parser.add_argument("--ngpu", type=int, default=1, help="0 for cpu, 1 for gpu")
+parser.add_argument("--batch_window", type=int, default=20, help="ms to wait for more utterances to batch together")
+parser.add_argument("--max_batch", type=int, default=8, help="max utterances per generate call")
+parser.add_argument("--hotword", type=str, default="data/hotword.txt", help="hotword file")
+parser.add_argument("--online", type=int, default=1, help="1 to load the streaming model for partial results")
 args = parser.parse_args()
 
+# 流式模型参数：每600ms音频输出一次中间结果
+ONLINE_CHUNK_SIZE = [0, 10, 5]
+ONLINE_CHUNK_STRIDE = ONLINE_CHUNK_SIZE[1] * 960  # 采样点数
+
 # 初始化模型
 print("model loading")
 asr_model = AutoModel(model="paraformer-zh", model_revision="v2.0.4",
                       vad_model="fsmn-vad", vad_model_revision="v2.0.4",
                       punc_model="ct-punc-c", punc_model_revision="v2.0.4")
+online_model = None
+if args.online:
+    online_model = AutoModel(model="paraformer-zh-streaming", model_revision="v2.0.4")
 print("model loaded")
 websocket_users = {}
 task_queue = asyncio.Queue()
+# 推理在单独的线程中进行，事件循环线程只负责收发，推理期间心跳不受影响。
+# AutoModel.generate会原地修改模型共享的kwargs（fs、hotword、batch_size等），不能并发调用，
+# 因此只用一个推理线程，吞吐量靠动态批处理获得
+executor = ThreadPoolExecutor(max_workers=1)
+# 流式模型同样只能串行调用：各句话的解码状态（cache）作为参数传入同一个模型，
+# 用独立的单线程执行，中间结果不必排在离线批次后面
+online_executor = ThreadPoolExecutor(max_workers=1)
+
+metrics = {
+    "requests": 0,
+    "batches": 0,
+    "audio_seconds": 0.0,
+    "inference_seconds": 0.0,
+    "in_flight": 0
+}
+
+def load_hotword():
+    # 热词
+    try:
+        with open(args.hotword, "r", encoding="utf-8") as f:
+            lines = [line.strip() for line in f.readlines()]
+    except OSError as e:
+        print(f"热词文件读取失败: {e}")
+        return ""
+    return " ".join(line for line in lines if line)
+
+hotword = load_hotword()
+print(f"热词：{hotword}")
+
+def get_metrics():
+    audio_seconds = metrics["audio_seconds"]
+    return {
+        "queue_depth": task_queue.qsize(),
+        "in_flight": metrics["in_flight"],
+        "requests": metrics["requests"],
+        "batches": metrics["batches"],
+        "avg_batch_size": metrics["requests"] / metrics["batches"] if metrics["batches"] else 0,
+        "rtf": metrics["inference_seconds"] / audio_seconds if audio_seconds else 0
+    }
+
+async def handle_command(websocket, data):
+    global hotword
+    command = data.get("command")
+    if command == "reload_hotword":
+        hotword = load_hotword()
+        print(f"热词已重新加载：{hotword}")
+        await websocket.send(json.dumps({"command": command, "hotword": hotword}, ensure_ascii=False))
+    elif command == "metrics":
+        await websocket.send(json.dumps({"command": command, "metrics": get_metrics()}))
 
 async def ws_serve(websocket, path):
     global websocket_users
     user_id = id(websocket)
     websocket_users[user_id] = websocket
+    pcm = None  # 正在接收的PCM音频：{"request_id", "bytes", "sample_rate", "data", "stream", "is_final", "cancel"}
+    streams = {}  # 流式识别中的话语：request_id -> 流状态
     try:
         async for message in websocket:
             if isinstance(message, str):
                 data = json.loads(message)
-                if 'url' in data:
-                    await task_queue.put((websocket, data['url']))
+                if 'command' in data:
+                    await handle_command(websocket, data)
+                elif 'url' in data:
+                    # request_id由客户端生成，结果原样带回，客户端可以在一条连接上同时识别多句话
+                    await task_queue.put((websocket, data['url'], data.get('request_id'), None))
+                elif data.get('audio') in ('pcm', 'chunk'):
+                    # 内存音频：头信息之后紧跟共bytes字节的二进制帧（16bit单声道PCM），不落盘
+                    # pcm为整句话；chunk为流式识别中的一段，is_final表示这句话结束，cancel表示客户端放弃这句话
+                    pcm = {"request_id": data.get('request_id'), "bytes": int(data.get('bytes', 0)),
+                           "sample_rate": int(data.get('sample_rate', 16000)), "data": bytearray(),
+                           "stream": data.get('audio') == 'chunk', "is_final": bool(data.get('is_final')),
+                           "cancel": bool(data.get('cancel'))}
+            elif pcm is not None:
+                pcm["data"].extend(message)
+            if pcm is not None and len(pcm["data"]) >= pcm["bytes"]:
+                audio = np.frombuffer(bytes(pcm["data"][:pcm["bytes"]]), dtype=np.int16).astype(np.float32) / 32768.0
+                if pcm["cancel"]:
+                    streams.pop(pcm["request_id"], None)
+                elif pcm["stream"]:
+                    await handle_stream_chunk(websocket, streams, pcm["request_id"], audio,
+                                              pcm["sample_rate"], pcm["is_final"])
+                else:
+                    await task_queue.put((websocket, audio, pcm["request_id"], pcm["sample_rate"]))
+                pcm = None
     except websockets.exceptions.ConnectionClosed as e:
         logger.info(f"Connection closed: {e.reason}")
     except Exception as e:
@@ -47,41 +135,154 @@ async def ws_serve(websocket, path):
         await websocket.close()
         logger.info("WebSocket closed")
 
-async def worker():
-    while True:
-        websocket, url = await task_queue.get()
+async def handle_stream_chunk(websocket, streams, request_id, audio, sample_rate, is_final):
+    """
+    流式识别（2-pass）：说话过程中用流式模型每600ms输出一次中间结果，
+    这句话结束后用离线模型对整句音频重新识别，作为最终结果
+    """
+    stream = streams.get(request_id)
+    if stream is None:
+        stream = {"chunks": [], "unfed": np.zeros(0, dtype=np.float32), "cache": {}, "text": "",
+                  "lock": asyncio.Lock()}
+        streams[request_id] = stream
+    stream["chunks"].append(audio)
+    if is_final:
+        del streams[request_id]
+        # 第二遍：整句离线识别，与普通请求一起批量处理
+        full_audio = np.concatenate(stream["chunks"]) if stream["chunks"] else np.zeros(0, dtype=np.float32)
+        await task_queue.put((websocket, full_audio, request_id, sample_rate))
+        return
+    if online_model is None:
+        return
+    stream["unfed"] = np.concatenate([stream["unfed"], audio])
+    while len(stream["unfed"]) >= ONLINE_CHUNK_STRIDE:
+        chunk = stream["unfed"][:ONLINE_CHUNK_STRIDE]
+        stream["unfed"] = stream["unfed"][ONLINE_CHUNK_STRIDE:]
+        asyncio.create_task(online_step(websocket, stream, request_id, chunk))
+
+def online_generate(chunk, cache):
+    res = online_model.generate(input=chunk, cache=cache, is_final=False, chunk_size=ONLINE_CHUNK_SIZE,
+                                encoder_chunk_look_back=4, decoder_chunk_look_back=1)
+    return res[0].get('text', '') if res else ''
+
+async def online_step(websocket, stream, request_id, chunk):
+    loop = asyncio.get_running_loop()
+    # asyncio.Lock按请求顺序唤醒，同一句话的音频段按顺序送入流式模型
+    async with stream["lock"]:
+        try:
+            text = await loop.run_in_executor(online_executor, online_generate, chunk, stream["cache"])
+        except Exception as e:
+            print(f"Error during online model.generate: {e}")
+            return
+        if not text:
+            return
+        stream["text"] += text
         if websocket.open:
-            await process_wav_file(websocket, url)
-        else:
-            logger.info("WebSocket connection is already closed when trying to process file")
-        task_queue.task_done()
+            try:
+                await websocket.send(json.dumps({"request_id": request_id, "text": stream["text"], "partial": True},
+                                                ensure_ascii=False))
+            except websockets.exceptions.ConnectionClosed:
+                pass
 
-async def process_wav_file(websocket, url):
-    # 热词
-    param_dict = {"sentence_timestamp": False}
-    with open("data/hotword.txt", "r", encoding="utf-8") as f:
-        lines = f.readlines()
-        lines = [line.strip() for line in lines]
-    hotword = " ".join(lines)
-    print(f"热词：{hotword}")
-    param_dict["hotword"] = hotword
-    wav_path = url
+async def batcher():
+    """
+    从task_queue取任务组成批次：拿到第一句话后最多再等batch_window毫秒收集同时到达的话语，
+    每批一次generate调用；上一批推理期间到达的话语在下一批中合并处理
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await task_queue.get()]
+        deadline = loop.time() + args.batch_window / 1000
+        while len(batch) < args.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(task_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        await process_batch(batch)
+
+def audio_duration(audio, sample_rate):
+    if isinstance(audio, str):
+        try:
+            with wave.open(audio, 'rb') as wf:
+                return wf.getnframes() / wf.getframerate()
+        except Exception:
+            return 0.0
+    return len(audio) / (sample_rate or 16000)
+
+def generate(inputs, sample_rate):
+    param_dict = {"sentence_timestamp": False, "hotword": hotword}
+    if sample_rate is not None:
+        param_dict["fs"] = sample_rate
+    input_data = inputs if len(inputs) > 1 else inputs[0]
+    res = asr_model.generate(input=input_data, is_final=True, **param_dict)
+    if len(res) != len(inputs):
+        raise ValueError(f"batch result size mismatch: {len(res)} != {len(inputs)}")
+    return [r.get('text', '') for r in res]
+
+def generate_batch(inputs, sample_rate):
     try:
-        res = asr_model.generate(input=wav_path, is_final=True, **param_dict)
-        if res:
-            if 'text' in res[0] and websocket.open:
-                await websocket.send(res[0]['text'])
+        return generate(inputs, sample_rate)
     except Exception as e:
-        print(f"Error during model.generate: {e}")
+        if len(inputs) == 1:
+            print(f"Error during model.generate: {e}")
+            return [""]
+        # 批量推理失败时逐句重试，避免一句话出错影响同批的其他话语
+        print(f"Error during batched model.generate, retrying one by one: {e}")
+        return [generate_batch([audio], sample_rate)[0] for audio in inputs]
+
+async def process_batch(batch):
+    loop = asyncio.get_running_loop()
+    tasks = [task for task in batch if task[0].open]
+    # 采样率相同的话语才能放在同一次generate调用中
+    groups = {}
+    for task in tasks:
+        groups.setdefault(task[3], []).append(task)
+    metrics["in_flight"] += len(tasks)
+    try:
+        for sample_rate, group in groups.items():
+            inputs = [task[1] for task in group]
+            audio_seconds = sum(audio_duration(audio, sample_rate) for audio in inputs)
+            start = time.time()
+            texts = await loop.run_in_executor(executor, generate_batch, inputs, sample_rate)
+            elapsed = time.time() - start
+            metrics["requests"] += len(group)
+            metrics["batches"] += 1
+            metrics["audio_seconds"] += audio_seconds
+            metrics["inference_seconds"] += elapsed
+            rtf = elapsed / audio_seconds if audio_seconds else 0
+            print(f"识别{len(group)}句，音频{audio_seconds:.2f}秒，耗时{elapsed:.2f}秒，RTF {rtf:.3f}，排队{task_queue.qsize()}句")
+            for (websocket, _, request_id, _), text in zip(group, texts):
+                # 识别失败也要回复，客户端不必等到超时
+                await send_result(websocket, text, request_id)
     finally:
-        if os.path.exists(wav_path):
-            os.remove(wav_path)
+        metrics["in_flight"] -= len(tasks)
+        for task in batch:
+            if isinstance(task[1], str) and os.path.exists(task[1]):
+                os.remove(task[1])
+        for _ in batch:
+            task_queue.task_done()
+
+async def send_result(websocket, text, request_id):
+    if not websocket.open:
+        return
+    try:
+        if request_id is None:
+            # 旧版客户端只接收文本
+            if text:
+                await websocket.send(text)
+        else:
+            await websocket.send(json.dumps({"request_id": request_id, "text": text}, ensure_ascii=False))
+    except websockets.exceptions.ConnectionClosed as e:
+        logger.info(f"Connection closed before result was sent: {e.reason}")
 
 async def main():
     start_server = websockets.serve(ws_serve, args.host, args.port, ping_interval=10)
     await start_server
-    worker_task = asyncio.create_task(worker())
-    await worker_task
+    batcher_task = asyncio.create_task(batcher())
+    await batcher_task
 
 # 使用 asyncio 运行主函数
 asyncio.run(main())
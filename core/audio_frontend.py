@@ -0,0 +1,149 @@
+"""
+录音前端：下混、音量计算、自适应阈值与可选的频谱VAD
+
+每个音频块只做一次下混（转为单声道np.int16），音量用NumPy向量化计算，
+历史音量保存在定长NumPy环形数组中并维护滑动窗口和，激活前的音频块保存在定长deque中，
+每块的处理开销与历史长度无关。
+"""
+import math
+from collections import deque
+
+import numpy as np
+
+try:
+    import webrtcvad
+    WEBRTCVAD_AVAILABLE = True
+except ImportError:
+    WEBRTCVAD_AVAILABLE = False
+
+# VAD模式：energy只看音量阈值；spectral在音量超过阈值的基础上再做频谱判断（装有webrtcvad时使用webrtcvad）
+VAD_ENERGY = 'energy'
+VAD_SPECTRAL = 'spectral'
+
+# 保存的激活前音频块数，以免信息掉失
+HISTORY_CHUNKS = 10
+# 计算历史平均音量的窗口（块数）
+AVERAGE_WINDOW = 30
+# 音量满刻度
+MAX_LEVEL = 25000
+# 初始音量阈值
+INITIAL_THRESHOLD = 0.5
+
+# 频谱VAD参数
+VAD_FRAME_MS = 30
+SPEECH_BAND = (300, 3400)  # 人声主要频段（Hz）
+SPEECH_BAND_RATIO = 0.5  # 人声频段能量占比下限
+SPECTRAL_FLATNESS = 0.5  # 频谱平坦度上限，噪声的频谱更平坦
+SPEECH_FRAME_RATIO = 0.3  # 一个音频块中判为人声的帧占比下限
+WEBRTCVAD_AGGRESSIVENESS = 2
+
+
+class AudioFrontend:
+    """
+    单个录音会话的音频前端
+
+    process(data, channels)返回(单声道数据, 音量占比)并更新自适应阈值；
+    is_voice(mono, percentage)判断当前块是否为人声。
+    """
+
+    def __init__(self, sample_rate=16000, vad_mode=VAD_ENERGY):
+        self.sample_rate = sample_rate
+        self.vad_mode = vad_mode
+        self.dynamic_threshold = INITIAL_THRESHOLD  # 声音识别的音量阈值
+        self.history = deque(maxlen=HISTORY_CHUNKS)
+        self.levels = np.zeros(AVERAGE_WINDOW, dtype=np.float64)
+        self.level_count = 0
+        self.level_index = 0
+        self.level_sum = 0.0
+        self._vad = None
+        self._band_mask = None
+        self._window = None
+
+    def process(self, data, channels):
+        """
+        处理一个音频块：下混、计算音量、保存到历史并更新自适应阈值
+        :return: (单声道np.int16数据, 音量占比)
+        """
+        samples = np.frombuffer(data, dtype=np.int16)
+        floats = samples.astype(np.float32)
+        level = math.sqrt(float(np.dot(floats, floats)) / len(floats)) if len(floats) else 0.0
+        if channels and channels > 1:
+            mono = floats.reshape(-1, channels).mean(axis=1).astype(np.int16)
+        else:
+            mono = samples
+        self.history.append(mono)
+        self.__add_level(level)
+        self.__update_threshold()
+        return mono, level / MAX_LEVEL
+
+    def __add_level(self, level):
+        # 定长环形数组，滑动窗口和随写入增量更新
+        self.level_sum += level - self.levels[self.level_index]
+        self.levels[self.level_index] = level
+        self.level_index = (self.level_index + 1) % AVERAGE_WINDOW
+        if self.level_count < AVERAGE_WINDOW:
+            self.level_count += 1
+
+    def history_percentage(self):
+        if self.level_count == 0:
+            return 0.02
+        return (self.level_sum / self.level_count / MAX_LEVEL) * 1.05 + 0.02
+
+    def __update_threshold(self):
+        history_percentage = self.history_percentage()
+        if history_percentage > self.dynamic_threshold:
+            self.dynamic_threshold += (history_percentage - self.dynamic_threshold) * 0.0025
+        elif history_percentage < self.dynamic_threshold:
+            self.dynamic_threshold = history_percentage
+
+    def take_history(self):
+        """
+        取出激活前保存的音频块（不含当前块，当前块由调用方自行发送）并清空历史
+        """
+        chunks = list(self.history)[:-1]
+        self.history.clear()
+        return chunks
+
+    def is_voice(self, mono, percentage):
+        """
+        判断当前块是否为人声：音量需超过自适应阈值，频谱模式下还需通过频谱判断
+        """
+        if percentage <= self.dynamic_threshold:
+            return False
+        if self.vad_mode != VAD_SPECTRAL:
+            return True
+        if WEBRTCVAD_AVAILABLE:
+            if self._vad is None:
+                self._vad = webrtcvad.Vad(WEBRTCVAD_AGGRESSIVENESS)
+            return self.__webrtc_is_speech(mono)
+        return self.__spectral_is_speech(mono)
+
+    def __frames(self, mono):
+        frame_len = self.sample_rate * VAD_FRAME_MS // 1000
+        count = len(mono) // frame_len
+        if count == 0:
+            return None
+        return mono[:count * frame_len].reshape(count, frame_len)
+
+    def __webrtc_is_speech(self, mono):
+        frames = self.__frames(mono)
+        if frames is None:
+            return True
+        speech = sum(1 for frame in frames if self._vad.is_speech(frame.tobytes(), self.sample_rate))
+        return speech >= len(frames) * SPEECH_FRAME_RATIO
+
+    def __spectral_is_speech(self, mono):
+        frames = self.__frames(mono)
+        if frames is None:
+            return True
+        frame_len = frames.shape[1]
+        if self._window is None or len(self._window) != frame_len:
+            self._window = np.hanning(frame_len).astype(np.float32)
+            freqs = np.fft.rfftfreq(frame_len, 1.0 / self.sample_rate)
+            self._band_mask = (freqs >= SPEECH_BAND[0]) & (freqs <= SPEECH_BAND[1])
+        # 所有帧一次性做FFT
+        power = np.abs(np.fft.rfft(frames.astype(np.float32) * self._window, axis=1)) ** 2 + 1e-10
+        band_ratio = power[:, self._band_mask].sum(axis=1) / power.sum(axis=1)
+        flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+        speech = (band_ratio > SPEECH_BAND_RATIO) & (flatness < SPECTRAL_FLATNESS)
+        return speech.mean() >= SPEECH_FRAME_RATIO
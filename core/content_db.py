@@ -1,15 +1,16 @@
 import sqlite3
 import time
+import atexit
 import threading
-import functools
+from queue import Queue, Empty
+from concurrent.futures import Future
 from utils import util
+from core.sqlite_pool import get_pool
 
-def synchronized(func):
-    @functools.wraps(func)
-    def wrapper(self, *args, **kwargs):
-        with self.lock:
-            return func(self, *args, **kwargs)
-    return wrapper
+DB_PATH = 'memory/fay.db'
+# 对话记录写后台批量提交：攒够FLUSH_ROWS条或等待FLUSH_INTERVAL秒后一次提交
+FLUSH_ROWS = 200
+FLUSH_INTERVAL = 0.05
 
 __content_tb = None
 def new_instance():
@@ -19,17 +20,120 @@ def new_instance():
         __content_tb.init_db()
     return __content_tb
 
+class MsgWriter:
+    """
+    T_Msg的后台写入队列
+
+    调用方只负责入队，立即拿到一个Future（结果为新记录的id，失败为0）；
+    后台线程把队列中的记录合并成一个事务提交，不再每条消息一次提交。
+    """
+
+    def __init__(self, pool, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL):
+        self.pool = pool
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.__queue = Queue()
+        self.__start_lock = threading.Lock()
+        self.__thread = None
+        self.__closed = False
+
+    def __ensure_started(self):
+        with self.__start_lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name="MsgWriter", daemon=True)
+                self.__thread.start()
+
+    def submit(self, row):
+        """
+        提交一条记录 (type, way, content, createtime, username, uid)
+        :return: Future，结果为记录id
+        """
+        future = Future()
+        if self.__closed:
+            self.__write_batch([(row, future)])
+            return future
+        self.__ensure_started()
+        self.__queue.put((row, future))
+        return future
+
+    def flush(self, timeout=None):
+        """
+        等待此前提交的记录全部写入
+        """
+        if self.__thread is None:
+            return True
+        future = Future()
+        self.__queue.put((None, future))
+        try:
+            future.result(timeout)
+            return True
+        except Exception:
+            return False
+
+    def close(self, timeout=5):
+        """
+        写入剩余记录并停止后台线程（之后的提交改为同步写入）
+        """
+        if self.__closed:
+            return
+        self.flush(timeout)
+        self.__closed = True
+
+    def __write_batch(self, batch):
+        try:
+            with self.pool.write() as conn:
+                for row, future in batch:
+                    try:
+                        cur = conn.execute("INSERT INTO T_Msg (type, way, content, createtime, username, uid) VALUES (?, ?, ?, ?, ?, ?)", row)
+                        future.set_result(cur.lastrowid)
+                    except Exception as e:
+                        util.log(1, "请检查参数是否有误: {}".format(e))
+                        future.set_result(0)
+        except Exception as e:
+            util.log(1, "写入对话记录失败: {}".format(e))
+            for row, future in batch:
+                if not future.done():
+                    future.set_result(0)
+
+    def __run(self):
+        while True:
+            item = self.__queue.get()
+            batch = []
+            markers = []
+            deadline = time.time() + self.flush_interval
+            while True:
+                if item[0] is None:
+                    # flush标记：写完当前批次后通知等待方
+                    markers.append(item[1])
+                    break
+                batch.append(item)
+                if len(batch) >= self.flush_rows:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.__queue.get(timeout=remaining)
+                except Empty:
+                    break
+            if batch:
+                self.__write_batch(batch)
+            for marker in markers:
+                marker.set_result(True)
+
+
 class Content_Db:
 
     def __init__(self) -> None:
-        self.lock = threading.Lock()
+        self.pool = get_pool(DB_PATH)
+        self.writer = MsgWriter(self.pool)
+        atexit.register(self.writer.close)
 
     # 初始化数据库
     def init_db(self):
-        conn = sqlite3.connect('memory/fay.db')
-        conn.text_factory = str
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS T_Msg
+        with self.pool.write() as conn:
+            c = conn.cursor()
+            c.execute('''CREATE TABLE IF NOT EXISTS T_Msg
             (id INTEGER PRIMARY KEY AUTOINCREMENT,
             type        CHAR(10),
             way         CHAR(10),
@@ -37,72 +141,54 @@ class Content_Db:
             createtime  INT,
             username    TEXT DEFAULT 'User',
             uid         INT);''')
-        # 对话采纳记录表
-        c.execute('''CREATE TABLE IF NOT EXISTS T_Adopted
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-            msg_id      INTEGER UNIQUE,
-            adopted_time INT,
-            FOREIGN KEY(msg_id) REFERENCES T_Msg(id));''')
-        conn.commit()
-        conn.close()
-
-    # 添加对话
-    @synchronized
+            # 对话采纳记录表
+            c.execute('''CREATE TABLE IF NOT EXISTS T_Adopted
+                (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                msg_id      INTEGER UNIQUE,
+                adopted_time INT,
+                FOREIGN KEY(msg_id) REFERENCES T_Msg(id));''')
+
+    # 添加对话（后台批量写入），返回记录id的Future
+    def add_content_async(self, type, way, content, username='User', uid=0):
+        return self.writer.submit((type, way, content, int(time.time()), username, uid))
+
+    # 添加对话并等待写入，返回记录id（不需要id的调用方应使用add_content_async）
     def add_content(self, type, way, content, username='User', uid=0):
-        conn = sqlite3.connect("memory/fay.db")
-        conn.text_factory = str
-        cur = conn.cursor()
-        try:
-            cur.execute("INSERT INTO T_Msg (type, way, content, createtime, username, uid) VALUES (?, ?, ?, ?, ?, ?)",
-                        (type, way, content, int(time.time()), username, uid))
-            conn.commit()
-            last_id = cur.lastrowid
-        except Exception as e:
-            util.log(1, "请检查参数是否有误: {}".format(e))
-            conn.close()
-            return 0
-        conn.close()
-        return last_id
+        future = self.add_content_async(type, way, content, username, uid)
+        # flush让后台线程立即提交当前批次，不必等满FLUSH_INTERVAL
+        self.writer.flush()
+        return future.result()
+
+    # 等待已提交的对话全部写入
+    def flush(self, timeout=None):
+        return self.writer.flush(timeout)
 
     # 根据ID查询对话记录
-    @synchronized
     def get_content_by_id(self, msg_id):
-        conn = sqlite3.connect("memory/fay.db")
-        conn.text_factory = str
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM T_Msg WHERE id = ?", (msg_id,))
-        record = cur.fetchone()
-        conn.close()
-        return record
+        # 按id查询前先写入队列中的记录，刚提交的对话也能查到
+        self.writer.flush()
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT * FROM T_Msg WHERE id = ?", (msg_id,)).fetchone()
 
     # 添加对话采纳记录
-    @synchronized
     def adopted_message(self, msg_id):
-        conn = sqlite3.connect('memory/fay.db')
-        conn.text_factory = str
-        cur = conn.cursor()
-        # 检查消息ID是否存在
-        cur.execute("SELECT 1 FROM T_Msg WHERE id = ?", (msg_id,))
-        if cur.fetchone() is None:
-            util.log(1, "消息ID不存在")
-            conn.close()
-            return False
-        try:
-            cur.execute("INSERT INTO T_Adopted (msg_id, adopted_time) VALUES (?, ?)", (msg_id, int(time.time())))
-            conn.commit()
-        except sqlite3.IntegrityError:
-            util.log(1, "该消息已被采纳")
-            conn.close()
-            return False
-        conn.close()
+        self.writer.flush()
+        with self.pool.write() as conn:
+            cur = conn.cursor()
+            # 检查消息ID是否存在
+            cur.execute("SELECT 1 FROM T_Msg WHERE id = ?", (msg_id,))
+            if cur.fetchone() is None:
+                util.log(1, "消息ID不存在")
+                return False
+            try:
+                cur.execute("INSERT INTO T_Adopted (msg_id, adopted_time) VALUES (?, ?)", (msg_id, int(time.time())))
+            except sqlite3.IntegrityError:
+                util.log(1, "该消息已被采纳")
+                return False
         return True
 
     # 获取对话内容
-    @synchronized
     def get_list(self, way, order, limit, uid=0):
-        conn = sqlite3.connect("memory/fay.db")
-        conn.text_factory = str
-        cur = conn.cursor()
         where_uid = ""
         if int(uid) != 0:
             where_uid = f" AND T_Msg.uid = {uid} "
@@ -115,31 +201,27 @@ class Content_Db:
             LEFT JOIN T_Adopted ON T_Msg.id = T_Adopted.msg_id
             WHERE 1 {where_uid}
         """
-        if way == 'all':
-            query = base_query + f" ORDER BY T_Msg.id {order} LIMIT ?"
-            cur.execute(query, (limit,))
-        elif way == 'notappended':
-            query = base_query + f" AND T_Msg.way != 'appended' ORDER BY T_Msg.id {order} LIMIT ?"
-            cur.execute(query, (limit,))
-        else:
-            query = base_query + f" AND T_Msg.way = ? ORDER BY T_Msg.id {order} LIMIT ?"
-            cur.execute(query, (way, limit))
-        list = cur.fetchall()
-        conn.close()
-        return list
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            if way == 'all':
+                query = base_query + f" ORDER BY T_Msg.id {order} LIMIT ?"
+                cur.execute(query, (limit,))
+            elif way == 'notappended':
+                query = base_query + f" AND T_Msg.way != 'appended' ORDER BY T_Msg.id {order} LIMIT ?"
+                cur.execute(query, (limit,))
+            else:
+                query = base_query + f" AND T_Msg.way = ? ORDER BY T_Msg.id {order} LIMIT ?"
+                cur.execute(query, (way, limit))
+            return cur.fetchall()
     
 
-    @synchronized
     def get_previous_user_message(self, msg_id):
-        conn = sqlite3.connect("memory/fay.db")
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT id, type, way, content, createtime, datetime(createtime, 'unixepoch', 'localtime') AS timetext, username
-            FROM T_Msg
-            WHERE id < ? AND type != 'fay'
-            ORDER BY id DESC
-            LIMIT 1
-        """, (msg_id,))
-        record = cur.fetchone()
-        conn.close()
-        return record
+        self.writer.flush()
+        with self.pool.connection() as conn:
+            return conn.execute("""
+                SELECT id, type, way, content, createtime, datetime(createtime, 'unixepoch', 'localtime') AS timetext, username
+                FROM T_Msg
+                WHERE id < ? AND type != 'fay'
+                ORDER BY id DESC
+                LIMIT 1
+            """, (msg_id,)).fetchone()
@@ -6,8 +6,7 @@ import time
 import socket
 import requests
 import asyncio  
-from pydub import AudioSegment
-from queue import Queue
+from queue import Queue, Empty
 import re  # 添加正则表达式模块用于过滤表情符号
 
 # 适应模型使用
@@ -22,6 +21,7 @@ from utils import util, config_util
 from core import qa_service
 from utils import config_util as cfg
 from core import content_db
+from core.tts_scheduler import SynthesisScheduler
 from ai_module import nlp_cemotion
 from llm import nlp_cognitive_stream
 from core import stream_manager
@@ -80,6 +80,7 @@ class FeiFei:
         self.cemotion = None
         self.timer = None
         self.sound_query = Queue()
+        self.__tts_scheduler = SynthesisScheduler()
         self.think_mode_users = {}  # 使用字典存储每个用户的think模式状态
         self.interview_questions = []
         self.current_question_idx = 0
@@ -332,36 +333,62 @@ class FeiFei:
                 util.printInfo(1, interact.data.get('user'), "say: think模式中不合成")
                 return None
 
-            result = None
+            username = interact.data.get('user')
+            if is_first:
+                # 新回复开始，丢弃上一条回复中尚未播放的句子
+                self.__tts_scheduler.cancel(username)
+
+            synthesize = None
             audio_url = interact.data.get('audio')
             if audio_url is not None:
                 file_name = 'sample-' + str(int(time.time() * 1000)) + audio_url[-4:]
-                result = self.download_wav(audio_url, './samples/', file_name)
-                util.printInfo(1, interact.data.get('user'), f"say: 透传音频下载 {result}")
-            elif config_util.config["interact"]["playSound"] or wsa_server.get_instance().is_connected(interact.data.get("user")) or self.__is_send_remote_device_audio(interact):
+                def synthesize():
+                    result = self.download_wav(audio_url, './samples/', file_name)
+                    util.printInfo(1, username, f"say: 透传音频下载 {result}")
+                    return result
+            elif config_util.config["interact"]["playSound"] or wsa_server.get_instance().is_connected(username) or self.__is_send_remote_device_audio(interact):
                 if text != None and text.replace("*", "").strip() != "":
                     filtered_text = self.__remove_emojis(text.replace("*", ""))
                     if filtered_text is not None and filtered_text.strip() != "":
-                        util.printInfo(1,  interact.data.get('user'), f'say: 合成音频... {filtered_text}')
-                        tm = time.time()
-                        result = self.sp.to_sample(filtered_text, self.__get_mood_voice())
-                        util.printInfo(1,  interact.data.get("user"), f"say: 合成音频完成. 耗时: {math.floor((time.time() - tm) * 1000)} ms 文件:{result}")
+                        mood_voice = self.__get_mood_voice()
+                        def synthesize():
+                            util.printInfo(1, username, f'say: 合成音频... {filtered_text}')
+                            tm = time.time()
+                            result = self.sp.to_sample(filtered_text, mood_voice)
+                            util.printInfo(1, username, f"say: 合成音频完成. 耗时: {math.floor((time.time() - tm) * 1000)} ms 文件:{result}")
+                            return result
             else:
-                if is_end and wsa_server.get_web_instance().is_connected(interact.data.get('user')):
-                    wsa_server.get_web_instance().add_cmd({"panelMsg": "", 'Username' : interact.data.get('user'), 'robot': f'{cfg.fay_url}/robot/Normal.jpg'})
+                if is_end and wsa_server.get_web_instance().is_connected(username):
+                    wsa_server.get_web_instance().add_cmd({"panelMsg": "", 'Username' : username, 'robot': f'{cfg.fay_url}/robot/Normal.jpg'})
 
-            if result is not None or is_first or is_end:
-                if is_end:
-                    time.sleep(1)
-                util.printInfo(1, interact.data.get('user'), f"say: 入队 sound_query, file={result}, is_first={is_first}, is_end={is_end}")
-                MyThread(target=self.__process_output_audio, args=[result, interact, text]).start()
-                return result
-            else:
-                util.printInfo(1, interact.data.get('user'), f"say: 未生成音频，未入队")
+            if synthesize is None:
+                if not is_first and not is_end:
+                    util.printInfo(1, username, f"say: 未生成音频，未入队")
+                    return None
+                synthesize = lambda: None
+            # 提交预合成：合成与后续句子并行进行，结果按顺序交给__deliver_audio
+            return self.__tts_scheduler.submit(username, synthesize,
+                                               lambda result: self.__deliver_audio(result, interact, text))
         except BaseException as e:
             util.printInfo(1, interact.data.get('user'), f"say: 异常 {e}")
             print(e)
         return None
+
+    #按顺序交付合成好的音频
+    def __deliver_audio(self, result, interact, text):
+        is_first = interact.data.get("isfirst", False)
+        is_end = interact.data.get("isend", False)
+        if result is not None or is_first or is_end:
+            if is_end:
+                time.sleep(1)
+            util.printInfo(1, interact.data.get('user'), f"say: 入队 sound_query, file={result}, is_first={is_first}, is_end={is_end}")
+            self.__process_output_audio(result, interact, text)
+        else:
+            util.printInfo(1, interact.data.get('user'), f"say: 未生成音频，未入队")
+
+    #取消该用户尚未播放的预合成句子（用户打断时调用）
+    def cancel_synthesis(self, username):
+        self.__tts_scheduler.cancel(username)
     
     #下载wav
     def download_wav(self, url, save_directory, filename):
@@ -400,34 +427,36 @@ class FeiFei:
 
         while self.__running:
             try:
-                time.sleep(0.01)
-                if not self.sound_query.empty():
-                    file_url, audio_length, interact = self.sound_query.get()
-                    is_first = interact.data.get('isfirst') is True
-                    is_end = interact.data.get('isend') is True
-                    util.printInfo(1, interact.data.get('user'), f"play_sound: 取出 file={file_url}, is_first={is_first}, is_end={is_end}")
-                    if file_url is not None:
-                        util.printInfo(1, interact.data.get('user'), 'play_sound: 播放音频...')
-                        if is_first:
-                            self.speaking = True
-                        elif not is_end:
-                            self.speaking = True
-                        try:
-                            pygame.mixer.music.load(file_url)
-                            pygame.mixer.music.play()
-                            length = 0
-                            while length < audio_length:
-                                length += 0.01
-                                time.sleep(0.01)
-                        except Exception as e:
-                            util.printInfo(1, interact.data.get('user'), f"play_sound: 播放异常 {e}")
-                    if is_end:
-                        util.printInfo(1, interact.data.get('user'), "play_sound: 播放结束，调用 play_end")
-                        self.play_end(interact)
-                    if wsa_server.get_web_instance().is_connected(interact.data.get('user')):
-                        wsa_server.get_web_instance().add_cmd({"panelMsg": "", "Username" : interact.data.get('user'), 'robot': f'{cfg.fay_url}/robot/Normal.jpg'})
-                    if wsa_server.get_web_instance().is_connected(interact.data.get("user")):
-                        wsa_server.get_web_instance().add_cmd({"panelMsg": "", 'Username': interact.data.get('user')})
+                # 阻塞等待待播放的音频，超时只用于检查__running
+                try:
+                    file_url, audio_length, interact = self.sound_query.get(timeout=1)
+                except Empty:
+                    continue
+                is_first = interact.data.get('isfirst') is True
+                is_end = interact.data.get('isend') is True
+                util.printInfo(1, interact.data.get('user'), f"play_sound: 取出 file={file_url}, is_first={is_first}, is_end={is_end}")
+                if file_url is not None:
+                    util.printInfo(1, interact.data.get('user'), 'play_sound: 播放音频...')
+                    if is_first:
+                        self.speaking = True
+                    elif not is_end:
+                        self.speaking = True
+                    try:
+                        pygame.mixer.music.load(file_url)
+                        pygame.mixer.music.play()
+                        length = 0
+                        while length < audio_length:
+                            length += 0.01
+                            time.sleep(0.01)
+                    except Exception as e:
+                        util.printInfo(1, interact.data.get('user'), f"play_sound: 播放异常 {e}")
+                if is_end:
+                    util.printInfo(1, interact.data.get('user'), "play_sound: 播放结束，调用 play_end")
+                    self.play_end(interact)
+                if wsa_server.get_web_instance().is_connected(interact.data.get('user')):
+                    wsa_server.get_web_instance().add_cmd({"panelMsg": "", "Username" : interact.data.get('user'), 'robot': f'{cfg.fay_url}/robot/Normal.jpg'})
+                if wsa_server.get_web_instance().is_connected(interact.data.get("user")):
+                    wsa_server.get_web_instance().add_cmd({"panelMsg": "", 'Username': interact.data.get('user')})
             except Exception as e:
                 util.printInfo(1, "System", f"play_sound: 循环异常 {e}")
                 continue
@@ -471,14 +500,8 @@ class FeiFei:
     def __process_output_audio(self, file_url, interact, text):
         try:
             try:
-                if file_url is None:
-                    audio_length = 0
-                elif file_url.endswith('.wav'):
-                    audio = AudioSegment.from_wav(file_url)
-                    audio_length = len(audio) / 1000.0  # 时长以秒为单位
-                elif file_url.endswith('.mp3'):
-                    audio = AudioSegment.from_mp3(file_url)
-                    audio_length = len(audio) / 1000.0  # 时长以秒为单位
+                # 时长以秒为单位，wav直接由采样数计算
+                audio_length = 0 if file_url is None else util.get_audio_length(file_url)
             except Exception as e:
                 audio_length = 3
             
@@ -515,8 +538,7 @@ class FeiFei:
                 util.printInfo(1, interact.data.get("user"),  "数字人接口发送音频数据成功")
 
             #面板播放
-            config_util.load_config()
-            if config_util.config["interact"]["playSound"]:
+            if config_util.get_snapshot().config["interact"]["playSound"]:
                   self.sound_query.put((file_url, audio_length, interact))
             else:
                 if wsa_server.get_web_instance().is_connected(interact.data.get('user')):
@@ -558,6 +580,7 @@ class FeiFei:
     #停止核心服务
     def stop(self):
         self.__running = False
+        self.__tts_scheduler.shutdown()
         self.speaking = False
         self.sp.close()
         wsa_server.get_web_instance().add_cmd({"panelMsg": ""})
@@ -570,10 +593,10 @@ class FeiFei:
         :param text: 回复文本
         :param username: 用户名
         :param uid: 用户ID
-        :return: content_id
+        :return: content_id的Future（对话记录在后台批量写入，不阻塞输出）
         """
         self.write_to_file("./logs", "answer_result.txt", text)
-        return content_db.new_instance().add_content('fay', 'speak', text, username, uid)
+        return content_db.new_instance().add_content_async('fay', 'speak', text, username, uid)
 
     def __send_panel_message(self, text, username, uid, content_id=None, type=None):
         """
@@ -636,7 +659,7 @@ class FeiFei:
         if text:
             text = text.strip()
         # 记录主回复
-        content_id = self.__record_response(text, username, uid)
+        self.__record_response(text, username, uid)
         # 发送主回复到面板和数字人
         self.__send_digital_human_message(text, username)
         # 新增：推送到WebSocket前端
@@ -2,6 +2,10 @@ import sqlite3
 import time
 import threading
 import functools
+from core.sqlite_pool import get_pool
+
+DB_PATH = 'memory/user_profiles.db'
+
 def synchronized(func):
   @functools.wraps(func)
   def wrapper(self, *args, **kwargs):
@@ -22,28 +26,23 @@ class Member_Db:
 
     def __init__(self) -> None:
         self.lock = threading.Lock()
+        self.pool = get_pool(DB_PATH)
            
    
 
     #初始化
     def init_db(self):
-        conn = sqlite3.connect('memory/user_profiles.db')
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS T_Member
-            (id INTEGER PRIMARY KEY     autoincrement,
-            username        TEXT    NOT NULL UNIQUE);''')
-        conn.commit()
-        conn.close()
+        with self.pool.write() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS T_Member
+                (id INTEGER PRIMARY KEY     autoincrement,
+                username        TEXT    NOT NULL UNIQUE);''')
        
     # 添加新用户
     @synchronized
     def add_user(self, username):
         if self.is_username_exist(username) == "notexists":
-            conn = sqlite3.connect('memory/user_profiles.db')
-            c = conn.cursor()
-            c.execute('INSERT INTO T_Member (username) VALUES (?)', (username,))
-            conn.commit()
-            conn.close()
+            with self.pool.write() as conn:
+                conn.execute('INSERT INTO T_Member (username) VALUES (?)', (username,))
             return "success"
         else:
            return f"Username '{username}' already exists."
@@ -52,11 +51,8 @@ class Member_Db:
     @synchronized
     def update_user(self, username, new_username):
         if self.is_username_exist(new_username) == "notexists":
-            conn = sqlite3.connect('memory/user_profiles.db')
-            c = conn.cursor()
-            c.execute('UPDATE T_Member SET username = ? WHERE username = ?', (new_username, username))
-            conn.commit()
-            conn.close()
+            with self.pool.write() as conn:
+                conn.execute('UPDATE T_Member SET username = ? WHERE username = ?', (new_username, username))
             return "success"
         else:
             return f"Username '{new_username}' already exists."
@@ -64,20 +60,14 @@ class Member_Db:
     # 删除用户
     @synchronized
     def delete_user(self, username):
-        conn = sqlite3.connect('memory/user_profiles.db')
-        c = conn.cursor()
-        c.execute('DELETE FROM T_Member WHERE username = ?', (username,))
-        conn.commit()
-        conn.close()
+        with self.pool.write() as conn:
+            conn.execute('DELETE FROM T_Member WHERE username = ?', (username,))
         return "success"
 
     # 检查用户名是否已存在
     def is_username_exist(self, username):
-        conn = sqlite3.connect('memory/user_profiles.db')
-        c = conn.cursor()
-        c.execute('SELECT COUNT(*) FROM T_Member WHERE username = ?', (username,))
-        result = c.fetchone()[0]
-        conn.close()
+        with self.pool.connection() as conn:
+            result = conn.execute('SELECT COUNT(*) FROM T_Member WHERE username = ?', (username,)).fetchone()[0]
         if result > 0:
             return "exists"
         else:
@@ -85,11 +75,8 @@ class Member_Db:
 
     #根据username查询uid
     def find_user(self, username):
-        conn = sqlite3.connect('memory/user_profiles.db')
-        c = conn.cursor()
-        c.execute('SELECT * FROM T_Member WHERE username = ?', (username,))
-        result = c.fetchone()
-        conn.close()
+        with self.pool.connection() as conn:
+            result = conn.execute('SELECT * FROM T_Member WHERE username = ?', (username,)).fetchone()
         if result is None:
             return 0
         else:
@@ -97,11 +84,8 @@ class Member_Db:
         
     #根据uid查询username
     def find_username_by_uid(self, uid):
-        conn = sqlite3.connect('memory/user_profiles.db')
-        c = conn.cursor()
-        c.execute('SELECT username FROM T_Member WHERE id = ?', (uid,))
-        result = c.fetchone()
-        conn.close()
+        with self.pool.connection() as conn:
+            result = conn.execute('SELECT username FROM T_Member WHERE id = ?', (uid,)).fetchone()
         if result is None:
             return 0
         else:
@@ -112,33 +96,13 @@ class Member_Db:
     @synchronized
     def query(self, sql):
         try:
-            conn = sqlite3.connect('memory/user_profiles.db')
-            c = conn.cursor()
-            c.execute(sql)
-            results = c.fetchall()
-            conn.commit()
-            conn.close()
-            return results
+            with self.pool.write() as conn:
+                return conn.execute(sql).fetchall()
         except Exception as e:
             return f"执行时发生错误：{str(e)}"
 
 
     # 获取所有用户
-    @synchronized
     def get_all_users(self):
-        conn = sqlite3.connect('memory/user_profiles.db')
-        c = conn.cursor()
-        c.execute('SELECT * FROM T_Member')
-        results = c.fetchall()
-        conn.close()
-        return results
-        
-
-
-
-
-
-   
-
-
-
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT * FROM T_Member').fetchall()
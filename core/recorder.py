@@ -1,11 +1,12 @@
 # 作用是音频录制，对于aliyun asr来说，边录制边stt，但对于其他来说，是先保存成文件再推送给asr模型，通过实现子类的方式（fay_booter.py 上有实现）来管理音频流的来源
-import audioop
 import math
 import time
 import threading
 from abc import abstractmethod
 from queue import Queue
 
+from asr import ali_nls
+from asr import funasr
 from asr.ali_nls import ALiNls
 from asr.funasr import FunASR
 from core import wsa_server
@@ -17,6 +18,7 @@ import tempfile
 import wave
 from core import fay_core
 from core import interact
+from core.audio_frontend import AudioFrontend, VAD_ENERGY
 
 # 麦克风启动时间 (秒)
 _ATTACK = 0.1
@@ -24,6 +26,9 @@ _ATTACK = 0.1
 # 麦克风释放时间 (秒) - 增加到3秒，给用户更多说话时间
 _RELEASE = 3.0
 
+# 等待ASR识别任务开始的超时（秒）
+ASR_START_TIMEOUT = 5
+
 
 class Recorder:
 
@@ -31,16 +36,15 @@ class Recorder:
         self._fay = fay
         self.__running = True
         self.__processing = False
-        self.__history_level = []
-        self.__history_data = []
-        self.__dynamic_threshold = 0.5  # 声音识别的音量阈值
+        self.__frontend = AudioFrontend()  # 下混、音量与自适应阈值
 
-        self.__MAX_LEVEL = 25000
         self.__MAX_BLOCK = 100
 
         # Edit by xszyou in 20230516:增加本地asr
         self.ASRMode = cfg.ASR_mode
+        self.__warm_up_asr()
         self.__aLiNls = None
+        self.__prefetching = False  # 同一时刻最多一个预取任务
         self.is_awake = False
         self.wakeup_matched = False
         if cfg.config['source']['wake_word_enabled']:
@@ -66,9 +70,7 @@ class Recorder:
             self.current_active_user = username
             if username not in self.user_sessions:
                 self.user_sessions[username] = {
-                    'history_level': [],
-                    'history_data': [],
-                    'dynamic_threshold': 0.5,
+                    'frontend': AudioFrontend(),
                     'is_awake': False,
                     'wakeup_matched': False,
                     'last_speaking_time': time.time(),
@@ -78,18 +80,14 @@ class Recorder:
             self.username = username
             self.is_awake = self.user_sessions[username]['is_awake']
             self.wakeup_matched = self.user_sessions[username]['wakeup_matched']
-            self.__history_level = self.user_sessions[username]['history_level']
-            self.__history_data = self.user_sessions[username]['history_data']
-            self.__dynamic_threshold = self.user_sessions[username]['dynamic_threshold']
+            self.__frontend = self.user_sessions[username]['frontend']
 
     def get_user_session(self, username):
         """获取用户会话，如果不存在则创建"""
         with self.user_lock:
             if username not in self.user_sessions:
                 self.user_sessions[username] = {
-                    'history_level': [],
-                    'history_data': [],
-                    'dynamic_threshold': 0.5,
+                    'frontend': AudioFrontend(),
                     'is_awake': False,
                     'wakeup_matched': False,
                     'last_speaking_time': time.time(),
@@ -110,13 +108,43 @@ class Recorder:
                         elif hasattr(self, key):
                             setattr(self, key, value)
 
+    def __warm_up_asr(self):
+        # 提前建立ASR常驻连接，第一句话不必等待握手
+        try:
+            if self.ASRMode == "ali":
+                ali_nls.get_pool()
+            elif self.ASRMode == "funasr" or self.ASRMode == "sensevoice":
+                funasr.get_pool()
+        except Exception as e:
+            util.log(1, f"ASR连接池初始化失败: {str(e)}")
+
     def asrclient(self):
         if self.ASRMode == "ali":
             asrcli = ALiNls(self.username)
         elif self.ASRMode == "funasr" or self.ASRMode == "sensevoice":
-            asrcli = FunASR(self.username)
+            # SenseVoice服务只支持wav文件路径（url）请求
+            asrcli = FunASR(self.username, pcm=self.ASRMode == "funasr")
+            asrcli.on_stable_text = self.__on_stable_text
         return asrcli
 
+    def __on_stable_text(self, text):
+        # 流式识别的中间结果已稳定：后台提前检索记忆和知识库，最终结果出来后直接复用
+        if self.__prefetching:
+            return
+        self.__prefetching = True
+        username = self.username
+
+        def prefetch():
+            try:
+                from llm import nlp_cognitive_stream
+                nlp_cognitive_stream.prefetch_context(username, text)
+            except Exception as e:
+                util.log(1, f"预取上下文失败: {str(e)}")
+            finally:
+                self.__prefetching = False
+
+        MyThread(target=prefetch).start()
+
     def save_buffer_to_file(self, buffer):
         temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav", dir="cache_data")
         wf = wave.open(temp_file.name, 'wb')
@@ -127,20 +155,6 @@ class Recorder:
         wf.close()
         return temp_file.name
 
-    def __get_history_average(self, number):
-        total = 0
-        num = 0
-        for i in range(len(self.__history_level) - 1, -1, -1):
-            level = self.__history_level[i]
-            total += level
-            num += 1
-            if num >= number:
-                break
-        return total / num
-
-    def __get_history_percentage(self, number):
-        return (self.__get_history_average(number) / self.__MAX_LEVEL) * 1.05 + 0.02
-
     def reset_wakeup_status(self):
         self.wakeup_matched = False
         with fay_core.auto_play_lock:
@@ -151,8 +165,15 @@ class Recorder:
         t = time.time()
         tm = time.time()
         if self.ASRMode == "funasr" or self.ASRMode == "sensevoice":
-            file_url = self.save_buffer_to_file(audio_data)
-            self.__aLiNls.send_url(file_url)
+            if iat.streaming:
+                # 流式识别：音频已边说边发送，只需发送剩余部分并请求最终结果
+                iat.finish_stream()
+            elif iat.pcm:
+                # 音频直接通过连接发送，不再写临时wav文件
+                iat.send_pcm(audio_data.tobytes(), self.sample_rate)
+            else:
+                file_url = self.save_buffer_to_file(audio_data)
+                iat.send_url(file_url)
 
         # return
         # 等待结果返回
@@ -203,7 +224,7 @@ class Recorder:
                             intt = interact.Interact("auto_play", 2,
                                                      {'user': self.username, 'text': "在呢，你说？", "isfirst": True,
                                                       "isend": True})
-                            self.__fay.on_interact(intt)
+                            self._fay.on_interact(intt)
                             self.processing = False
                             self.timer.cancel()  # 取消之前的计时器任务
                             # 新增：唤醒成功后也推送识别文本到主AI
@@ -246,7 +267,8 @@ class Recorder:
                             wsa_server.get_instance().add_cmd(content)
                         # 去除唤醒词后语句
                         question = text  # [len(wake_up_word):].lstrip()
-                        self.__fay.sound_query = Queue()
+                        self._fay.sound_query = Queue()
+                        self._fay.cancel_synthesis(self.username)
                         time.sleep(0.3)
                         self.on_speaking(question)
                         self.processing = False
@@ -269,7 +291,7 @@ class Recorder:
         else:
             self.processing = False
             util.printInfo(1, self.username, "[!] 语音未检测到内容！")
-            self.dynamic_threshold = self.__get_history_percentage(30)
+            self.dynamic_threshold = self.__frontend.history_percentage()
             if wsa_server.get_web_instance().is_connected(self.username):
                 wsa_server.get_web_instance().add_cmd(
                     {"panelMsg": "", 'Username': self.username, 'robot': f'{cfg.fay_url}/robot/Normal.jpg'})
@@ -298,16 +320,13 @@ class Recorder:
         print(f"[Recorder.__record] 进入录音循环，用户: {self.username}")
         while self.__running:
             try:
-                cfg.load_config()
-                record = cfg.config['source']['record']
+                record = cfg.get_snapshot().config['source']['record']
                 if not record['enabled'] and not self.is_remote():
                     time.sleep(1)
                     continue
                 self.is_reading = True
                 data = stream.read(1024, exception_on_overflow=False)
                 self.is_reading = False
-                if data:
-                    print(f"[Recorder.__record] 读取到音频数据: {len(data)} 字节")
             except Exception as e:
                 data = None
                 print(f"[Recorder.__record] 读取音频数据异常: {e}")
@@ -332,28 +351,19 @@ class Recorder:
                 data = None
                 continue
 
-            # 计算音量是否满足激活拾音
-            level = audioop.rms(data, 2)
-            if len(self.__history_data) >= 10:  # 保存激活前的音频，以免信息掉失
-                self.__history_data.pop(0)
-            if len(self.__history_level) >= 500:
-                self.__history_level.pop(0)
-            self.__history_data.append(data)
-            self.__history_level.append(level)
-            percentage = level / self.__MAX_LEVEL
-            history_percentage = self.__get_history_percentage(30)
-            if history_percentage > self.__dynamic_threshold:
-                self.__dynamic_threshold += (history_percentage - self.__dynamic_threshold) * 0.0025
-            elif history_percentage < self.__dynamic_threshold:
-                self.__dynamic_threshold += (history_percentage - self.__dynamic_threshold) * 1
-            
+            # 计算音量是否满足激活拾音（每块只下混一次，单声道数据用于VAD和发送）
+            frontend = self.__frontend
+            frontend.vad_mode = record.get('vad_mode', VAD_ENERGY)
+            mono, percentage = frontend.process(data, self.channels)
+            is_voice = frontend.is_voice(mono, percentage)
+
             # 添加VAD调试日志
-            if percentage > self.__dynamic_threshold:
-                print(f"[Recorder.__record] VAD检测到声音: percentage={percentage:.3f}, threshold={self.__dynamic_threshold:.3f}")
+            if is_voice:
+                print(f"[Recorder.__record] VAD检测到声音: percentage={percentage:.3f}, threshold={frontend.dynamic_threshold:.3f}")
 
             # 用户正在说话，激活拾音
             try:
-                if percentage > self.__dynamic_threshold:
+                if is_voice:
                     last_speaking_time = time.time()
                     last_voice_time = time.time()  # 更新最后有声音的时间
 
@@ -369,17 +379,14 @@ class Recorder:
                         concatenated_audio.clear()
                         self.__aLiNls = self.asrclient()
                         task_id = self.__aLiNls.start()
-                        while not self.__aLiNls.started:
-                            time.sleep(0.01)
+                        self.__aLiNls.wait_started(ASR_START_TIMEOUT)
                         print(f"[Recorder.__record] ASR已启动，task_id: {task_id}")
-                        for i in range(len(self.__history_data) - 1):  # 当前data在下面会做发送，这里是发送激活前的音频数据，以免漏掉信息
-                            buf = self.__history_data[i]
-                            audio_data_list.append(self.__process_audio_data(buf, self.channels))
-                            if self.ASRMode == "ali":
-                                self.__aLiNls.send(self.__process_audio_data(buf, self.channels).tobytes())
-                            else:
-                                concatenated_audio.extend(self.__process_audio_data(buf, self.channels).tobytes())
-                        self.__history_data.clear()
+                        for buf in frontend.take_history():  # 当前data在下面会做发送，这里是发送激活前的音频数据，以免漏掉信息
+                            audio_data_list.append(buf)
+                            # funasr非流式识别时send不发送，整句话结束后一次发送
+                            self.__aLiNls.send(buf.tobytes())
+                            if self.ASRMode != "ali":
+                                concatenated_audio.extend(buf.tobytes())
                         print(f"[Recorder.__record] 历史音频数据已发送，清空历史数据")
                     else:
                         print(f"[Recorder.__record] 不满足进入聆听状态条件: processing={self.__processing}, isSpeaking={isSpeaking}, time_since_mute={time_since_mute:.3f}秒")
@@ -404,7 +411,9 @@ class Recorder:
                         if should_end:
                             print(f"[Recorder.__record] 准备结束ASR，用户: {self.username}")
                             isSpeaking = False
-                            self.__aLiNls.end()
+                            if self.ASRMode == "ali":
+                                # FunASR的end()表示放弃这句话，结束时由__waitingResult发送音频
+                                self.__aLiNls.end()
                             util.printInfo(1, self.username, "语音处理中...")
 
                             mono_data = self.__concatenate_audio_data(audio_data_list)
@@ -414,11 +423,10 @@ class Recorder:
 
                 # 拾音中
                 if isSpeaking:
-                    audio_data_list.append(self.__process_audio_data(data, self.channels))
-                    if self.ASRMode == "ali":
-                        self.__aLiNls.send(self.__process_audio_data(data, self.channels).tobytes())
-                    else:
-                        concatenated_audio.extend(self.__process_audio_data(data, self.channels).tobytes())
+                    audio_data_list.append(mono)
+                    self.__aLiNls.send(mono.tobytes())
+                    if self.ASRMode != "ali":
+                        concatenated_audio.extend(mono.tobytes())
                         
                     # 检查关键字自动结束
                     if self.ASRMode == "ali" and self.__aLiNls and hasattr(self.__aLiNls, 'get_result'):
@@ -439,6 +447,10 @@ class Recorder:
             except Exception as e:
                 util.printInfo(1, self.username, "录音失败: " + str(e))
 
+        if isSpeaking and self.__aLiNls is not None:
+            # 停止录音时这句话尚未结束，放弃识别请求
+            self.__aLiNls.end()
+
     # 异步发送 WebSocket 通知
     def __notify_listening_status(self):
         current_time = time.time()
@@ -491,17 +503,6 @@ class Recorder:
         data = np.concatenate(audio_data_list)
         return data
 
-    # 转变为单声道np.int16
-    def __process_audio_data(self, data, channels):
-        data = bytearray(data)
-        # 将字节数据转换为 numpy 数组
-        data = np.frombuffer(data, dtype=np.int16)
-        # 重塑数组，将数据分离成多个声道
-        data = np.reshape(data, (-1, channels))
-        # 对所有声道的数据进行平均，生成单声道
-        mono_data = np.mean(data, axis=1).astype(np.int16)
-        return mono_data
-
     def set_processing(self, processing):
         self.__processing = processing
 
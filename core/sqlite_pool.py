@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from queue import Queue, Empty, Full
+
+# 连接池中保留的空闲连接数上限，超出的连接用完即关闭
+MAX_IDLE_CONNECTIONS = 8
+# 每个连接缓存的预编译语句数
+CACHED_STATEMENTS = 256
+# 等待写锁/数据库忙时的超时（秒）
+BUSY_TIMEOUT = 30
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # 读写互不阻塞
+    "PRAGMA synchronous=NORMAL",    # WAL模式下NORMAL即可保证一致性
+    "PRAGMA cache_size=-8000",      # 约8MB页缓存
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT * 1000}",
+)
+
+
+class SQLitePool:
+    """
+    SQLite连接池
+
+    连接复用而不是每条语句都重新打开，连接上的预编译语句缓存也随之复用。
+    数据库使用WAL模式，读操作直接从池中取连接并发执行；写操作额外持有一把写锁，
+    保证同一时刻只有一个写事务（SQLite本身也只允许单写）。
+    """
+
+    def __init__(self, db_path, max_idle=MAX_IDLE_CONNECTIONS):
+        self.db_path = db_path
+        self._idle = Queue(maxsize=max_idle)
+        self._write_lock = threading.RLock()
+
+    def _connect(self):
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                               cached_statements=CACHED_STATEMENTS)
+        conn.text_factory = str
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            return self._connect()
+
+    def _release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # 回滚失败的连接不再放回连接池
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        取一个连接用于读，用完归还连接池
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def write(self):
+        """
+        取一个连接用于写：持有写锁，正常结束时提交，异常时回滚
+        """
+        with self._write_lock:
+            conn = self._acquire()
+            try:
+                yield conn
+                conn.commit()
+            finally:
+                self._release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                break
+
+
+__pools = {}
+__pools_lock = threading.Lock()
+
+
+def get_pool(db_path):
+    """
+    获取数据库文件对应的连接池（同一文件共用一个连接池）
+    """
+    key = os.path.abspath(db_path)
+    with __pools_lock:
+        pool = __pools.get(key)
+        if pool is None:
+            pool = SQLitePool(db_path)
+            __pools[key] = pool
+        return pool
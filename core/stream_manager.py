@@ -1,5 +1,6 @@
 import threading
 import time
+from queue import Queue, Empty
 from utils import stream_sentence
 from scheduler.thread_manager import MyThread
 import fay_booter
@@ -11,6 +12,15 @@ __streams = None
 # 线程锁，用于保护全局变量的访问
 __streams_lock = threading.Lock()
 
+# 处理所有用户文本流的工作线程数
+DISPATCH_WORKERS = 8
+# 工作线程每次为同一用户连续处理的最大句子数，处理完仍有句子则重新排队，避免单个用户占满线程
+SENTENCES_PER_TURN = 16
+# 用户文本流空闲超过该时间（秒）后回收
+STREAM_IDLE_TTL = 600
+# 检查空闲文本流的间隔（秒）
+EVICT_INTERVAL = 60
+
 def new_instance(max_sentences=1024):
     """
     创建并返回StreamManager的单例实例
@@ -35,36 +45,46 @@ class StreamManager:
         if hasattr(self, '_initialized') and self._initialized:
             return
         self.lock = threading.Lock()  # 线程锁，用于保护streams字典的访问
-        self.streams = {}  # 存储用户ID到句子缓存的映射
-        self.nlp_streams = {}  # 存储用户ID到句子缓存的映射
+        self.caches = {}  # 存储用户ID到句子缓存的映射（TTS与NLP两个消费者共用一个缓存）
+        self.streams = {}  # 存储用户ID到TTS消费者的映射
+        self.nlp_streams = {}  # 存储用户ID到NLP消费者的映射
         self.max_sentences = max_sentences  # 最大句子缓存数量
-        self.listener_threads = {}  # 存储用户ID到监听线程的映射
-        self.running = True  # 控制监听线程的运行状态
+        self.last_active = {}  # 存储用户ID到最后活动时间的映射，用于回收空闲的流
+        self.ready_queue = Queue()  # 有待处理句子的用户ID队列
+        self.scheduled = set()  # 已在队列中或正在被处理的用户ID，保证同一用户的句子按顺序由一个线程处理
+        self.workers = []  # 工作线程
+        self.last_evict_time = time.time()
+        self.running = True  # 控制工作线程的运行状态
         self._initialized = True  # 标记是否已初始化
         self.msgid = ""  # 消息ID
 
+    def _ensure_workers(self):
+        # 注意：需在已获得锁的情况下调用
+        if self.workers:
+            return
+        for i in range(DISPATCH_WORKERS):
+            thread = MyThread(target=self.dispatch, name=f"StreamDispatcher-{i}", daemon=True)
+            self.workers.append(thread)
+            thread.start()
+
     def get_Stream(self, username):
         """
         获取指定用户ID的文本流，如果不存在则创建新的（线程安全）
         :param username: 用户名
-        :return: 对应的句子缓存对象
+        :return: (TTS消费者, NLP消费者)，两者读取同一个句子缓存
         """
         # 注意：这个方法应该在已经获得锁的情况下调用
         # 如果从外部调用，需要先获得锁
 
-        if username not in self.streams or username not in self.nlp_streams:
-            # 创建新的流缓存
-            self.streams[username] = stream_sentence.SentenceCache(self.max_sentences)
-            self.nlp_streams[username] = stream_sentence.SentenceCache(self.max_sentences)
-
-            # 启动监听线程（如果还没有）
-            if username not in self.listener_threads:
-                stream = self.streams[username]
-                nlp_stream = self.nlp_streams[username]
-                thread = MyThread(target=self.listen, args=(username, stream, nlp_stream), daemon=True)
-                self.listener_threads[username] = thread
-                thread.start()
+        if username not in self.caches:
+            # 创建新的流缓存：TTS使用缓存的默认消费者，NLP另外订阅一个读取位置
+            cache = stream_sentence.SentenceCache(self.max_sentences)
+            self.caches[username] = cache
+            self.streams[username] = cache.default_reader
+            self.nlp_streams[username] = cache.subscribe("nlp")
+            self._ensure_workers()
 
+        self.last_active[username] = time.time()
         return self.streams[username], self.nlp_streams[username]
 
     def write_sentence(self, username, sentence):
@@ -84,10 +104,13 @@ class StreamManager:
         # 使用锁保护获取和写入操作
         with self.lock:
             try:
-                Stream, nlp_Stream = self.get_Stream(username)
-                success = Stream.write(sentence)
-                nlp_success = nlp_Stream.write(sentence)
-                return success and nlp_success
+                self.get_Stream(username)
+                success = self.caches[username].write(sentence)
+                # 用户不在队列中时加入队列，由空闲的工作线程处理
+                if username not in self.scheduled:
+                    self.scheduled.add(username)
+                    self.ready_queue.put(username)
+                return success
             except Exception as e:
                 print(f"写入句子时出错: {e}")
                 return False
@@ -98,18 +121,63 @@ class StreamManager:
         :param username: 用户名
         """
         with self.lock:
-            if username in self.streams:
-                self.streams[username].clear()
-            if username in self.nlp_streams:
-                self.nlp_streams[username].clear()
+            if username in self.caches:
+                self.caches[username].clear()
 
-    def listen(self, username, stream, nlp_stream):
+    def dispatch(self):
+        """
+        工作线程：从队列中取出有待处理句子的用户，按顺序处理该用户的句子
+        """
         while self.running:
-            sentence = stream.read()
-            if sentence:
-                self.execute(username, sentence)
-            else:
-                time.sleep(0.1)
+            try:
+                username = self.ready_queue.get(timeout=EVICT_INTERVAL)
+            except Empty:
+                self.evict_idle_streams()
+                continue
+
+            with self.lock:
+                stream = self.streams.get(username)
+            if stream is not None:
+                for _ in range(SENTENCES_PER_TURN):
+                    sentence = stream.read()
+                    if sentence is None:
+                        break
+                    try:
+                        self.execute(username, sentence)
+                    except Exception as e:
+                        print(f"处理句子时出错: {e}")
+
+            with self.lock:
+                # 写入方在持有锁时写入并检查scheduled，这里在锁内判断是否还有句子不会漏掉新写入的句子
+                if stream is not None and self.streams.get(username) is stream and stream.pending() > 0:
+                    self.ready_queue.put(username)
+                else:
+                    self.scheduled.discard(username)
+                if stream is not None:
+                    self.last_active[username] = time.time()
+
+            if time.time() - self.last_evict_time >= EVICT_INTERVAL:
+                self.evict_idle_streams()
+
+    def evict_idle_streams(self, ttl=STREAM_IDLE_TTL):
+        """
+        回收空闲超过ttl秒、没有待处理句子且没有读取方在等待的用户文本流
+        """
+        now = time.time()
+        with self.lock:
+            self.last_evict_time = now
+            for username, last_active in list(self.last_active.items()):
+                cache = self.caches.get(username)
+                if now - last_active < ttl or username in self.scheduled:
+                    continue
+                if cache is not None and cache.waiting > 0:
+                    continue
+                self.last_active.pop(username, None)
+                self.streams.pop(username, None)
+                self.nlp_streams.pop(username, None)
+                cache = self.caches.pop(username, None)
+                if cache is not None:
+                    cache.close()
 
     def execute(self, username, sentence):
         """
@@ -125,5 +193,4 @@ class StreamManager:
 
         if sentence or is_first or is_end :
             interact = Interact("stream", 1, {"user": username, "msg": sentence, "isfirst" : is_first, "isend" : is_end})
-            fay_core.say(interact, sentence)  # 调用核心处理模块进行响应
-        time.sleep(0.01)  # 短暂休眠以控制处理频率
\ No newline at end of file
+            fay_core.say(interact, sentence)  # 调用核心处理模块进行响应
\ No newline at end of file
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from queue import Queue, Empty
+
+from scheduler.thread_manager import MyThread
+from utils import util
+
+# 同时进行的TTS合成数（所有用户共用），也就是每条回复最多提前合成的句子数
+SYNTHESIS_WORKERS = 3
+# 交付合成结果的工作线程数（所有用户共用），交付包括口型生成、发送和句末等待
+DELIVERY_WORKERS = 8
+# 用户交付队列空闲超过该时间（秒）后回收
+PIPELINE_IDLE_TTL = 600
+# 检查空闲交付队列的间隔（秒）
+EVICT_INTERVAL = 60
+
+
+class _UserPipeline:
+    def __init__(self, username):
+        self.username = username
+        self.lock = threading.Lock()
+        self.jobs = deque()  # (generation, future, deliver)，按提交顺序排列
+        self.generation = 0
+        self.scheduled = False  # 已在交付队列中或正在被交付，保证同一用户的句子由一个线程按顺序交付
+        self.last_active = time.time()
+
+    def head_ready(self):
+        # 调用方需持有self.lock
+        return bool(self.jobs) and self.jobs[0][1].done()
+
+
+class SynthesisScheduler:
+    """
+    TTS预合成调度器
+
+    句子一到就提交到有界线程池合成，后面的句子不必等前一句合成完；
+    用户队首的句子合成完成后，该用户进入交付队列，由固定数量的交付线程按提交顺序逐个交给deliver回调，
+    同一用户的音频顺序不会乱，交付（口型生成、发送、等待）也不占用合成线程。
+    cancel会丢弃该用户尚未交付的全部句子（未开始的合成直接取消，进行中的合成结果被丢弃）。
+    """
+
+    def __init__(self, max_workers=SYNTHESIS_WORKERS, delivery_workers=DELIVERY_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="TTS")
+        self.lock = threading.Lock()
+        self.pipelines = {}
+        self.ready_queue = Queue()  # 队首句子已合成完成、等待交付的用户
+        self.delivery_workers = delivery_workers
+        self.workers = []
+        self.last_evict_time = time.time()
+        self.running = True
+
+    def __pipeline(self, username):
+        with self.lock:
+            pipeline = self.pipelines.get(username)
+            if pipeline is None:
+                pipeline = _UserPipeline(username)
+                self.pipelines[username] = pipeline
+            if not self.workers:
+                for i in range(self.delivery_workers):
+                    thread = MyThread(target=self.__deliver_loop, name=f"TTSDelivery-{i}", daemon=True)
+                    self.workers.append(thread)
+                    thread.start()
+            pipeline.last_active = time.time()
+            return pipeline
+
+    def submit(self, username, synthesize, deliver):
+        """
+        提交一句话
+        :param username: 用户名
+        :param synthesize: 合成函数，返回音频文件路径（或None）
+        :param deliver: 交付回调deliver(result)，按提交顺序调用
+        :return: 合成结果的Future
+        """
+        pipeline = self.__pipeline(username)
+        future = self.executor.submit(synthesize)
+        with pipeline.lock:
+            pipeline.jobs.append((pipeline.generation, future, deliver))
+        # 完成回调只负责把用户放入交付队列，合成线程马上可以处理下一句
+        future.add_done_callback(lambda _: self.__schedule(pipeline))
+        return future
+
+    def cancel(self, username):
+        """
+        取消该用户所有尚未交付的句子
+        """
+        pipeline = self.__pipeline(username)
+        with pipeline.lock:
+            pipeline.generation += 1
+            futures = [future for _, future, _ in pipeline.jobs]
+            pipeline.jobs.clear()
+        # cancel会同步触发完成回调（__schedule需要pipeline.lock），因此在锁外调用
+        for future in futures:
+            future.cancel()
+
+    def __schedule(self, pipeline):
+        with pipeline.lock:
+            if pipeline.scheduled or not pipeline.head_ready():
+                return
+            pipeline.scheduled = True
+        self.ready_queue.put(pipeline)
+
+    def __deliver_loop(self):
+        while self.running:
+            try:
+                pipeline = self.ready_queue.get(timeout=EVICT_INTERVAL)
+            except Empty:
+                self.evict_idle_pipelines()
+                continue
+            self.__deliver(pipeline)
+            if time.time() - self.last_evict_time >= EVICT_INTERVAL:
+                self.evict_idle_pipelines()
+
+    def __deliver(self, pipeline):
+        # 交付该用户所有已合成完成的队首句子，交付顺序即提交顺序
+        while True:
+            with pipeline.lock:
+                if not pipeline.head_ready():
+                    # 在锁内清除scheduled：之后完成的合成会由完成回调重新排队，不会漏掉
+                    pipeline.scheduled = False
+                    pipeline.last_active = time.time()
+                    return
+                generation, future, deliver = pipeline.jobs.popleft()
+                if generation != pipeline.generation:
+                    continue
+            try:
+                result = future.result()
+            except CancelledError:
+                continue
+            except Exception as e:
+                util.log(1, f"TTS合成异常: {str(e)}")
+                result = None
+            try:
+                deliver(result)
+            except Exception as e:
+                util.log(1, f"TTS结果处理异常: {str(e)}")
+
+    def evict_idle_pipelines(self, ttl=PIPELINE_IDLE_TTL):
+        """
+        回收空闲超过ttl秒、没有待交付句子的用户交付队列
+        """
+        now = time.time()
+        with self.lock:
+            self.last_evict_time = now
+            for username, pipeline in list(self.pipelines.items()):
+                with pipeline.lock:
+                    if pipeline.jobs or pipeline.scheduled or now - pipeline.last_active < ttl:
+                        continue
+                del self.pipelines[username]
+
+    def shutdown(self):
+        self.running = False
+        self.executor.shutdown(wait=False, cancel_futures=True)
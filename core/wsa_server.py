@@ -8,19 +8,31 @@ from abc import abstractmethod
 from websockets.legacy.server import Serve
 import time  # 添加此行导入time模块
 import traceback  # 新增导入
+from collections import deque
 
 from utils import util
 from scheduler.thread_manager import MyThread
 from core.interview_manager import InterviewManager
 interview_mgr = InterviewManager()
 
+# 每个连接的待发送队列长度，慢消费者队列满时丢弃最旧的消息
+CLIENT_QUEUE_SIZE = 1024
+# 没有任何连接时暂存的消息数，第一个连接上来时补发
+BACKLOG_SIZE = 256
+# 单条消息发送超时（秒）
+SEND_TIMEOUT = 3
+# 音频帧率统计窗口（秒）
+AUDIO_RATE_WINDOW = 1.0
+
 class MyServer:
     def __init__(self, host='0.0.0.0', port=10000):
         self.lock = asyncio.Lock()
         self.__host = host  # ip
         self.__port = port  # 端口号
-        self.__listCmd = []  # 要发送的信息的列表
+        self.__backlog = deque(maxlen=BACKLOG_SIZE)  # 没有连接时暂存的消息
         self.__clients = list()
+        self.__user_clients = {}  # 用户名 -> 该用户的连接列表，定向发送时只遍历目标连接
+        self.dropped = 0  # 因慢消费者队列满而丢弃的消息数
         self.__server: Serve = None
         self.__event_loop: AbstractEventLoop = None
         self.__running = True
@@ -30,7 +42,7 @@ class MyServer:
         self.__tasks = {}  # 记录任务和开始时间的字典
 
     # 接收处理
-    async def __consumer_handler(self, websocket, path):
+    async def __consumer_handler(self, websocket, path, client):
         print(f"[Fay][consumer_handler] 等待消息... 端口={self.__port}")
         username = None
         interview_questions = None  # 新增：面试题
@@ -40,21 +52,20 @@ class MyServer:
         connection_username = None
         try:
             print(f"[Fay][consumer_handler] 进入消息循环，准备接收消息... 端口={self.__port}")
+            unique_id = client["id"]
+            # 逐条同步处理：处理跟不上时不再从连接读取，由websockets的接收队列和TCP窗口向客户端施加背压
             async for message in websocket:
                 # print(f"[Fay][consumer_handler] 收到消息原文: {repr(message)} (type={type(message)})")
-                await asyncio.sleep(0.01)
-                remote_address = websocket.remote_address
-                unique_id = f"{remote_address[0]}:{remote_address[1]}"
                 # 新增：每条消息原样打印
                 # print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] 收到消息原文: {repr(message)} (from {unique_id})")
                 # 1. 区分二进制和文本消息
                 if isinstance(message, bytes):
-                    # 处理音频流
+                    # 音频流快速通道：不解析、不等待，直接写入音频缓冲区
                     if first_message:
                         print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] 首条消息为二进制音频流，跳过greet解析 (from {unique_id})")
-                    # 不再打印原文，避免控制台乱码
-                    await self.__consumer(message, connection_username)
-                    first_message = False
+                        first_message = False
+                    self.__count_audio_frame(client, len(message))
+                    self.on_audio_frame(message, connection_username)
                     continue
                 # 2. 处理文本消息
                 try:
@@ -131,7 +142,7 @@ class MyServer:
                             for i in range(len(self.__clients)):
                                 if self.__clients[i]["id"] == unique_id:
                                     old_username = self.__clients[i]["username"]
-                                    self.__clients[i]["username"] = username or old_username
+                                    self.__set_client_username(self.__clients[i], username or old_username)
                                     print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] greet同步: 用户名 {old_username} -> {self.__clients[i]['username']}")
                         # 跳过后续的__consumer调用，避免重复处理
                         continue
@@ -195,8 +206,32 @@ class MyServer:
             print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] WebSocket连接断开(未知异常): {unique_id_safe}, 用户名: {username}, 原因: {e}")
             util.printInfo(1, "User" if username is None else username, f"WebSocket 连接关闭(未知异常): {e}")
 
+    def __count_audio_frame(self, client, length):
+        client["audio_frames"] += 1
+        client["audio_bytes"] += length
+        client["window_frames"] += 1
+        now = time.time()
+        elapsed = now - client["window_start"]
+        if elapsed >= AUDIO_RATE_WINDOW:
+            client["audio_fps"] = client["window_frames"] / elapsed
+            client["window_frames"] = 0
+            client["window_start"] = now
+
+    def get_audio_stats(self):
+        """
+        各连接的音频帧统计
+        :return: [{id, username, frames, bytes, fps}]
+        """
+        return [{
+            "id": c["id"],
+            "username": c["username"],
+            "frames": c["audio_frames"],
+            "bytes": c["audio_bytes"],
+            "fps": c["audio_fps"]
+        } for c in list(self.__clients)]
+
     def get_client_output(self, username):
-        clients_with_username = [c for c in self.__clients if c.get("username") == username]
+        clients_with_username = self.__user_clients.get(username, [])
         if not clients_with_username:
             return False
         for client in clients_with_username:
@@ -205,32 +240,13 @@ class MyServer:
                 return True
         return False
 
-    # 发送处理
-    async def __producer_handler(self, websocket, path):
+    # 发送处理：等待该连接自己的队列，有消息才唤醒
+    async def __producer_handler(self, websocket, client):
+        queue = client["queue"]
         try:
             while self.__running:
-                await asyncio.sleep(0.01)
-                if len(self.__listCmd) > 0:
-                    message = await self.__producer()
-                    if message:
-                        try:
-                            username = json.loads(message).get("Username")
-                            if username is None:
-                                # 群发消息
-                                async with self.lock:
-                                    wsclients = [c["websocket"] for c in self.__clients]
-                                tasks = [self.send_message_with_timeout(client, message, username, timeout=3) for client in wsclients]
-                                await asyncio.gather(*tasks)
-                            else:
-                                # 向指定用户发送消息
-                                async with self.lock:
-                                    target_clients = [c["websocket"] for c in self.__clients if c.get("username") == username]
-                                tasks = [self.send_message_with_timeout(client, message, username, timeout=3) for client in target_clients]
-                                await asyncio.gather(*tasks)
-                        except json.JSONDecodeError as e:
-                            print(f"[Fay][producer] JSON解析失败: {e}, message: {message}")
-                        except Exception as e:
-                            print(f"[Fay][producer] 发送消息异常: {e}")
+                message = await queue.get()
+                await self.send_message_with_timeout(websocket, message, client["username"], timeout=SEND_TIMEOUT)
         except Exception as e:
             print(f"[Fay][producer] producer_handler异常: {e}")
             # 不要在这里调用 remove_client，让 consumer_handler 处理连接断开
@@ -264,13 +280,22 @@ class MyServer:
         # 修改现有连接日志为详细格式
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}][系统] 远程音频输入输出设备连接上: {unique_id}, 端口={self.__port}")
         util.log(1,"websocket连接上:{}".format(self.__port))
-        self.on_connect_handler()
-        remote_address = websocket.remote_address
-        unique_id = f"{remote_address[0]}:{remote_address[1]}"
+        client = {"id" : unique_id, "websocket" : websocket, "username" : "User",
+                  "queue" : asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE), "dropped" : 0,
+                  "audio_frames" : 0, "audio_bytes" : 0, "audio_fps" : 0.0,
+                  "window_frames" : 0, "window_start" : time.time()}
         async with self.lock:
-            self.__clients.append({"id" : unique_id, "websocket" : websocket, "username" : "User"})
-        consumer_task = asyncio.create_task(self.__consumer_handler(websocket, path))#接收
-        producer_task = asyncio.create_task(self.__producer_handler(websocket, path))#发送
+            self.__clients.append(client)
+            self.__index_client(client)
+        # 补发没有连接时暂存的消息
+        backlog = list(self.__backlog)
+        self.__backlog.clear()
+        for content in backlog:
+            self.__dispatch(content)
+        # 先登记连接再回调，连接回调中发送的消息能送达当前连接
+        self.on_connect_handler()
+        consumer_task = asyncio.create_task(self.__consumer_handler(websocket, path, client))#接收
+        producer_task = asyncio.create_task(self.__producer_handler(websocket, client))#发送
         done, self.__pending = await asyncio.wait([consumer_task, producer_task], return_when=asyncio.FIRST_COMPLETED)
 
         for task in self.__pending:
@@ -287,16 +312,60 @@ class MyServer:
     async def __consumer(self, message, connection_username=None):
         self.on_revice_handler(message, connection_username)
 
-    async def __producer(self):
-        if len(self.__listCmd) > 0:
-            message = self.on_send_handler(self.__listCmd.pop(0))
-            return message
+    def __index_client(self, client):
+        self.__user_clients.setdefault(client["username"], []).append(client)
+
+    def __unindex_client(self, client):
+        clients = self.__user_clients.get(client["username"])
+        if clients is None:
+            return
+        if client in clients:
+            clients.remove(client)
+        if not clients:
+            del self.__user_clients[client["username"]]
+
+    def __set_client_username(self, client, username):
+        if client["username"] == username:
+            return
+        self.__unindex_client(client)
+        client["username"] = username
+        self.__index_client(client)
+
+    def __enqueue(self, client, message):
+        queue = client["queue"]
+        # 慢消费者：队列满时丢弃最旧的消息，不阻塞其他连接
+        while queue.full():
+            queue.get_nowait()
+            client["dropped"] += 1
+            self.dropped += 1
+            if client["dropped"] % 100 == 1:
+                util.log(1, f"websocket发送队列已满，丢弃旧消息: {client['id']}，累计丢弃{client['dropped']}条")
+        queue.put_nowait(message)
+
+    def __dispatch(self, content):
+        # 在事件循环线程中执行：序列化一次，只投递到目标连接的队列
+        if not self.__clients:
+            self.__backlog.append(content)
+            return
+        message = self.on_send_handler(json.dumps(content))
+        if not message:
+            return
+        username = content.get("Username") if isinstance(content, dict) else None
+        if username is None:
+            # 群发消息
+            targets = self.__clients
         else:
-            return None
+            # 向指定用户发送消息
+            targets = self.__user_clients.get(username, [])
+        for client in list(targets):
+            self.__enqueue(client, message)
 
     async def remove_client(self, websocket):
         async with self.lock:
+            removed = [c for c in self.__clients if c["websocket"] == websocket]
             self.__clients = [c for c in self.__clients if c["websocket"] != websocket]
+            for client in removed:
+                self.__unindex_client(client)
             if len(self.__clients) == 0:
                 self.isConnect = False
         # 新增详细日志（移除堆栈跟踪）
@@ -306,12 +375,7 @@ class MyServer:
     def is_connected(self, username):
         if username is None:
             username = "User"
-        if len(self.__clients) == 0:
-            return False
-        clients = [c for c in self.__clients if c["username"] == username]
-        if len(clients) > 0:
-            return True
-        return False
+        return len(self.__user_clients.get(username, [])) > 0
 
 
     #Edit by xszyou on 20230113:通过继承此类来实现服务端的接收后处理逻辑
@@ -336,6 +400,10 @@ class MyServer:
             print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] 收到文本消息: {message}")
         # 保持原有逻辑不变
 
+    # 二进制音频帧的处理入口，在事件循环线程中同步调用，子类可重写为直接写入音频缓冲区
+    def on_audio_frame(self, frame, connection_username=None):
+        self.on_revice_handler(frame, connection_username)
+
     #Edit by xszyou on 20230114:通过继承此类来实现服务端的连接处理逻辑
     @abstractmethod
     def on_connect_handler(self):
@@ -363,12 +431,27 @@ class MyServer:
         asyncio.get_event_loop().run_until_complete(self.__server)
         asyncio.get_event_loop().run_forever()
 
-    # 往要发送的命令列表中，添加命令
+    # 添加要发送的命令，可在任意线程调用；序列化和投递都在事件循环线程中进行
     def add_cmd(self, content):
         if not self.__running:
             return
-        jsonStr = json.dumps(content)
-        self.__listCmd.append(jsonStr)
+        loop = self.__event_loop
+        if loop is None:
+            # 服务尚未启动
+            self.__backlog.append(content)
+            return
+        try:
+            in_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self.__dispatch(content)
+        else:
+            try:
+                loop.call_soon_threadsafe(self.__dispatch, content)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
         # util.log('命令 {}'.format(content))
 
     # 开启服务
@@ -384,6 +467,7 @@ class MyServer:
         self.__server.close()
         self.__server = None
         self.__clients = []
+        self.__user_clients = {}
         util.log(1, "WebSocket server stopped.")
 
 
@@ -391,49 +475,45 @@ class MyServer:
 class WebServer(MyServer):
     def __init__(self, host='0.0.0.0', port=10003):
         super().__init__(host, port)
+        self.__waiting_fay_logged = False
 
     def on_revice_handler(self, message, connection_username=None):
         # 处理音频流
         if isinstance(message, bytes):
-            # 将音频流转发给WebSocketAudioListener处理
-            try:
-                import fay_booter
-                # 使用连接特定的用户名
-                username = connection_username
-                
-                # 确保WebSocketAudioListener单例存在
-                if fay_booter.websocket_audio_listener is None:
-                    # 确保feiFei已经初始化
-                    if fay_booter.feiFei is None:
-                        print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] feiFei未初始化，等待初始化完成...")
-                        # 等待feiFei初始化
-                        while fay_booter.feiFei is None:
-                            time.sleep(0.1)
-                        print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] feiFei初始化完成")
-                    
-                    fay_booter.websocket_audio_listener = fay_booter.WebSocketAudioListener(fay_booter.feiFei)
-                    print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] 创建WebSocketAudioListener单例")
-                    # 确保录音线程启动
-                    fay_booter.websocket_audio_listener.start()
-                    print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] WebSocketAudioListener录音线程已启动")
-                
-                if username:
-                    # 确保当前用户是活跃用户
-                    fay_booter.websocket_audio_listener.set_active_user(username)
-                    fay_booter.websocket_audio_listener.write_audio_data(message)
-                else:
-                    # 如果connection_username为None，使用默认用户名
-                    default_username = "User"
-                    print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] connection_username为None，使用默认用户名: {default_username}")
-                    
-                    # 确保当前用户是活跃用户
-                    fay_booter.websocket_audio_listener.set_active_user(default_username)
-                    fay_booter.websocket_audio_listener.write_audio_data(message)
-            except Exception as e:
-                print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] 转发音频流失败: {e}")
+            self.on_audio_frame(message, connection_username)
         else:
             print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] WebServer收到文本消息: {message}")
 
+    def __get_audio_listener(self):
+        # 获取WebSocketAudioListener单例；数字人尚未初始化时返回None（不在事件循环线程中等待）
+        import fay_booter
+        if fay_booter.websocket_audio_listener is None:
+            if fay_booter.feiFei is None:
+                if not self.__waiting_fay_logged:
+                    print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] feiFei未初始化，丢弃音频帧直到初始化完成")
+                    self.__waiting_fay_logged = True
+                return None
+            fay_booter.websocket_audio_listener = fay_booter.WebSocketAudioListener(fay_booter.feiFei)
+            print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] 创建WebSocketAudioListener单例")
+            # 确保录音线程启动
+            fay_booter.websocket_audio_listener.start()
+            print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] WebSocketAudioListener录音线程已启动")
+        return fay_booter.websocket_audio_listener
+
+    def on_audio_frame(self, frame, connection_username=None):
+        # 将音频流转发给WebSocketAudioListener处理
+        try:
+            listener = self.__get_audio_listener()
+            if listener is None:
+                return
+            # 使用连接特定的用户名，为None时使用默认用户名
+            username = connection_username or "User"
+            # 确保当前用户是活跃用户
+            listener.set_active_user(username)
+            listener.write_audio_data(frame)
+        except Exception as e:
+            print(f"[Fay][{time.strftime('%Y-%m-%d %H:%M:%S')}] 转发音频流失败: {e}")
+
     def on_connect_handler(self):
         self.add_cmd({"panelMsg": "使用提示：杰克的MCP可以独立使用，启动数字人将自动对接。"})
 
@@ -11,6 +11,7 @@ from utils import util, config_util, stream_util
 from core.wsa_server import MyServer
 from core import wsa_server
 from core import socket_bridge_service
+from core import content_db
 from llm.nlp_cognitive_stream import save_agent_memory
 import threading
 import numpy as np
@@ -88,8 +89,7 @@ class RecorderListener(Recorder):
         # 只使用本地麦克风，WebSocket音频由WebSocketAudioListener处理
         try:
             while True:
-                config_util.load_config()
-                record = config_util.config['source']['record']
+                record = config_util.get_snapshot().config['source']['record']
                 if record['enabled']:
                     break
                 time.sleep(0.1)
@@ -302,16 +302,12 @@ class WebSocketAudioListener(Recorder):
             print(f"[WebSocketAudioListener.start] 录音线程已经启动，用户: {self.username}")
 
     def write_audio_data(self, audio_data):
-        """接收WebSocket音频数据并写入缓存"""
-        print(f"[WebSocketAudioListener.write_audio_data] 接收到音频数据: {len(audio_data)} 字节")
+        """接收WebSocket音频数据并写入缓存（每帧调用，不输出日志）"""
         if self.__running and audio_data:
             try:
                 self.streamCache.write(audio_data)
-                print(f"[WebSocketAudioListener.write_audio_data] 音频数据已写入缓存")
             except Exception as e:
                 print(f"[WebSocketAudioListener.write_audio_data] 写入音频数据失败: {e}")
-        else:
-            print(f"[WebSocketAudioListener.write_audio_data] 跳过音频数据: running={self.__running}, data={audio_data is not None}")
 
     def get_stream(self):
         """返回音频流，供基类__record方法使用"""
@@ -523,6 +519,7 @@ def stop():
 
     util.log(1, '正在关闭核心服务...')
     feiFei.stop()
+    content_db.new_instance().flush(5)
     util.log(1, '服务已关闭！')
 
 
@@ -11,6 +11,9 @@ from utils import util
 
 from genagents.modules.interaction import *
 from genagents.modules.memory_stream import *
+from genagents.modules.embedding_store import EmbeddingStore, open_embedding_store
+from genagents.modules.memory_journal import JOURNAL_FILE, load_memory_nodes, save_memory_nodes
+from genagents.modules.ann_index import IVFIndex
 
 
 # ############################################################################
@@ -21,15 +24,17 @@ class GenerativeAgent:
   def __init__(self, agent_folder=None):
     if agent_folder: 
       # 检查记忆目录是否存在
-      memory_stream_exists = check_if_file_exists(f"{agent_folder}/memory_stream/nodes.json") and check_if_file_exists(f"{agent_folder}/memory_stream/embeddings.json")
+      memory_stream_exists = (check_if_file_exists(f"{agent_folder}/memory_stream/nodes.json") 
+                              or check_if_file_exists(f"{agent_folder}/memory_stream/{JOURNAL_FILE}"))
       
       # 加载记忆流数据
+      journal = None
       try:
         if memory_stream_exists:
-          with open(f"{agent_folder}/memory_stream/embeddings.json", 'r', encoding='utf-8') as json_file:
-            embeddings = json.load(json_file)
-          with open(f"{agent_folder}/memory_stream/nodes.json", 'r', encoding='utf-8') as json_file:
-            nodes = json.load(json_file)
+          # embeddings以二进制矩阵存储并通过mmap打开，旧的embeddings.json会被自动迁移
+          embeddings = open_embedding_store(f"{agent_folder}/memory_stream")
+          # 节点 = nodes.json快照 + 回放追加日志
+          nodes, journal = load_memory_nodes(f"{agent_folder}/memory_stream")
         else:
           embeddings = {}
           nodes = []
@@ -38,17 +43,41 @@ class GenerativeAgent:
         # 如果加载失败，创建空的记忆
         embeddings = {}
         nodes = []
+        journal = None
 
       self.id = uuid.uuid4()
       # 从配置文件实时加载数字人属性
       self.scratch = self._load_scratch_from_config()
       self.memory_stream = MemoryStream(nodes, embeddings)
+      self.memory_stream.journal = journal
+      self.load_retrieval_mode(f"{agent_folder}/memory_stream")
 
     else: 
       self.id = uuid.uuid4()
       # 从配置文件实时加载数字人属性
       self.scratch = self._load_scratch_from_config()
       self.memory_stream = MemoryStream([], {})
+      self.load_retrieval_mode()
+
+  def load_retrieval_mode(self, memory_stream_dir=None):
+    """
+    根据配置(memory.retrieval_mode: exact/approximate)设置记忆检索模式，
+    近似模式下加载memory_stream目录中已保存的ANN索引
+    
+    参数:
+        memory_stream_dir: memory_stream目录的路径，为None时使用新的空索引
+    """
+    try:
+      if not hasattr(cfg, 'config') or cfg.config is None:
+        cfg.load_config()
+      mode = cfg.config.get("memory", {}).get("retrieval_mode", "exact")
+    except Exception as e:
+      util.log(1, f"读取记忆检索模式时出错: {str(e)}")
+      mode = "exact"
+    ann_index = None
+    if mode == "approximate" and memory_stream_dir:
+      ann_index = IVFIndex.load(memory_stream_dir)
+    self.memory_stream.set_retrieval_mode(mode, ann_index)
 
   def _load_scratch_from_config(self):
     """
@@ -123,13 +152,13 @@ class GenerativeAgent:
           self.memory_stream.embeddings = {}
       
       # Saving the agent's memory stream. This includes saving the embeddings 
-      # as well as the nodes. 
-      with open(f"{storage}/memory_stream/embeddings.json", "w", encoding='utf-8') as json_file:
-        json.dump(self.memory_stream.embeddings, 
-                  json_file, ensure_ascii=False, indent=2)
-      with open(f"{storage}/memory_stream/nodes.json", "w", encoding='utf-8') as json_file:
-        json.dump([node.package() for node in self.memory_stream.seq_nodes], 
-                  json_file, ensure_ascii=False, indent=2)
+      # as well as the nodes. Embeddings go to the binary store and node 
+      # changes to the append-only journal, so both only write what changed
+      # since the last save. 
+      self.save_embeddings(f"{storage}/memory_stream")
+      save_memory_nodes(self.memory_stream, f"{storage}/memory_stream")
+      if self.memory_stream.ann_index is not None: 
+        self.memory_stream.ann_index.save(f"{storage}/memory_stream")
 
       # Saving the agent's meta information. 
       with open(f"{storage}/meta.json", "w", encoding='utf-8') as json_file:
@@ -140,6 +169,29 @@ class GenerativeAgent:
       util.log(1, f"保存代理记忆时出错: {str(e)}")
 
 
+  def save_embeddings(self, memory_stream_dir): 
+    """
+    Persists the memory stream's embeddings into the binary store at 
+    memory_stream_dir. A plain dict (fresh agent) or a store opened from a
+    different folder is copied into the target store first, and the memory
+    stream switches over to that store.
+
+    Parameters:
+      memory_stream_dir: str - memory_stream目录的路径
+    Returns: 
+      None
+    """
+    embeddings = self.memory_stream.embeddings
+    if (not isinstance(embeddings, EmbeddingStore) 
+        or os.path.abspath(embeddings.directory) 
+           != os.path.abspath(memory_stream_dir)): 
+      store = open_embedding_store(memory_stream_dir)
+      store.update(embeddings)
+      self.memory_stream.embeddings = store
+      embeddings = store
+    embeddings.flush()
+
+
   def get_fullname(self): 
     if "first_name" in self.scratch and "last_name" in self.scratch:
       return f"{self.scratch['first_name']} {self.scratch['last_name']}"
@@ -0,0 +1,192 @@
+import os
+
+import numpy as np
+
+
+# ##############################################################################
+# ###                    APPROXIMATE NEAREST NEIGHBOURS                      ###
+# ##############################################################################
+
+ANN_INDEX_FILE = "ann_index.npz"
+
+# The index stays untrained (retrieval falls back to the exact scan) until the
+# stream holds this many embedded nodes, and is retrained from scratch once
+# it has grown by RETRAIN_FACTOR since the last training.
+MIN_TRAIN_SIZE = 2048
+RETRAIN_FACTOR = 4
+KMEANS_ITERATIONS = 8
+KMEANS_SAMPLE_PER_LIST = 64
+
+# A query collects at least max(n_count * CANDIDATE_OVERSAMPLE, MIN_CANDIDATES)
+# candidate nodes before the exact blend is applied to them.
+CANDIDATE_OVERSAMPLE = 4
+MIN_CANDIDATES = 1024
+
+
+def _unit_rows(matrix):
+  norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+  norms[norms == 0] = 1
+  return (matrix / norms).astype(np.float32)
+
+
+class IVFIndex:
+  """
+  Pure-NumPy inverted-file index over unit-normalized embeddings. Vectors are
+  bucketed by their nearest k-means centroid; a query only scans the node ids
+  in the buckets of its closest centroids, so candidate selection touches a
+  small fraction of the memory stream.
+
+  The index stores node ids (not engine rows) so it survives reloads and can
+  be persisted next to the memory_stream files.
+  """
+  def __init__(self):
+    self.centroids = None
+    self.lists = []
+    self.indexed = set()
+    self.trained_size = 0
+    self.dirty = False
+
+
+  @property
+  def trained(self):
+    return self.centroids is not None
+
+
+  def __len__(self):
+    return len(self.indexed)
+
+
+  def needs_training(self, embedded_count):
+    if not self.trained:
+      return embedded_count >= MIN_TRAIN_SIZE
+    return embedded_count > self.trained_size * RETRAIN_FACTOR
+
+
+  def train(self, node_ids, matrix, seed=0):
+    """
+    (Re)builds the index with spherical k-means over <matrix>.
+
+    Parameters:
+      node_ids: 1-D array of node ids, one per row of <matrix>
+      matrix: 2-D float array of embeddings
+      seed: random seed for the centroid initialization
+    Returns:
+      None
+    """
+    vectors = _unit_rows(np.asarray(matrix, dtype=np.float32))
+    n = vectors.shape[0]
+    nlist = max(1, int(np.sqrt(n)))
+    rng = np.random.default_rng(seed)
+
+    sample_size = min(n, nlist * KMEANS_SAMPLE_PER_LIST)
+    sample = vectors[rng.choice(n, sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+      assign = np.argmax(sample @ centroids.T, axis=1)
+      sums = np.zeros_like(centroids)
+      np.add.at(sums, assign, sample)
+      empty = np.bincount(assign, minlength=nlist) == 0
+      sums[empty] = centroids[empty]
+      centroids = _unit_rows(sums)
+
+    self.centroids = centroids
+    self.lists = [[] for _ in range(nlist)]
+    self.indexed = set()
+    assign = np.argmax(vectors @ centroids.T, axis=1)
+    for node_id, bucket in zip(np.asarray(node_ids).tolist(), assign.tolist()):
+      self.lists[bucket].append(node_id)
+      self.indexed.add(node_id)
+    self.trained_size = n
+    self.dirty = True
+
+
+  def add(self, node_id, vector):
+    """
+    Incrementally assigns one node to its nearest bucket. Before the index
+    is trained this is a no-op; training picks up every embedded node.
+    """
+    if not self.trained or node_id in self.indexed:
+      return
+    vec = np.asarray(vector, dtype=np.float32).reshape(-1)
+    if vec.size != self.centroids.shape[1]:
+      return
+    norm = np.linalg.norm(vec)
+    if norm == 0 or not np.isfinite(norm):
+      return
+    bucket = int(np.argmax(self.centroids @ (vec / norm)))
+    self.lists[bucket].append(node_id)
+    self.indexed.add(node_id)
+    self.dirty = True
+
+
+  def search(self, query, min_candidates):
+    """
+    Returns the node ids of the buckets closest to <query>, probing buckets
+    in order of centroid similarity until at least <min_candidates> ids have
+    been collected.
+
+    Parameters:
+      query: 1-D embedding of the focal point
+      min_candidates: lower bound on the number of ids returned
+    Returns:
+      1-D int array of node ids, or None if the query cannot be used
+    """
+    if not self.trained:
+      return None
+    q = np.asarray(query, dtype=np.float32).reshape(-1)
+    if q.size != self.centroids.shape[1]:
+      return None
+    norm = np.linalg.norm(q)
+    if norm == 0 or not np.isfinite(norm):
+      return None
+
+    order = np.argsort(-(self.centroids @ (q / norm)))
+    candidates = []
+    for bucket in order:
+      candidates.extend(self.lists[bucket])
+      if len(candidates) >= min_candidates:
+        break
+    return np.asarray(candidates, dtype=np.int64)
+
+
+  def save(self, memory_stream_dir):
+    """
+    Persists the index as memory_stream/ann_index.npz (only when it changed).
+    """
+    if not self.trained or not self.dirty:
+      return
+    os.makedirs(memory_stream_dir, exist_ok=True)
+    lengths = np.array([len(l) for l in self.lists], dtype=np.int64)
+    ids = (np.concatenate([np.asarray(l, dtype=np.int64) for l in self.lists])
+           if lengths.sum() else np.empty(0, dtype=np.int64))
+    path = os.path.join(memory_stream_dir, ANN_INDEX_FILE)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, centroids=self.centroids, ids=ids, lengths=lengths,
+             trained_size=np.array(self.trained_size))
+    os.replace(tmp_path, path)
+    self.dirty = False
+
+
+  @classmethod
+  def load(cls, memory_stream_dir):
+    """
+    Loads memory_stream/ann_index.npz, or returns an empty (untrained) index
+    if there is none or it cannot be read.
+    """
+    index = cls()
+    path = os.path.join(memory_stream_dir, ANN_INDEX_FILE)
+    if not os.path.exists(path):
+      return index
+    try:
+      with np.load(path) as data:
+        index.centroids = data["centroids"].astype(np.float32)
+        offsets = np.concatenate(([0], np.cumsum(data["lengths"])))
+        ids = data["ids"]
+        index.lists = [ids[offsets[i]:offsets[i + 1]].tolist()
+                       for i in range(len(offsets) - 1)]
+        index.trained_size = int(data["trained_size"])
+      index.indexed = {node_id for l in index.lists for node_id in l}
+    except Exception as e:
+      print(f"加载ANN索引失败，将重新构建: {str(e)}")
+      index = cls()
+    return index
@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import threading
+
+import numpy as np
+
+
+# ##############################################################################
+# ###                        BINARY EMBEDDING STORE                          ###
+# ##############################################################################
+
+# Files that make up a store inside a memory_stream folder:
+#   embeddings.bin          raw row-major vectors, one row per entry
+#   embeddings.index.jsonl  the content string of each row, one per line
+#   embeddings.meta.json    dimension and on-disk dtype
+STORE_BIN = "embeddings.bin"
+STORE_INDEX = "embeddings.index.jsonl"
+STORE_META = "embeddings.meta.json"
+LEGACY_JSON = "embeddings.json"
+
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+class EmbeddingStore:
+  """
+  A content -> embedding mapping persisted as a raw binary matrix plus a
+  line-per-row content index. The matrix is opened with np.memmap at load, so
+  startup cost no longer depends on parsing text floats, and new entries are
+  appended to the end of the files on flush() instead of rewriting them.
+
+  The store behaves like the dict it replaces (in, [], get, len, iteration),
+  so MemoryStream can use either interchangeably.
+  """
+  def __init__(self, directory, dtype="float32"):
+    if dtype not in SUPPORTED_DTYPES:
+      raise ValueError(f"不支持的embedding存储类型: {dtype}")
+    self.directory = directory
+    self.dtype = dtype
+    self.dim = None
+
+    self._lock = threading.RLock()
+    self._row_of = dict()
+    self._keys = []
+    self._mmap = None
+    self._persisted = 0
+    self._pending = []
+
+    self._load()
+
+
+  # ---------------------------------------------------------------- loading --
+
+  def _path(self, name):
+    return os.path.join(self.directory, name)
+
+
+  def _load(self):
+    meta_path = self._path(STORE_META)
+    if not os.path.exists(meta_path):
+      return
+    with open(meta_path, "r", encoding="utf-8") as f:
+      meta = json.load(f)
+    self.dim = int(meta["dim"])
+    self.dtype = meta.get("dtype", self.dtype)
+
+    keys = []
+    index_path = self._path(STORE_INDEX)
+    if os.path.exists(index_path):
+      with open(index_path, "r", encoding="utf-8") as f:
+        for line in f:
+          line = line.rstrip("\n")
+          if not line:
+            continue
+          try:
+            keys.append(json.loads(line))
+          except ValueError:
+            # A torn final line from an interrupted flush.
+            break
+
+    row_bytes = self.dim * np.dtype(self.dtype).itemsize
+    bin_path = self._path(STORE_BIN)
+    file_bytes = os.path.getsize(bin_path) if os.path.exists(bin_path) else 0
+    rows = min(len(keys), file_bytes // row_bytes)
+
+    # Drop anything past the last complete row so the next flush appends at
+    # a consistent offset in both files.
+    if rows != len(keys) or rows * row_bytes != file_bytes:
+      self._truncate(rows, keys[:rows], row_bytes)
+
+    self._keys = keys[:rows]
+    for row, key in enumerate(self._keys):
+      self._row_of[key] = row
+    self._persisted = rows
+
+
+  def _truncate(self, rows, keys, row_bytes):
+    bin_path = self._path(STORE_BIN)
+    if os.path.exists(bin_path):
+      with open(bin_path, "r+b") as f:
+        f.truncate(rows * row_bytes)
+    with open(self._path(STORE_INDEX), "w", encoding="utf-8") as f:
+      for key in keys:
+        f.write(json.dumps(key, ensure_ascii=False) + "\n")
+
+
+  def _matrix(self):
+    """
+    Lazily (re)maps the persisted rows. Remapping only happens after a flush
+    has appended new rows.
+    """
+    if self._persisted == 0:
+      return None
+    if self._mmap is None or self._mmap.shape[0] != self._persisted:
+      self._mmap = np.memmap(self._path(STORE_BIN), dtype=self.dtype,
+                             mode="r", shape=(self._persisted, self.dim))
+    return self._mmap
+
+
+  # ---------------------------------------------------------- dict protocol --
+
+  def __contains__(self, key):
+    return key in self._row_of
+
+
+  def __len__(self):
+    return len(self._row_of)
+
+
+  def __iter__(self):
+    return iter(list(self._row_of.keys()))
+
+
+  def __getitem__(self, key):
+    with self._lock:
+      row = self._row_of[key]
+      if row >= self._persisted:
+        return self._pending[row - self._persisted].copy()
+      return np.array(self._matrix()[row], dtype=np.float32)
+
+
+  def get(self, key, default=None):
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+
+  def keys(self):
+    return list(self._row_of.keys())
+
+
+  def items(self):
+    for key in self.keys():
+      yield key, self[key]
+
+
+  def __setitem__(self, key, vector):
+    vec = np.asarray(vector, dtype=np.float32).reshape(-1)
+    # Failed embeddings come through as empty lists; they are not stored, so
+    # retrieval treats them like a missing embedding.
+    if vec.size == 0:
+      return
+    with self._lock:
+      if self.dim is None:
+        self.dim = vec.size
+      if vec.size != self.dim:
+        raise ValueError(f"embedding维度不一致: 期望 {self.dim}, 实际 {vec.size}")
+
+      row = self._row_of.get(key)
+      if row is not None:
+        if row >= self._persisted:
+          self._pending[row - self._persisted] = vec
+          return
+        if np.array_equal(self[key], vec.astype(self.dtype).astype(np.float32)):
+          return
+
+      # New rows (and changed vectors for persisted keys) are appended; on
+      # reload the last row for a key wins.
+      self._row_of[key] = len(self._keys)
+      self._keys.append(key)
+      self._pending.append(vec)
+
+
+  def update(self, other):
+    for key, vector in other.items():
+      self[key] = vector
+
+
+  # ------------------------------------------------------------ persistence --
+
+  @property
+  def dirty(self):
+    return len(self._pending) > 0
+
+
+  def flush(self):
+    """
+    Appends the rows added since the last flush to the binary matrix and the
+    content index. Cost is proportional to the number of new rows only.
+    """
+    with self._lock:
+      if self.dim is None:
+        return
+      os.makedirs(self.directory, exist_ok=True)
+      meta_path = self._path(STORE_META)
+      if not os.path.exists(meta_path):
+        with open(meta_path, "w", encoding="utf-8") as f:
+          json.dump({"dim": self.dim, "dtype": self.dtype}, f)
+      if not self._pending:
+        return
+
+      block = np.vstack(self._pending).astype(self.dtype)
+      with open(self._path(STORE_BIN), "ab") as f:
+        f.write(block.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+      # The index is written after the vectors, so a crash in between leaves
+      # extra vector bytes that _load trims, never an index entry without data.
+      with open(self._path(STORE_INDEX), "a", encoding="utf-8") as f:
+        for key in self._keys[self._persisted:]:
+          f.write(json.dumps(key, ensure_ascii=False) + "\n")
+
+      self._persisted = len(self._keys)
+      self._pending = []
+
+
+def open_embedding_store(memory_stream_dir, dtype="float32"):
+  """
+  Opens the binary embedding store in <memory_stream_dir>, migrating a
+  legacy embeddings.json first if one is present.
+
+  Parameters:
+    memory_stream_dir: str path of an agent's memory_stream folder
+    dtype: on-disk dtype for a newly created store
+  Returns:
+    EmbeddingStore
+  """
+  migrate_embeddings_json(memory_stream_dir, dtype)
+  return EmbeddingStore(memory_stream_dir, dtype)
+
+
+def migrate_embeddings_json(memory_stream_dir, dtype="float32"):
+  """
+  One-shot conversion of memory_stream/embeddings.json into a binary store.
+  The JSON file is kept as embeddings.json.bak once the store is written.
+
+  Parameters:
+    memory_stream_dir: str path of an agent's memory_stream folder
+    dtype: on-disk dtype of the new store
+  Returns:
+    Number of migrated embeddings, or 0 if there was nothing to migrate.
+  """
+  json_path = os.path.join(memory_stream_dir, LEGACY_JSON)
+  if not os.path.exists(json_path):
+    return 0
+  if os.path.exists(os.path.join(memory_stream_dir, STORE_META)):
+    return 0
+
+  with open(json_path, "r", encoding="utf-8") as f:
+    embeddings = json.load(f) if os.path.getsize(json_path) > 0 else {}
+
+  store = EmbeddingStore(memory_stream_dir, dtype)
+  for content, vector in (embeddings or {}).items():
+    try:
+      store[content] = vector
+    except ValueError as e:
+      print(f"迁移embedding时跳过一条记录: {str(e)}")
+  store.flush()
+
+  os.replace(json_path, json_path + ".bak")
+  return len(store)
+
+
+if __name__ == "__main__":
+  # Usage: python -m genagents.modules.embedding_store [memory_root] [dtype]
+  memory_root = sys.argv[1] if len(sys.argv) > 1 else "memory"
+  store_dtype = sys.argv[2] if len(sys.argv) > 2 else "float32"
+  for root, dirs, files in os.walk(memory_root):
+    if LEGACY_JSON in files:
+      count = migrate_embeddings_json(root, store_dtype)
+      print(f"{root}: 已迁移 {count} 条embedding")
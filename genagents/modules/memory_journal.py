@@ -0,0 +1,209 @@
+import os
+import json
+
+
+# ##############################################################################
+# ###                      APPEND-ONLY NODE JOURNAL                          ###
+# ##############################################################################
+
+# nodes.json stays the snapshot (same list format as before); every change
+# made since the last snapshot is appended to nodes.journal.jsonl as one JSON
+# record per line:
+#   {"op": "add", "node": {...ConceptNode.package()...}}
+#   {"op": "retrieved", "node_ids": [...], "last_retrieved": time_step}
+SNAPSHOT_FILE = "nodes.json"
+JOURNAL_FILE = "nodes.journal.jsonl"
+
+# Fold the journal into the snapshot once it holds this many records, or once
+# it grows past the snapshot itself (whichever comes first).
+COMPACT_RECORDS = 2000
+COMPACT_MIN_BYTES = 1024 * 1024
+
+
+def apply_journal_record(nodes, id_to_node, record):
+  """
+  Applies one journal record to a list of node dicts. Replay is idempotent:
+  an "add" for a node_id that is already present is skipped, so a crash
+  between writing a snapshot and truncating the journal is harmless.
+
+  Parameters:
+    nodes: list of node dicts (ConceptNode.package() format)
+    id_to_node: dict node_id -> node dict for <nodes>
+    record: one decoded journal record
+  Returns:
+    None
+  """
+  op = record.get("op")
+  if op == "add":
+    node = record["node"]
+    if node["node_id"] in id_to_node:
+      return
+    nodes.append(node)
+    id_to_node[node["node_id"]] = node
+  elif op == "retrieved":
+    for node_id in record.get("node_ids", []):
+      if node_id in id_to_node:
+        id_to_node[node_id]["last_retrieved"] = record["last_retrieved"]
+
+
+class NodeJournal:
+  """
+  Persistence for a memory stream's ConceptNodes: a nodes.json snapshot plus
+  an append-only journal of additions and last_retrieved updates. A save
+  appends only the records produced since the previous save; compaction
+  rewrites the snapshot and empties the journal.
+  """
+  def __init__(self, memory_stream_dir):
+    self.directory = memory_stream_dir
+    self.snapshot_path = os.path.join(memory_stream_dir, SNAPSHOT_FILE)
+    self.journal_path = os.path.join(memory_stream_dir, JOURNAL_FILE)
+    # Number of nodes the files on disk describe; None until load() or
+    # compact() has established it.
+    self.node_count = None
+    self.record_count = 0
+
+
+  def load(self):
+    """
+    Reads the snapshot and replays the journal tail on top of it.
+
+    Parameters:
+      None
+    Returns:
+      A list of node dicts, ready for MemoryStream / ConceptNode.
+    """
+    nodes = []
+    if os.path.exists(self.snapshot_path) and os.path.getsize(self.snapshot_path) > 0:
+      with open(self.snapshot_path, "r", encoding="utf-8") as f:
+        nodes = json.load(f) or []
+    id_to_node = {node["node_id"]: node for node in nodes}
+
+    self.record_count = 0
+    if os.path.exists(self.journal_path):
+      valid_bytes = 0
+      with open(self.journal_path, "rb") as f:
+        for raw in f:
+          # A line without its newline, or one that does not decode, is the
+          # torn tail of an interrupted append; everything after it is dropped.
+          if not raw.endswith(b"\n"):
+            break
+          try:
+            record = json.loads(raw.decode("utf-8"))
+          except ValueError:
+            break
+          apply_journal_record(nodes, id_to_node, record)
+          valid_bytes += len(raw)
+          self.record_count += 1
+      if valid_bytes != os.path.getsize(self.journal_path):
+        with open(self.journal_path, "r+b") as f:
+          f.truncate(valid_bytes)
+
+    self.node_count = len(nodes)
+    return nodes
+
+
+  def has_data(self):
+    """
+    Whether the snapshot or the journal holds any nodes.
+    """
+    return ((os.path.exists(self.snapshot_path)
+             and os.path.getsize(self.snapshot_path) > 2)
+            or (os.path.exists(self.journal_path)
+                and os.path.getsize(self.journal_path) > 0))
+
+
+  def should_compact(self):
+    if self.record_count >= COMPACT_RECORDS:
+      return True
+    if not os.path.exists(self.journal_path):
+      return False
+    snapshot_bytes = (os.path.getsize(self.snapshot_path)
+                      if os.path.exists(self.snapshot_path) else 0)
+    return os.path.getsize(self.journal_path) > max(snapshot_bytes,
+                                                    COMPACT_MIN_BYTES)
+
+
+  def append(self, records):
+    """
+    Appends journal records and fsyncs them. Cost is O(len(records)).
+    """
+    if not records:
+      return
+    os.makedirs(self.directory, exist_ok=True)
+    with open(self.journal_path, "a", encoding="utf-8") as f:
+      for record in records:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+      f.flush()
+      os.fsync(f.fileno())
+    self.record_count += len(records)
+
+
+  def compact(self, seq_nodes):
+    """
+    Writes a fresh snapshot of <seq_nodes> and empties the journal. The
+    snapshot is written to a temp file and swapped in atomically before the
+    journal is truncated.
+    """
+    os.makedirs(self.directory, exist_ok=True)
+    tmp_path = self.snapshot_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+      json.dump([node.package() for node in seq_nodes],
+                f, ensure_ascii=False, indent=2)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp_path, self.snapshot_path)
+    with open(self.journal_path, "w", encoding="utf-8"):
+      pass
+    self.record_count = 0
+    self.node_count = len(seq_nodes)
+
+
+def load_memory_nodes(memory_stream_dir):
+  """
+  Loads the node dicts of a memory_stream folder (snapshot + journal replay).
+
+  Parameters:
+    memory_stream_dir: str path of an agent's memory_stream folder
+  Returns:
+    (nodes, journal): the node dicts and the NodeJournal bound to the folder
+  """
+  journal = NodeJournal(memory_stream_dir)
+  return journal.load(), journal
+
+
+def save_memory_nodes(memory_stream, memory_stream_dir, compact=False):
+  """
+  Persists a MemoryStream's nodes into memory_stream_dir. Normally only the
+  records produced since the last save are appended to the journal; a full
+  snapshot is written when requested, when the journal is due for
+  compaction, or when the in-memory nodes no longer line up with what is on
+  disk (e.g., seq_nodes was replaced, or the target folder changed).
+
+  Parameters:
+    memory_stream: MemoryStream
+    memory_stream_dir: str path of the memory_stream folder to save into
+    compact: force a snapshot
+  Returns:
+    None
+  """
+  journal = memory_stream.journal
+  if (journal is None
+      or os.path.abspath(journal.directory) != os.path.abspath(memory_stream_dir)):
+    journal = NodeJournal(memory_stream_dir)
+
+  records = memory_stream.drain_journal()
+  added = sum(1 for record in records if record.get("op") == "add")
+  in_sync = (journal.node_count is not None
+             and journal.node_count + added == len(memory_stream.seq_nodes))
+
+  if compact or not in_sync or journal.should_compact():
+    # Appending first keeps replay consistent with the snapshot if we crash
+    # between swapping the snapshot in and truncating the journal.
+    if in_sync:
+      journal.append(records)
+    journal.compact(memory_stream.seq_nodes)
+  else:
+    journal.append(records)
+    journal.node_count += added
+
+  memory_stream.journal = journal
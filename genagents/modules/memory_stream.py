@@ -4,7 +4,9 @@ import datetime
 import random
 import string
 import re
+import threading
 
+import numpy as np
 from numpy import dot
 from numpy.linalg import norm
 
@@ -12,6 +14,8 @@ from simulation_engine.settings import *
 from simulation_engine.global_methods import *
 from simulation_engine.gpt_structure import *
 from simulation_engine.llm_json_parser import *
+from genagents.modules.retrieval_engine import RetrievalEngine, top_k_indices
+from genagents.modules.ann_index import IVFIndex, CANDIDATE_OVERSAMPLE, MIN_CANDIDATES
 
 
 def run_gpt_generate_importance(
@@ -432,8 +436,11 @@ class ConceptNode:
 # ###                             MEMORY STREAM                              ###
 # ##############################################################################
 
+RETRIEVAL_MODES = ("exact", "approximate")
+
+
 class MemoryStream: 
-  def __init__(self, nodes, embeddings): 
+  def __init__(self, nodes, embeddings, retrieval_mode="exact"): 
     # Loading the memory stream for the agent. 
     self.seq_nodes = []
     self.id_to_node = dict()
@@ -443,6 +450,82 @@ class MemoryStream:
       self.id_to_node[new_node.node_id] = new_node
 
     self.embeddings = embeddings
+    self._engine = RetrievalEngine()
+
+    # In "approximate" mode an IVF index pre-selects the relevance candidates
+    # and the recency/importance blend is only applied to those. 
+    self.retrieval_mode = "exact"
+    self.ann_index = None
+    self.set_retrieval_mode(retrieval_mode)
+
+    # Changes since the last save, as journal records (see memory_journal). 
+    # <journal> is the NodeJournal of the folder these nodes were loaded 
+    # from or last saved to. 
+    self.journal = None
+    self._journal_records = []
+    self._journal_lock = threading.Lock()
+
+
+  def _record(self, record): 
+    with self._journal_lock: 
+      self._journal_records.append(record)
+
+
+  def drain_journal(self): 
+    """
+    Hands over the journal records accumulated since the last call. 
+
+    Parameters:
+      None
+    Returns: 
+      A list of journal records (dicts). 
+    """
+    with self._journal_lock: 
+      records, self._journal_records = self._journal_records, []
+    return records
+
+
+  def set_retrieval_mode(self, retrieval_mode, ann_index=None): 
+    """
+    Switches between exact and approximate (ANN pre-selected) retrieval. 
+
+    Parameters:
+      retrieval_mode: 'exact' or 'approximate'
+      ann_index: an IVFIndex loaded from disk to use in approximate mode; a
+        fresh one is created if None
+    Returns: 
+      None
+    """
+    if retrieval_mode not in RETRIEVAL_MODES: 
+      print(f"警告: 未知的检索模式 {retrieval_mode}，使用exact")
+      retrieval_mode = "exact"
+    self.retrieval_mode = retrieval_mode
+    if retrieval_mode == "approximate": 
+      self.ann_index = ann_index if ann_index is not None else IVFIndex()
+    else: 
+      self.ann_index = None
+
+
+  def _sync_ann_index(self, engine): 
+    """
+    Keeps the ANN index in line with the engine: (re)trains it once enough
+    nodes are embedded, and indexes nodes it has not seen (e.g., when the
+    index on disk is older than the nodes). 
+    """
+    index = self.ann_index
+    embedded = engine.embedded_rows()
+    if len(index) > embedded.size: 
+      # The stream was cleared or replaced; the index refers to old nodes.
+      index = self.ann_index = IVFIndex()
+
+    if index.needs_training(embedded.size): 
+      ids = [engine.nodes[row].node_id for row in embedded]
+      index.train(ids, engine.matrix[embedded])
+    elif index.trained and len(index) != embedded.size: 
+      for row in embedded: 
+        node_id = engine.nodes[row].node_id
+        if node_id not in index.indexed: 
+          index.add(node_id, engine.matrix[row])
 
 
   def count_observations(self): 
@@ -467,90 +550,116 @@ class MemoryStream:
     """
     Retrieve elements from the memory stream. 
 
+    Scoring runs through the array-backed RetrievalEngine, which is synced
+    with seq_nodes before each call. All focal points are embedded in one
+    batch; for each of them the recency, relevance (cosine similarity) and
+    importance of every candidate node are computed with one matrix-vector
+    product, min-max normalized and blended with <hp>. When an ANN index is
+    trained, only the nodes in the focal point's nearest buckets are scored.
+    The n_count highest-scoring nodes are then selected with top_k_indices
+    (argpartition, ties broken by sequence order) and returned sorted by
+    their creation time. 
+
     Parameters:
       focal_points: This is the query sentence. It is in a list form where 
         the elemnts of the list are the query sentences.
       time_step: Current time_step 
-      n_count: The number of nodes that we want to retrieve. 
+      n_count: The number of nodes that we want to retrieve (top-k). 
       curr_filter: Filtering the node.type that we want to retrieve. 
         Acceptable values are 'all', 'reflection', 'observation' 
       hp: Hyperparameter for [recency_w, relevance_w, importance_w]
+      stateless: If True, last_retrieved of the retrieved nodes is not
+        updated. 
       verbose: verbose
     Returns: 
       retrieved: A dictionary whose keys are a focal_pt query str, and whose
-        values are a list of nodes that are retrieved for that query str. 
+        values are a list of at most n_count nodes retrieved for that query
+        str, in ascending order of creation. 
     """
-    curr_nodes = []
-
     # If the memory stream is empty, we return an empty dictionary.
     if len(self.seq_nodes) == 0:
       return dict()
 
-    # Filtering for the desired node type. curr_filter can be one of the three
-    # elements: 'all', 'reflection', 'observation' 
-    if curr_filter == "all": 
-      curr_nodes = self.seq_nodes
-    else: 
-      for curr_node in self.seq_nodes: 
-        if curr_node.node_type == curr_filter: 
-          curr_nodes += [curr_node]
-
     # 确保embeddings不为None
     if self.embeddings is None:
       print("警告: 在retrieve方法中，embeddings为None，初始化为空字典")
       self.embeddings = {}
 
+    # The engine mirrors seq_nodes as contiguous arrays. Filtering for the 
+    # desired node type ('all', 'reflection', 'observation') yields the row
+    # positions of the candidate nodes, in chronological order. 
+    engine = self._engine
+    engine.sync(self.seq_nodes, self.embeddings)
+    rows = engine.candidates(curr_filter)
+    if rows.size == 0: 
+      return {focal_pt: [] for focal_pt in focal_points}
+
+    use_ann = False
+    if self.ann_index is not None: 
+      self._sync_ann_index(engine)
+      use_ann = self.ann_index.trained
+
+    # Embedding all focal points in one batch; repeated queries are served 
+    # from the embedding cache. 
+    try:
+      focal_embeddings = get_text_embeddings(list(focal_points))
+    except Exception as e:
+      print(f"获取焦点嵌入向量时出错: {str(e)}")
+      focal_embeddings = [None] * len(focal_points)
+
     # <retrieved> is the main dictionary that we are returning
     retrieved = dict() 
-    for focal_pt in focal_points: 
-      # Calculating the component dictionaries and normalizing them.
-      x = extract_recency(curr_nodes)
-      recency_out = normalize_dict_floats(x, 0, 1)
-      x = extract_importance(curr_nodes)
-      importance_out = normalize_dict_floats(x, 0, 1)  
-      x = extract_relevance(curr_nodes, self.embeddings, focal_pt)
-      relevance_out = normalize_dict_floats(x, 0, 1)
-      
-      # Computing the final scores that combines the component values. 
-      master_out = dict()
-      for key in recency_out.keys(): 
-        recency_w = hp[0]
-        relevance_w = hp[1]
-        importance_w = hp[2]
-        master_out[key] = (recency_w * recency_out[key]
-                         + relevance_w * relevance_out[key] 
-                         + importance_w * importance_out[key])
+    for focal_pt, focal_embedding in zip(focal_points, focal_embeddings): 
+
+      # In approximate mode, only the nodes in the focal point's nearest IVF
+      # buckets are scored. 
+      fp_rows = rows
+      if use_ann and focal_embedding is not None: 
+        candidate_ids = self.ann_index.search(
+          focal_embedding, max(n_count * CANDIDATE_OVERSAMPLE, MIN_CANDIDATES))
+        if candidate_ids is not None: 
+          fp_rows = np.intersect1d(rows, engine.rows_for_ids(candidate_ids))
+          if fp_rows.size == 0: 
+            fp_rows = rows
+
+      # Calculating the normalized component scores for every candidate with
+      # one matrix-vector product, and combining them into the final score. 
+      master_out, recency_out, relevance_out, importance_out = engine.score(
+        fp_rows, focal_embedding, hp)
 
       if verbose: 
-        master_out = top_highest_x_values(master_out, len(master_out.keys()))
-        for key, val in master_out.items(): 
-          print (self.id_to_node[key].content, val)
-          print (recency_w*recency_out[key]*1, 
-                 relevance_w*relevance_out[key]*1, 
-                 importance_w*importance_out[key]*1)
-
-      # Extracting the highest x values.
-      # <master_out> has the key of node.id and value of float. Once we get  
-      # the highest x values, we want to translate the node.id into nodes 
-      # and return the list of nodes.
-      master_out = top_highest_x_values(master_out, n_count)
-      master_nodes = [self.id_to_node[key] for key in list(master_out.keys())]
-
-      # **Sort the master_nodes list by last_retrieved in descending order**
-      master_nodes = sorted(master_nodes, key=lambda node: node.created, reverse=False)
+        for i in top_k_indices(master_out, master_out.shape[0]): 
+          print (engine.nodes[fp_rows[i]].content, master_out[i])
+          print (hp[0]*recency_out[i]*1, 
+                 hp[1]*relevance_out[i]*1, 
+                 hp[2]*importance_out[i]*1)
+
+      # Extracting the highest x values and translating the row positions 
+      # back into nodes.
+      top_rows = fp_rows[top_k_indices(master_out, n_count)]
+      master_nodes = [engine.nodes[row] for row in top_rows]
+
+      # **Sort the master_nodes list by created in ascending order**
+      order = sorted(range(len(master_nodes)), 
+                     key=lambda i: master_nodes[i].created)
+      master_nodes = [master_nodes[i] for i in order]
+      top_rows = top_rows[order]
 
       # We do not want to update the last retrieved time_step for these nodes
       # if we are in a stateless mode. 
       if not stateless: 
-        for n in master_nodes: 
-          n.last_retrieved = time_step
+        engine.mark_retrieved(top_rows, time_step)
+        self._record({"op": "retrieved", 
+                      "node_ids": [n.node_id for n in master_nodes], 
+                      "last_retrieved": time_step})
         
       retrieved[focal_pt] = master_nodes
     
     return retrieved 
 
 
-  def _add_node(self, time_step, node_type, content, importance, pointer_id):
+  def _add_node(self, time_step, node_type, content, importance, pointer_id, 
+                embedding=None):
     """
     Adding a new node to the memory stream. 
 
@@ -560,6 +669,8 @@ class MemoryStream:
       content: the str content of the memory record
       importance: int score of the importance score
       pointer_id: the str of the parent node 
+      embedding: the precomputed embedding of content, if the caller already
+        embedded it as part of a batch
     Returns: 
       retrieved: A dictionary whose keys are a focal_pt query str, and whose
         values are a list of nodes that are retrieved for that query str. 
@@ -576,17 +687,28 @@ class MemoryStream:
 
     self.seq_nodes += [new_node]
     self.id_to_node[new_node.node_id] = new_node
+    self._record({"op": "add", "node": new_node.package()})
     
     # 确保embeddings不为None
     if self.embeddings is None:
         self.embeddings = {}
     
     try:
-        self.embeddings[content] = get_text_embedding(content)
+        if embedding is None: 
+          embedding = get_text_embedding(content)
+        self.embeddings[content] = embedding
     except Exception as e:
         print(f"获取文本嵌入时出错: {str(e)}")
         # 如果获取嵌入失败，使用空列表代替
         self.embeddings[content] = []
+        return
+
+    # 近似索引插入失败不影响已保存的embedding，精确检索仍然可用
+    if self.ann_index is not None: 
+      try:
+        self.ann_index.add(new_node.node_id, embedding)
+      except Exception as e:
+        print(f"加入近似检索索引时出错: {str(e)}")
 
 
   def remember(self, content, time_step=0):
@@ -600,7 +722,8 @@ class MemoryStream:
     record_ids = [i.node_id for i in records]
     reflections = generate_reflection(records, anchor, reflection_count)
     scores = generate_importance_score(reflections)
+    embeddings = get_text_embeddings(reflections)
 
     for count, reflection in enumerate(reflections): 
       self._add_node(time_step, "reflection", reflections[count], 
-                     scores[count], record_ids)
+                     scores[count], record_ids, embeddings[count])
@@ -0,0 +1,284 @@
+import numpy as np
+
+
+# ##############################################################################
+# ###                        MATRIX RETRIEVAL ENGINE                         ###
+# ##############################################################################
+
+RECENCY_DECAY = 0.99
+DEFAULT_RELEVANCE = 0.5
+DEFAULT_IMPORTANCE = 50.0
+
+
+def _to_importance(value):
+  """
+  Mirrors extract_importance: numeric strings are parsed, anything that
+  cannot be parsed falls back to the default importance score.
+  """
+  if isinstance(value, str):
+    try:
+      return float(value)
+    except ValueError:
+      return DEFAULT_IMPORTANCE
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return DEFAULT_IMPORTANCE
+
+
+def _normalize(values):
+  """
+  Vectorized counterpart of normalize_dict_floats with target range [0, 1].
+  A constant vector is mapped to 0.5, exactly like the dict version.
+  """
+  if values.size == 0:
+    return values
+  min_val = values.min()
+  range_val = values.max() - min_val
+  if range_val == 0:
+    return np.full(values.shape, 0.5)
+  return (values - min_val) / range_val
+
+
+def top_k_indices(scores, k):
+  """
+  Returns the positions of the k highest scores, ordered by score descending.
+  Ties are broken by position, which reproduces the stable sort used by
+  top_highest_x_values over a dict built in sequence order.
+
+  Parameters:
+    scores: 1-D float array
+    k: number of positions to return
+  Returns:
+    1-D int array of positions into <scores>
+  """
+  n = scores.shape[0]
+  if k <= 0 or n == 0:
+    return np.empty(0, dtype=np.int64)
+  if k >= n:
+    return np.lexsort((np.arange(n), -scores))
+
+  # argpartition gives us the k-th value in O(n); we then take everything
+  # strictly above it plus the earliest positions that tie with it.
+  part = np.argpartition(-scores, k - 1)[:k]
+  threshold = scores[part].min()
+  above = np.flatnonzero(scores > threshold)
+  ties = np.flatnonzero(scores == threshold)[:k - above.shape[0]]
+  selected = np.concatenate((above, ties))
+  return selected[np.lexsort((selected, -scores[selected]))]
+
+
+class RetrievalEngine:
+  """
+  Contiguous, array-backed mirror of a MemoryStream used to score every node
+  with a single matrix-vector product per focal point.
+
+  Rows are kept in the same order as MemoryStream.seq_nodes. The engine is
+  synced lazily before each retrieval: new nodes are appended, and a full
+  rebuild only happens when seq_nodes or embeddings were swapped out (e.g.,
+  by load_agent_memory or clear_agent_memory).
+  """
+  def __init__(self, dtype=np.float32):
+    self.dtype = dtype
+    self._clear()
+
+
+  def _clear(self):
+    self.nodes = []
+    self.size = 0
+    self.dim = None
+    self.matrix = None
+    self.norms = np.empty(0, dtype=np.float64)
+    self.has_embedding = np.empty(0, dtype=bool)
+    self.created = np.empty(0, dtype=np.int64)
+    self.last_retrieved = np.empty(0, dtype=np.int64)
+    self.importance = np.empty(0, dtype=np.float64)
+    self.node_types = np.empty(0, dtype=object)
+    self.row_of_id = dict()
+    self._source_nodes = None
+    self._source_embeddings = None
+    self._embeddings_seen = 0
+
+
+  def _reserve(self, capacity):
+    """
+    Grows every parallel array to at least <capacity> rows (amortized
+    doubling, so appending a node is O(1)).
+    """
+    curr = self.created.shape[0]
+    if capacity <= curr:
+      return
+    new_cap = max(capacity, curr * 2, 64)
+
+    def grow(arr, fill):
+      out = np.full((new_cap,) + arr.shape[1:], fill, dtype=arr.dtype)
+      out[:curr] = arr[:curr]
+      return out
+
+    self.norms = grow(self.norms, 0.0)
+    self.has_embedding = grow(self.has_embedding, False)
+    self.created = grow(self.created, 0)
+    self.last_retrieved = grow(self.last_retrieved, 0)
+    self.importance = grow(self.importance, 0.0)
+    self.node_types = grow(self.node_types, None)
+    if self.matrix is not None:
+      self.matrix = grow(self.matrix, 0.0)
+
+
+  def _set_embedding(self, row, embedding):
+    if embedding is None:
+      return
+    vec = np.asarray(embedding, dtype=self.dtype).reshape(-1)
+    if vec.size == 0:
+      return
+    if self.matrix is None:
+      self.dim = vec.size
+      self.matrix = np.zeros((self.created.shape[0], self.dim),
+                             dtype=self.dtype)
+    if vec.size != self.dim:
+      return
+    norm = float(np.linalg.norm(vec.astype(np.float64)))
+    if norm == 0 or not np.isfinite(norm):
+      return
+    self.matrix[row] = vec
+    self.norms[row] = norm
+    self.has_embedding[row] = True
+
+
+  def append(self, node, embedding):
+    """
+    Appends one ConceptNode (and its embedding vector, if any) as a new row.
+    """
+    row = self.size
+    self._reserve(row + 1)
+    self.nodes.append(node)
+    self.created[row] = node.created
+    self.last_retrieved[row] = node.last_retrieved
+    self.importance[row] = _to_importance(node.importance)
+    self.node_types[row] = node.node_type
+    self.row_of_id[node.node_id] = row
+    self._set_embedding(row, embedding)
+    self.size += 1
+
+
+  def sync(self, seq_nodes, embeddings):
+    """
+    Brings the engine in line with the memory stream's current state.
+
+    Parameters:
+      seq_nodes: MemoryStream.seq_nodes
+      embeddings: MemoryStream.embeddings (content -> vector mapping)
+    Returns:
+      None
+    """
+    stale = (seq_nodes is not self._source_nodes
+             or embeddings is not self._source_embeddings
+             or len(seq_nodes) < self.size
+             or (self.size and seq_nodes[self.size - 1] is not self.nodes[-1]))
+    if stale:
+      self._clear()
+      self._source_nodes = seq_nodes
+      self._source_embeddings = embeddings
+      self._reserve(len(seq_nodes))
+
+    # Embeddings may land after their node was synced (remember runs on a
+    # separate thread), so rows still missing one are re-checked whenever
+    # the embedding mapping has grown.
+    if embeddings and len(embeddings) != self._embeddings_seen:
+      self.refresh_embeddings(embeddings)
+
+    for node in seq_nodes[self.size:]:
+      self.append(node, embeddings.get(node.content) if embeddings else None)
+    self._embeddings_seen = len(embeddings) if embeddings else 0
+
+
+  def refresh_embeddings(self, embeddings):
+    """
+    Fills in rows whose embedding was not available when they were synced.
+    """
+    if not embeddings:
+      return
+    for row in np.flatnonzero(~self.has_embedding[:self.size]):
+      self._set_embedding(row, embeddings.get(self.nodes[row].content))
+
+
+  def candidates(self, curr_filter="all"):
+    """
+    Returns the row positions of the nodes that pass <curr_filter>, in
+    sequence order.
+    """
+    if curr_filter == "all":
+      return np.arange(self.size)
+    return np.flatnonzero(self.node_types[:self.size] == curr_filter)
+
+
+  def rows_for_ids(self, node_ids):
+    """
+    Maps node ids (e.g., ANN candidates) to sorted row positions, dropping
+    ids that are not in the engine.
+    """
+    rows = np.fromiter((self.row_of_id.get(node_id, -1) for node_id in node_ids),
+                       dtype=np.int64, count=len(node_ids))
+    return np.unique(rows[rows >= 0])
+
+
+  def embedded_rows(self):
+    """
+    Row positions of the nodes that have a usable embedding.
+    """
+    return np.flatnonzero(self.has_embedding[:self.size])
+
+
+  def relevance(self, rows, focal_embedding):
+    """
+    Cosine similarity between <focal_embedding> and every row in <rows>,
+    computed with a single matrix-vector product. Rows without an embedding
+    (or a missing/invalid focal embedding) get the default relevance.
+    """
+    out = np.full(rows.shape[0], DEFAULT_RELEVANCE)
+    if focal_embedding is None or self.matrix is None or rows.size == 0:
+      return out
+    q = np.asarray(focal_embedding, dtype=self.dtype).reshape(-1)
+    if q.size != self.dim:
+      return out
+    q_norm = float(np.linalg.norm(q.astype(np.float64)))
+    if q_norm == 0 or not np.isfinite(q_norm):
+      return out
+
+    if rows.shape[0] == self.size:
+      dots = self.matrix[:self.size] @ q
+    else:
+      dots = self.matrix[rows] @ q
+    valid = self.has_embedding[rows]
+    out[valid] = dots[valid] / (self.norms[rows][valid] * q_norm)
+    return out
+
+
+  def score(self, rows, focal_embedding, hp):
+    """
+    Computes the blended recency/relevance/importance score for <rows>.
+
+    Parameters:
+      rows: row positions (see candidates)
+      focal_embedding: embedding vector of the focal point, or None
+      hp: [recency_w, relevance_w, importance_w]
+    Returns:
+      (master, recency, relevance, importance) float arrays aligned to rows
+    """
+    last_retrieved = self.last_retrieved[rows]
+    recency = RECENCY_DECAY ** (last_retrieved.max() - last_retrieved
+                                ).astype(np.float64)
+    recency = _normalize(recency)
+    importance = _normalize(self.importance[rows])
+    relevance = _normalize(self.relevance(rows, focal_embedding))
+    master = hp[0] * recency + hp[1] * relevance + hp[2] * importance
+    return master, recency, relevance, importance
+
+
+  def mark_retrieved(self, rows, time_step):
+    """
+    Updates last_retrieved both in the parallel array and on the nodes.
+    """
+    self.last_retrieved[rows] = time_step
+    for row in rows:
+      self.nodes[row].last_retrieved = time_step
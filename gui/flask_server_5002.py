@@ -433,9 +433,12 @@ def gpt_stream_response(last_content, username):
 
     def generate():
         while True:
-            sentence = nlp_Stream.read()
+            # 阻塞等待下一句，有句子写入时立即返回
+            sentence = nlp_Stream.read(block=True, timeout=1)
             if sentence is None:
-                time.sleep(0.01)
+                if nlp_Stream.closed:
+                    # 文本流已被回收，不会再有句子
+                    break
                 continue
 
             # 处理特殊标记
@@ -471,7 +474,6 @@ def gpt_stream_response(last_content, username):
                 yield f"data: {json.dumps(message)}\n\n"
             if is_end:
                 break
-            time.sleep(0.01)
         yield 'data: [DONE]\n\n'
 
     return Response(generate(), mimetype='text/event-stream')
@@ -482,9 +484,10 @@ def non_streaming_response(last_content, username):
     _, nlp_Stream = stream_manager.new_instance().get_Stream(username)
     text = ""
     while True:
-        sentence = nlp_Stream.read()
+        sentence = nlp_Stream.read(block=True, timeout=1)
         if sentence is None:
-            time.sleep(0.01)
+            if nlp_Stream.closed:
+                break
             continue
 
         # 处理特殊标记
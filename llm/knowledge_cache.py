@@ -0,0 +1,192 @@
+"""
+知识库文档解析结果的持久化缓存
+
+按(路径, mtime, 大小, 内容哈希)缓存每个文件的解析结果，保存在cache_data下的SQLite中，
+重启后仍然有效；只有内容真正变化的文件才会重新解析，解析在进程池中并行进行。
+"""
+import os
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from utils import util
+from llm.knowledge_parser import load_knowledge_file
+
+KNOWLEDGE_CACHE_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  "cache_data", "knowledge_cache.db")
+# 解析进程数上限（.doc 解析会启动 Word COM，进程不宜过多）
+MAX_PARSE_WORKERS = 4
+
+
+def file_digest(file_path):
+    """
+    计算文件内容的sha256
+    """
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class KnowledgeParseCache:
+    """
+    文件解析结果的磁盘缓存
+
+    先比较mtime和大小，两者都没变直接命中；变了再比较内容哈希，
+    哈希相同（例如文件只是被touch或复制）也视为命中，不重新解析。
+    """
+
+    def __init__(self, db_path=KNOWLEDGE_CACHE_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db_ready = False
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        if not self._db_ready:
+            conn.execute("CREATE TABLE IF NOT EXISTS T_Parsed ("
+                         "path TEXT PRIMARY KEY, mtime REAL, size INTEGER, "
+                         "digest TEXT, content TEXT)")
+            self._db_ready = True
+        return conn
+
+    def lookup(self, file_path):
+        """
+        查询文件的缓存解析结果
+
+        参数:
+            file_path: 文件路径
+
+        返回:
+            (hit, content, stat_info): hit为True时content为缓存内容；
+            stat_info为(mtime, size, digest)，供store使用
+        """
+        path = os.path.abspath(str(file_path))
+        stat = os.stat(path)
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT mtime, size, digest, content FROM T_Parsed WHERE path = ?",
+                                   (path,)).fetchone()
+                if row and row[0] == stat.st_mtime and row[1] == stat.st_size:
+                    return True, row[3], (stat.st_mtime, stat.st_size, row[2])
+
+                digest = file_digest(path)
+                if row and row[2] == digest:
+                    conn.execute("UPDATE T_Parsed SET mtime = ?, size = ? WHERE path = ?",
+                                 (stat.st_mtime, stat.st_size, path))
+                    conn.commit()
+                    return True, row[3], (stat.st_mtime, stat.st_size, digest)
+                return False, None, (stat.st_mtime, stat.st_size, digest)
+            finally:
+                conn.close()
+
+    def store(self, file_path, stat_info, content):
+        """
+        保存文件的解析结果
+        """
+        path = os.path.abspath(str(file_path))
+        mtime, size, digest = stat_info
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("INSERT OR REPLACE INTO T_Parsed (path, mtime, size, digest, content) "
+                             "VALUES (?, ?, ?, ?, ?)", (path, mtime, size, digest, content))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def forget(self, file_path):
+        """
+        删除已不存在文件的缓存
+        """
+        path = os.path.abspath(str(file_path))
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM T_Parsed WHERE path = ?", (path,))
+                conn.commit()
+            finally:
+                conn.close()
+
+
+_parse_cache = KnowledgeParseCache()
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def _get_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            workers = max(1, min(MAX_PARSE_WORKERS, os.cpu_count() or 1))
+            _parse_pool = ProcessPoolExecutor(max_workers=workers)
+        return _parse_pool
+
+
+def load_knowledge_files(file_paths):
+    """
+    加载一组知识库文件：命中缓存的直接返回，其余在进程池中并行解析后写入缓存
+
+    参数:
+        file_paths: 文件路径列表
+
+    返回:
+        dict: 文件名到内容的映射（解析不出内容的文件不包含在内）
+    """
+    contents = {}
+    to_parse = []
+    for file_path in file_paths:
+        file_path = Path(file_path)
+        try:
+            hit, content, stat_info = _parse_cache.lookup(file_path)
+        except (OSError, sqlite3.Error) as e:
+            util.log(1, f"读取知识库解析缓存失败 {file_path.name}: {str(e)}")
+            hit, content, stat_info = False, None, None
+        if hit and content:
+            contents[file_path.name] = content
+        else:
+            # 旧版本缓存的空结果不再视为命中，重新解析
+            to_parse.append((file_path, stat_info))
+
+    if not to_parse:
+        return contents
+
+    util.log(1, f"解析 {len(to_parse)} 个知识库文件...")
+    try:
+        pool = _get_parse_pool()
+        futures = [(file_path, stat_info, pool.submit(load_knowledge_file, file_path))
+                   for file_path, stat_info in to_parse]
+        results = [(file_path, stat_info, future.result()) for file_path, stat_info, future in futures]
+    except Exception as e:
+        # 进程池不可用（例如打包环境）时退回到当前线程解析
+        util.log(1, f"知识库解析进程池不可用，改为串行解析: {str(e)}")
+        results = [(file_path, stat_info, load_knowledge_file(file_path))
+                   for file_path, stat_info in to_parse]
+
+    for file_path, stat_info, content in results:
+        # 只缓存解析出内容的文件：解析失败可能只是暂时的（Word COM出错、文件被占用等），
+        # 下次加载时重试，而不是在文件变化之前一直当作空文档
+        if not content:
+            continue
+        contents[file_path.name] = content
+        if stat_info is not None:
+            try:
+                _parse_cache.store(file_path, stat_info, content)
+            except sqlite3.Error as e:
+                util.log(1, f"写入知识库解析缓存失败 {file_path.name}: {str(e)}")
+    return contents
+
+
+def forget_knowledge_file(file_path):
+    """
+    文件被删除时清理其缓存
+    """
+    try:
+        _parse_cache.forget(file_path)
+    except sqlite3.Error as e:
+        util.log(1, f"清理知识库解析缓存失败: {str(e)}")
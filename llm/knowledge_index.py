@@ -0,0 +1,178 @@
+import math
+import re
+import threading
+from collections import Counter, namedtuple
+
+
+# 句子切分规则与原先的search_knowledge_base保持一致
+SENTENCE_SPLIT = re.compile(r'[。！？\n]')
+# 连续的中日韩字符按字切分为n-gram，其余按单词切分
+CJK_CHARS = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+CJK_RUN = re.compile('[' + CJK_CHARS + ']+')
+WORD = re.compile(r'[^\W' + CJK_CHARS + ']+')
+
+# 知识库快照：文件名到内容的字典 + 对应的索引。整体替换，查询方只需读取一次引用
+KnowledgeSnapshot = namedtuple('KnowledgeSnapshot', ['documents', 'index', 'load_time'])
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# 每个文件返回的最相关句子数
+SENTENCES_PER_FILE = 5
+
+
+def tokenize(text):
+    """
+    将文本切分为检索词：英文/数字按单词（小写），中文按字符二元组(bigram)，
+    单字的中文片段保留为一元组
+
+    参数:
+        text: 待切分文本
+
+    返回:
+        list: 词项列表
+    """
+    text = text.lower()
+    tokens = WORD.findall(text)
+    for run in CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def split_sentences(content):
+    """
+    按句子切分文档内容，去掉空句
+    """
+    return [s.strip() for s in SENTENCE_SPLIT.split(content) if s.strip()]
+
+
+class KnowledgeIndex:
+    """
+    本地知识库的倒排索引，以句子为检索单元、BM25打分
+
+    文档只在加入索引时切分、分词一次；查询只访问倒排表，不再扫描原文。
+    支持按文件增删，知识库文件变化时只需重建变化的文件。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}      # term -> {sentence_id: tf}
+        self._sentences = {}     # sentence_id -> (file_name, sentence, length)
+        self._sentence_terms = {}  # sentence_id -> Counter
+        self._file_sentences = {}  # file_name -> [sentence_id]
+        self._next_id = 0
+        self._total_length = 0
+
+    @classmethod
+    def from_documents(cls, documents):
+        """
+        由文件名到内容的字典构建索引
+        """
+        index = cls()
+        for file_name, content in documents.items():
+            index.add_file(file_name, content)
+        return index
+
+    def __len__(self):
+        return len(self._file_sentences)
+
+    def copy(self):
+        """
+        复制索引（不重新分词），用于在后台构建新快照而不影响正在服务的索引
+        """
+        with self._lock:
+            other = KnowledgeIndex()
+            other._postings = {term: dict(postings) for term, postings in self._postings.items()}
+            other._sentences = dict(self._sentences)
+            other._sentence_terms = dict(self._sentence_terms)
+            other._file_sentences = {name: list(ids) for name, ids in self._file_sentences.items()}
+            other._next_id = self._next_id
+            other._total_length = self._total_length
+            return other
+
+    def files(self):
+        return list(self._file_sentences.keys())
+
+    def add_file(self, file_name, content):
+        """
+        加入（或替换）一个文件的内容
+        """
+        with self._lock:
+            self.remove_file(file_name)
+            ids = []
+            for sentence in split_sentences(content):
+                terms = Counter(tokenize(sentence))
+                if not terms:
+                    continue
+                sentence_id = self._next_id
+                self._next_id += 1
+                length = sum(terms.values())
+                self._sentences[sentence_id] = (file_name, sentence, length)
+                self._sentence_terms[sentence_id] = terms
+                self._total_length += length
+                for term, tf in terms.items():
+                    self._postings.setdefault(term, {})[sentence_id] = tf
+                ids.append(sentence_id)
+            self._file_sentences[file_name] = ids
+
+    def remove_file(self, file_name):
+        """
+        从索引中移除一个文件
+        """
+        with self._lock:
+            for sentence_id in self._file_sentences.pop(file_name, []):
+                _, _, length = self._sentences.pop(sentence_id)
+                self._total_length -= length
+                for term in self._sentence_terms.pop(sentence_id):
+                    postings = self._postings[term]
+                    del postings[sentence_id]
+                    if not postings:
+                        del self._postings[term]
+
+    def search(self, query, max_results=3):
+        """
+        BM25检索，按文件聚合结果
+
+        参数:
+            query: 查询内容
+            max_results: 最大返回文件数
+
+        返回:
+            list: [{'file_name', 'score', 'content'}]，content为该文件中最相关的句子
+        """
+        with self._lock:
+            n = len(self._sentences)
+            if n == 0:
+                return []
+            avg_length = self._total_length / n
+
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                for sentence_id, tf in postings.items():
+                    length = self._sentences[sentence_id][2]
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                    scores[sentence_id] = (scores.get(sentence_id, 0.0)
+                                           + idf * tf * (BM25_K1 + 1) / (tf + norm))
+
+            by_file = {}
+            for sentence_id, score in scores.items():
+                file_name, sentence, _ = self._sentences[sentence_id]
+                by_file.setdefault(file_name, []).append((score, sentence_id, sentence))
+
+        results = []
+        for file_name, matched in by_file.items():
+            matched.sort(key=lambda x: (-x[0], x[1]))
+            results.append({
+                'file_name': file_name,
+                'score': sum(m[0] for m in matched),
+                'content': '\n'.join(m[2] for m in matched[:SENTENCES_PER_FILE])
+            })
+        results.sort(key=lambda x: x['score'], reverse=True)
+        return results[:max_results]
@@ -0,0 +1,244 @@
+"""
+本地知识库文档解析（.docx/.doc/.pptx/文本）
+
+解析函数放在独立的轻量模块中，便于在进程池中并行解析知识库文件。
+"""
+import os
+from pathlib import Path
+import docx
+from docx.document import Document
+from docx.oxml.table import CT_Tbl
+from docx.oxml.text.paragraph import CT_P
+from docx.table import _Cell, Table
+from docx.text.paragraph import Paragraph
+try:
+    from pptx import Presentation
+    PPTX_AVAILABLE = True
+except ImportError:
+    PPTX_AVAILABLE = False
+
+# 用于处理 .doc 文件的库
+try:
+    import win32com.client
+    WIN32COM_AVAILABLE = True
+except ImportError:
+    WIN32COM_AVAILABLE = False
+
+from utils import util
+
+
+def read_doc_file(file_path):
+    """
+    读取doc文件内容
+    
+    参数:
+        file_path: doc文件路径
+        
+    返回:
+        str: 文档内容
+    """
+    try:
+        # 方法1: 使用 win32com.client（Windows系统，推荐用于.doc文件）
+        if WIN32COM_AVAILABLE:
+            word = None
+            doc = None
+            try:
+                import pythoncom
+                pythoncom.CoInitialize()  # 初始化COM组件
+                
+                word = win32com.client.Dispatch("Word.Application")
+                word.Visible = False
+                doc = word.Documents.Open(file_path)
+                content = doc.Content.Text
+                
+                # 先保存内容，再尝试关闭
+                if content and content.strip():
+                    try:
+                        doc.Close()
+                        word.Quit()
+                    except Exception as close_e:
+                        util.log(1, f"关闭Word应用程序时出错: {str(close_e)}，但内容已成功提取")
+                    
+                    try:
+                        pythoncom.CoUninitialize()  # 清理COM组件
+                    except:
+                        pass
+                    
+                    return content.strip()
+                
+            except Exception as e:
+                util.log(1, f"使用 win32com 读取 .doc 文件失败: {str(e)}")
+            finally:
+                # 确保资源被释放
+                try:
+                    if doc:
+                        doc.Close()
+                except:
+                    pass
+                try:
+                    if word:
+                        word.Quit()
+                except:
+                    pass
+                try:
+                    pythoncom.CoUninitialize()
+                except:
+                    pass
+        
+        # 方法2: 简单的二进制文本提取（备选方案）
+        try:
+            with open(file_path, 'rb') as f:
+                raw_data = f.read()
+                # 尝试提取可打印的文本
+                text_parts = []
+                current_text = ""
+                
+                for byte in raw_data:
+                    char = chr(byte) if 32 <= byte <= 126 or byte in [9, 10, 13] else None
+                    if char:
+                        current_text += char
+                    else:
+                        if len(current_text) > 3:  # 只保留长度大于3的文本片段
+                            text_parts.append(current_text.strip())
+                        current_text = ""
+                
+                if len(current_text) > 3:
+                    text_parts.append(current_text.strip())
+                
+                # 过滤和清理文本
+                filtered_parts = []
+                for part in text_parts:
+                    # 移除过多的重复字符和无意义的片段
+                    if (len(part) > 5 and 
+                        not part.startswith('Microsoft') and 
+                        not all(c in '0123456789-_.' for c in part) and
+                        len(set(part)) > 3):  # 字符种类要多样
+                        filtered_parts.append(part)
+                
+                if filtered_parts:
+                    return '\n'.join(filtered_parts)
+                    
+        except Exception as e:
+            util.log(1, f"使用二进制方法读取 .doc 文件失败: {str(e)}")
+        
+        util.log(1, f"无法读取 .doc 文件 {file_path}，建议转换为 .docx 格式")
+        return ""
+        
+    except Exception as e:
+        util.log(1, f"读取doc文件 {file_path} 时出错: {str(e)}")
+        return ""
+
+def read_docx_file(file_path):
+    """
+    读取docx文件内容
+    
+    参数:
+        file_path: docx文件路径
+        
+    返回:
+        str: 文档内容
+    """
+    try:
+        doc = docx.Document(file_path)
+        content = []
+        
+        for element in doc.element.body:
+            if isinstance(element, CT_P):
+                paragraph = Paragraph(element, doc)
+                if paragraph.text.strip():
+                    content.append(paragraph.text.strip())
+            elif isinstance(element, CT_Tbl):
+                table = Table(element, doc)
+                for row in table.rows:
+                    row_text = []
+                    for cell in row.cells:
+                        if cell.text.strip():
+                            row_text.append(cell.text.strip())
+                    if row_text:
+                        content.append(" | ".join(row_text))
+        
+        return "\n".join(content)
+    except Exception as e:
+        util.log(1, f"读取docx文件 {file_path} 时出错: {str(e)}")
+        return ""
+    
+def read_pptx_file(file_path):
+    """
+    读取pptx文件内容
+    
+    参数:
+        file_path: pptx文件路径
+        
+    返回:
+        str: 演示文稿内容
+    """
+    if not PPTX_AVAILABLE:
+        util.log(1, "python-pptx 库未安装，无法读取 PowerPoint 文件")
+        return ""
+        
+    try:
+        prs = Presentation(file_path)
+        content = []
+        
+        for i, slide in enumerate(prs.slides):
+            slide_content = [f"第{i+1}页："]
+            
+            for shape in slide.shapes:
+                if hasattr(shape, "text") and shape.text.strip():
+                    slide_content.append(shape.text.strip())
+                    
+            if len(slide_content) > 1:  # 有内容才添加
+                content.append("\n".join(slide_content))
+        
+        return "\n\n".join(content)
+    except Exception as e:
+        util.log(1, f"读取pptx文件 {file_path} 时出错: {str(e)}")
+        return ""
+
+def get_knowledge_base_dir():
+    """
+    获取知识库目录(llm/data)路径
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(current_dir, "data")
+
+def load_knowledge_file(file_path):
+    """
+    读取单个知识库文件的内容
+    
+    参数:
+        file_path: 文件路径(Path)
+        
+    返回:
+        str: 文件内容，无法读取或内容为空时返回None
+    """
+    file_name = file_path.name
+    file_extension = file_path.suffix.lower()
+    
+    try:
+        if file_extension == '.docx':
+            content = read_docx_file(str(file_path))
+        elif file_extension == '.doc':
+            content = read_doc_file(str(file_path))
+        elif file_extension == '.pptx':
+            content = read_pptx_file(str(file_path))
+        else:
+            # 尝试作为文本文件读取
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+            except UnicodeDecodeError:
+                try:
+                    with open(file_path, 'r', encoding='gbk') as f:
+                        content = f.read()
+                except UnicodeDecodeError:
+                    util.log(1, f"无法解码文件: {file_name}")
+                    return None
+        
+        if content.strip():
+            util.log(1, f"成功加载知识库文件: {file_name} ({len(content)} 字符)")
+            return content
+        
+    except Exception as e:
+        util.log(1, f"加载知识库文件 {file_name} 时出错: {str(e)}")
+    return None
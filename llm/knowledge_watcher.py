@@ -0,0 +1,146 @@
+"""
+知识库目录监视
+
+后台线程定期扫描知识库目录（装有watchdog时改为由文件系统事件唤醒），
+发现变化后等待一段静默期（去抖），再把变化的文件一次性交给回调处理。
+查询路径因此不再需要访问文件系统。
+"""
+import os
+import stat
+import threading
+import time
+from pathlib import Path
+
+from utils import util
+from scheduler.thread_manager import MyThread
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
+
+# 支持的知识库文件格式（无扩展名的文件按文本处理）
+KNOWLEDGE_FILE_EXTENSIONS = ('.docx', '.doc', '.pptx', '.txt', '')
+# 没有文件系统事件时的轮询间隔（秒）
+POLL_INTERVAL = 5.0
+# 最后一次变化后静默多久才触发重新加载（秒），避免文件复制/保存过程中反复加载
+DEBOUNCE_SECONDS = 1.0
+
+
+def scan_knowledge_dir(data_dir):
+    """
+    扫描知识库目录
+
+    返回:
+        dict: 文件名 -> (mtime, size)
+    """
+    file_states = {}
+    if not os.path.isdir(data_dir):
+        return file_states
+    for file_path in Path(data_dir).iterdir():
+        if file_path.suffix.lower() not in KNOWLEDGE_FILE_EXTENSIONS:
+            continue
+        try:
+            file_stat = file_path.stat()
+        except OSError:
+            continue
+        if not stat.S_ISREG(file_stat.st_mode):
+            continue
+        file_states[file_path.name] = (file_stat.st_mtime, file_stat.st_size)
+    return file_states
+
+
+if WATCHDOG_AVAILABLE:
+    class _WakeupHandler(FileSystemEventHandler):
+        def __init__(self, wakeup):
+            super().__init__()
+            self._wakeup = wakeup
+
+        def on_any_event(self, event):
+            self._wakeup.set()
+
+
+class KnowledgeBaseWatcher:
+    """
+    知识库目录监视器
+
+    on_change(changed, removed) 在后台线程中调用，参数为文件名集合
+    """
+
+    def __init__(self, data_dir, on_change, poll_interval=POLL_INTERVAL, debounce=DEBOUNCE_SECONDS):
+        self.data_dir = data_dir
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self._file_states = {}
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+        self._observer = None
+
+    def start(self, file_states=None):
+        """
+        启动监视
+
+        参数:
+            file_states: 初始目录状态（scan_knowledge_dir的结果），为None时现在扫描
+        """
+        if self._running:
+            return
+        self._file_states = scan_knowledge_dir(self.data_dir) if file_states is None else dict(file_states)
+        self._running = True
+        if WATCHDOG_AVAILABLE and os.path.isdir(self.data_dir):
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_WakeupHandler(self._wakeup), self.data_dir, recursive=False)
+                self._observer.daemon = True
+                self._observer.start()
+            except Exception as e:
+                util.log(1, f"知识库目录事件监视启动失败，改为轮询: {str(e)}")
+                self._observer = None
+        self._thread = MyThread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        if self._observer is not None:
+            try:
+                self._observer.stop()
+            except Exception:
+                pass
+            self._observer = None
+
+    def _diff(self):
+        current = scan_knowledge_dir(self.data_dir)
+        changed = {name for name, state in current.items() if self._file_states.get(name) != state}
+        removed = set(self._file_states.keys()) - set(current.keys())
+        return current, changed, removed
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            if not self._running:
+                break
+            try:
+                current, changed, removed = self._diff()
+                if not changed and not removed:
+                    continue
+
+                # 去抖：直到目录在debounce时间内不再变化才提交
+                while self._running:
+                    time.sleep(self.debounce)
+                    self._wakeup.clear()
+                    latest = scan_knowledge_dir(self.data_dir)
+                    if latest == current:
+                        break
+                    current = latest
+                current, changed, removed = self._diff()
+                self._file_states = current
+                if changed or removed:
+                    self.on_change(changed, removed)
+            except Exception as e:
+                util.log(1, f"监视知识库目录时出错: {str(e)}")
@@ -14,29 +14,17 @@ from langgraph.prebuilt import create_react_agent
 # 新增：本地知识库相关导入
 import re
 from pathlib import Path
-import docx
-from docx.document import Document
-from docx.oxml.table import CT_Tbl
-from docx.oxml.text.paragraph import CT_P
-from docx.table import _Cell, Table
-from docx.text.paragraph import Paragraph
-try:
-    from pptx import Presentation
-    PPTX_AVAILABLE = True
-except ImportError:
-    PPTX_AVAILABLE = False
-
-# 用于处理 .doc 文件的库
-try:
-    import win32com.client
-    WIN32COM_AVAILABLE = True
-except ImportError:
-    WIN32COM_AVAILABLE = False
 
 from utils import util
 import utils.config_util as cfg
 from genagents.genagents import GenerativeAgent
 from genagents.modules.memory_stream import ConceptNode
+from genagents.modules.embedding_store import open_embedding_store
+from genagents.modules.memory_journal import NodeJournal, save_memory_nodes
+from llm.knowledge_index import KnowledgeIndex, KnowledgeSnapshot
+from llm.knowledge_cache import load_knowledge_files, forget_knowledge_file
+from llm.knowledge_watcher import KnowledgeBaseWatcher, scan_knowledge_dir
+from llm.knowledge_parser import read_doc_file, read_docx_file, read_pptx_file, get_knowledge_base_dir
 from urllib3.exceptions import InsecureRequestWarning
 from scheduler.thread_manager import MyThread
 from core import stream_manager
@@ -105,232 +93,27 @@ def get_current_time_step(username=None):
         util.log(1, f"获取time_step时出错: {str(e)}，使用0代替")
         return 0
 
-# 新增：本地知识库相关函数
-def read_doc_file(file_path):
-    """
-    读取doc文件内容
-    
-    参数:
-        file_path: doc文件路径
-        
-    返回:
-        str: 文档内容
-    """
-    try:
-        # 方法1: 使用 win32com.client（Windows系统，推荐用于.doc文件）
-        if WIN32COM_AVAILABLE:
-            word = None
-            doc = None
-            try:
-                import pythoncom
-                pythoncom.CoInitialize()  # 初始化COM组件
-                
-                word = win32com.client.Dispatch("Word.Application")
-                word.Visible = False
-                doc = word.Documents.Open(file_path)
-                content = doc.Content.Text
-                
-                # 先保存内容，再尝试关闭
-                if content and content.strip():
-                    try:
-                        doc.Close()
-                        word.Quit()
-                    except Exception as close_e:
-                        util.log(1, f"关闭Word应用程序时出错: {str(close_e)}，但内容已成功提取")
-                    
-                    try:
-                        pythoncom.CoUninitialize()  # 清理COM组件
-                    except:
-                        pass
-                    
-                    return content.strip()
-                
-            except Exception as e:
-                util.log(1, f"使用 win32com 读取 .doc 文件失败: {str(e)}")
-            finally:
-                # 确保资源被释放
-                try:
-                    if doc:
-                        doc.Close()
-                except:
-                    pass
-                try:
-                    if word:
-                        word.Quit()
-                except:
-                    pass
-                try:
-                    pythoncom.CoUninitialize()
-                except:
-                    pass
-        
-        # 方法2: 简单的二进制文本提取（备选方案）
-        try:
-            with open(file_path, 'rb') as f:
-                raw_data = f.read()
-                # 尝试提取可打印的文本
-                text_parts = []
-                current_text = ""
-                
-                for byte in raw_data:
-                    char = chr(byte) if 32 <= byte <= 126 or byte in [9, 10, 13] else None
-                    if char:
-                        current_text += char
-                    else:
-                        if len(current_text) > 3:  # 只保留长度大于3的文本片段
-                            text_parts.append(current_text.strip())
-                        current_text = ""
-                
-                if len(current_text) > 3:
-                    text_parts.append(current_text.strip())
-                
-                # 过滤和清理文本
-                filtered_parts = []
-                for part in text_parts:
-                    # 移除过多的重复字符和无意义的片段
-                    if (len(part) > 5 and 
-                        not part.startswith('Microsoft') and 
-                        not all(c in '0123456789-_.' for c in part) and
-                        len(set(part)) > 3):  # 字符种类要多样
-                        filtered_parts.append(part)
-                
-                if filtered_parts:
-                    return '\n'.join(filtered_parts)
-                    
-        except Exception as e:
-            util.log(1, f"使用二进制方法读取 .doc 文件失败: {str(e)}")
-        
-        util.log(1, f"无法读取 .doc 文件 {file_path}，建议转换为 .docx 格式")
-        return ""
-        
-    except Exception as e:
-        util.log(1, f"读取doc文件 {file_path} 时出错: {str(e)}")
-        return ""
-
-def read_docx_file(file_path):
-    """
-    读取docx文件内容
-    
-    参数:
-        file_path: docx文件路径
-        
-    返回:
-        str: 文档内容
-    """
-    try:
-        doc = docx.Document(file_path)
-        content = []
-        
-        for element in doc.element.body:
-            if isinstance(element, CT_P):
-                paragraph = Paragraph(element, doc)
-                if paragraph.text.strip():
-                    content.append(paragraph.text.strip())
-            elif isinstance(element, CT_Tbl):
-                table = Table(element, doc)
-                for row in table.rows:
-                    row_text = []
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            row_text.append(cell.text.strip())
-                    if row_text:
-                        content.append(" | ".join(row_text))
-        
-        return "\n".join(content)
-    except Exception as e:
-        util.log(1, f"读取docx文件 {file_path} 时出错: {str(e)}")
-        return ""
-    
-def read_pptx_file(file_path):
-    """
-    读取pptx文件内容
-    
-    参数:
-        file_path: pptx文件路径
-        
-    返回:
-        str: 演示文稿内容
-    """
-    if not PPTX_AVAILABLE:
-        util.log(1, "python-pptx 库未安装，无法读取 PowerPoint 文件")
-        return ""
-        
-    try:
-        prs = Presentation(file_path)
-        content = []
-        
-        for i, slide in enumerate(prs.slides):
-            slide_content = [f"第{i+1}页："]
-            
-            for shape in slide.shapes:
-                if hasattr(shape, "text") and shape.text.strip():
-                    slide_content.append(shape.text.strip())
-                    
-            if len(slide_content) > 1:  # 有内容才添加
-                content.append("\n".join(slide_content))
-        
-        return "\n\n".join(content)
-    except Exception as e:
-        util.log(1, f"读取pptx文件 {file_path} 时出错: {str(e)}")
-        return ""
-
 def load_local_knowledge_base():
     """
-    加载本地知识库内容
+    加载本地知识库内容（命中解析缓存的文件不再重新解析）
     
     返回:
         dict: 文件名到内容的映射
     """
-    knowledge_base = {}
-    
     # 获取llm/data目录路径
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(current_dir, "data")
+    data_dir = get_knowledge_base_dir()
     
     if not os.path.exists(data_dir):
         util.log(1, f"知识库目录不存在: {data_dir}")
-        return knowledge_base
+        return {}
     
     # 遍历data目录中的文件
-    for file_path in Path(data_dir).iterdir():
-        if not file_path.is_file():
-            continue
-            
-        file_name = file_path.name
-        file_extension = file_path.suffix.lower()
-        
-        try:
-            if file_extension == '.docx':
-                content = read_docx_file(str(file_path))
-            elif file_extension == '.doc':
-                content = read_doc_file(str(file_path))
-            elif file_extension == '.pptx':
-                content = read_pptx_file(str(file_path))
-            else:
-                # 尝试作为文本文件读取
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                except UnicodeDecodeError:
-                    try:
-                        with open(file_path, 'r', encoding='gbk') as f:
-                            content = f.read()
-                    except UnicodeDecodeError:
-                        util.log(1, f"无法解码文件: {file_name}")
-                        continue
-            
-            if content.strip():
-                knowledge_base[file_name] = content
-                util.log(1, f"成功加载知识库文件: {file_name} ({len(content)} 字符)")
-            
-        except Exception as e:
-            util.log(1, f"加载知识库文件 {file_name} 时出错: {str(e)}")
-    
-    return knowledge_base
+    file_paths = [file_path for file_path in Path(data_dir).iterdir() if file_path.is_file()]
+    return load_knowledge_files(file_paths)
 
 def search_knowledge_base(query, knowledge_base, max_results=3):
     """
-    在知识库中搜索相关内容
+    在知识库中搜索相关内容（倒排索引 + BM25）
     
     参数:
         query: 查询内容
@@ -343,155 +126,134 @@ def search_knowledge_base(query, knowledge_base, max_results=3):
     if not knowledge_base:
         return []
     
-    results = []
-    query_lower = query.lower()
-    
-    # 搜索关键词
-    query_keywords = re.findall(r'\w+', query_lower)
-    
-    for file_name, content in knowledge_base.items():
-        content_lower = content.lower()
-        
-        # 计算匹配度
-        score = 0
-        matched_sentences = []
-        
-        # 按句子分割内容
-        sentences = re.split(r'[。！？\n]', content)
-        
-        for sentence in sentences:
-            if not sentence.strip():
-                continue
-                
-            sentence_lower = sentence.lower()
-            sentence_score = 0
-            
-            # 计算关键词匹配度
-            for keyword in query_keywords:
-                if keyword in sentence_lower:
-                    sentence_score += 1
-            
-            # 如果句子有匹配，记录
-            if sentence_score > 0:
-                matched_sentences.append((sentence.strip(), sentence_score))
-                score += sentence_score
-        
-        # 如果有匹配的内容
-        if score > 0:
-            # 按匹配度排序句子
-            matched_sentences.sort(key=lambda x: x[1], reverse=True)
-            
-            # 取前几个最相关的句子
-            relevant_sentences = [sent[0] for sent in matched_sentences[:5] if sent[0]]
-            
-            if relevant_sentences:
-                results.append({
-                    'file_name': file_name,
-                    'score': score,
-                    'content': '\n'.join(relevant_sentences)
-                })
-    
-    # 按匹配度排序
-    results.sort(key=lambda x: x['score'], reverse=True)
+    # 当前快照的知识库直接使用已建好的索引，其他字典临时建索引
+    snapshot = _knowledge_snapshot
+    if snapshot is not None and knowledge_base is snapshot.documents:
+        index = snapshot.index
+    else:
+        index = KnowledgeIndex.from_documents(knowledge_base)
     
-    return results[:max_results]
+    return index.search(query, max_results)
 
-# 全局知识库缓存
-_knowledge_base_cache = None
-_knowledge_base_load_time = None
-_knowledge_base_file_times = {}  # 存储文件的最后修改时间
+# 全局知识库快照（文档 + 索引），重新加载时在后台构建新快照后整体替换
+_knowledge_snapshot = None  # type: KnowledgeSnapshot
+_knowledge_watcher = None  # 知识库目录监视器，发现文件变化后触发增量重新加载
+_knowledge_init_lock = threading.Lock()
+_knowledge_reload_lock = threading.Lock()  # 保护下面的待处理变化与后台线程状态
+_knowledge_pending_changed = set()
+_knowledge_pending_removed = set()
+_knowledge_reloading = False
 
-def check_knowledge_base_changes():
+def init_knowledge_base():
     """
-    检查知识库文件是否有变化
-    
-    返回:
-        bool: 如果有文件变化返回True，否则返回False
+    初始化知识库并启动目录监视，在系统启动时调用
     """
-    global _knowledge_base_file_times
-    
-    # 获取llm/data目录路径
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(current_dir, "data")
+    global _knowledge_snapshot, _knowledge_watcher
     
-    if not os.path.exists(data_dir):
-        return False
-    
-    current_file_times = {}
-    
-    # 遍历data目录中的文件
-    for file_path in Path(data_dir).iterdir():
-        if not file_path.is_file():
-            continue
+    with _knowledge_init_lock:
+        if _knowledge_snapshot is not None:
+            return
+        util.log(1, "初始化本地知识库...")
+        # 先记录目录状态再加载，加载期间发生的修改会被监视器发现
+        data_dir = get_knowledge_base_dir()
+        file_states = scan_knowledge_dir(data_dir)
+        documents = load_local_knowledge_base()
+        _knowledge_snapshot = KnowledgeSnapshot(documents, KnowledgeIndex.from_documents(documents), time.time())
         
-        file_name = file_path.name
-        file_extension = file_path.suffix.lower()
+        _knowledge_watcher = KnowledgeBaseWatcher(data_dir, on_knowledge_files_changed)
+        _knowledge_watcher.start(file_states)
         
-        # 只检查支持的文件格式
-        if file_extension in ['.docx', '.doc', '.pptx', '.txt'] or file_extension == '':
-            try:
-                mtime = os.path.getmtime(str(file_path))
-                current_file_times[file_name] = mtime
-            except OSError:
-                continue
-    
-    # 检查是否有变化
-    if not _knowledge_base_file_times:
-        # 第一次检查，保存文件时间
-        _knowledge_base_file_times = current_file_times
-        return True
-    
-    # 比较文件时间
-    if set(current_file_times.keys()) != set(_knowledge_base_file_times.keys()):
-        # 文件数量发生变化
-        _knowledge_base_file_times = current_file_times
-        return True
-    
-    for file_name, mtime in current_file_times.items():
-        if file_name not in _knowledge_base_file_times or _knowledge_base_file_times[file_name] != mtime:
-            # 文件被修改
-            _knowledge_base_file_times = current_file_times
-            return True
-    
-    return False
+        util.log(1, f"知识库初始化完成，共 {len(documents)} 个文件")
 
-def init_knowledge_base():
+def on_knowledge_files_changed(changed, removed):
     """
-    初始化知识库，在系统启动时调用
+    监视器回调：知识库文件变化后在后台增量重新加载
     """
-    global _knowledge_base_cache, _knowledge_base_load_time
-    
-    util.log(1, "初始化本地知识库...")
-    _knowledge_base_cache = load_local_knowledge_base()
-    _knowledge_base_load_time = time.time()
+    util.log(1, f"检测到知识库文件变化，后台重新加载 {len(changed)} 个文件，移除 {len(removed)} 个文件...")
+    schedule_knowledge_reload(changed, removed)
+
+def reload_changed_knowledge_files(changed, removed):
+    """
+    只重新加载变化的文件：基于当前快照复制出新的文档与索引，增量更新后整体替换。
+    替换前查询继续使用旧快照。
     
-    # 初始化文件修改时间跟踪
-    check_knowledge_base_changes()
+    参数:
+        changed: 新增/修改的文件名集合
+        removed: 已删除的文件名集合
+    """
+    global _knowledge_snapshot
+    
+    data_dir = get_knowledge_base_dir()
+    old = _knowledge_snapshot
+    documents = dict(old.documents)
+    index = old.index.copy()
+    
+    for file_name in removed:
+        documents.pop(file_name, None)
+        index.remove_file(file_name)
+        forget_knowledge_file(Path(data_dir) / file_name)
+    
+    paths = [Path(data_dir) / file_name for file_name in changed
+             if (Path(data_dir) / file_name).is_file()]
+    loaded = load_knowledge_files(paths)
+    for file_name in changed:
+        content = loaded.get(file_name)
+        if content:
+            documents[file_name] = content
+            index.add_file(file_name, content)
+        else:
+            documents.pop(file_name, None)
+            index.remove_file(file_name)
     
-    util.log(1, f"知识库初始化完成，共 {len(_knowledge_base_cache)} 个文件")
+    _knowledge_snapshot = KnowledgeSnapshot(documents, index, time.time())
+
+def _knowledge_reload_thread():
+    """
+    后台重新加载线程：处理完所有待处理的变化后退出
+    """
+    global _knowledge_reloading
+    while True:
+        with _knowledge_reload_lock:
+            changed = set(_knowledge_pending_changed)
+            removed = set(_knowledge_pending_removed)
+            _knowledge_pending_changed.clear()
+            _knowledge_pending_removed.clear()
+            if not changed and not removed:
+                _knowledge_reloading = False
+                return
+        try:
+            reload_changed_knowledge_files(changed, removed)
+            util.log(1, f"知识库重新加载完成，共 {len(_knowledge_snapshot.documents)} 个文件")
+        except Exception as e:
+            util.log(1, f"重新加载知识库时出错: {str(e)}")
+
+def schedule_knowledge_reload(changed, removed):
+    """
+    登记变化的文件，并在后台线程中重新加载（已有线程在运行时由其一并处理）
+    """
+    global _knowledge_reloading
+    with _knowledge_reload_lock:
+        _knowledge_pending_changed.update(changed)
+        _knowledge_pending_changed.difference_update(removed)
+        _knowledge_pending_removed.update(removed)
+        _knowledge_pending_removed.difference_update(changed)
+        if _knowledge_reloading:
+            return
+        _knowledge_reloading = True
+    MyThread(target=_knowledge_reload_thread).start()
 
 def get_knowledge_base():
     """
-    获取知识库，使用缓存机制
+    获取知识库当前快照的内容。文件变化由后台监视器处理，这里不访问文件系统
     
     返回:
-        dict: 知识库内容
+        dict: 知识库内容（只读，不要修改）
     """
-    global _knowledge_base_cache, _knowledge_base_load_time
-    
-    # 如果缓存为空，先初始化
-    if _knowledge_base_cache is None:
+    snapshot = _knowledge_snapshot
+    if snapshot is None:
         init_knowledge_base()
-        return _knowledge_base_cache
-    
-    # 检查文件是否有变化
-    if check_knowledge_base_changes():
-        util.log(1, "检测到知识库文件变化，正在重新加载...")
-        _knowledge_base_cache = load_local_knowledge_base()
-        _knowledge_base_load_time = time.time()
-        util.log(1, f"知识库重新加载完成，共 {len(_knowledge_base_cache)} 个文件")
-    
-    return _knowledge_base_cache
+        snapshot = _knowledge_snapshot
+    return snapshot.documents
 
 
 # 定时保存记忆的线程
@@ -568,19 +330,13 @@ def check_memory_files(username=None):
         os.makedirs(memory_stream_dir)
         util.log(1, f"创建memory_stream目录: {memory_stream_dir}")
     
-    # 检查必要的文件是否存在
-    embeddings_path = os.path.join(memory_stream_dir, "embeddings.json")
+    # 检查必要的文件是否存在（embeddings保存在二进制存储中，首次保存时创建）
     nodes_path = os.path.join(memory_stream_dir, "nodes.json")
     
-    # 检查文件是否存在且不为空
-    is_complete = (os.path.exists(embeddings_path) and os.path.getsize(embeddings_path) > 2 and
-                  os.path.exists(nodes_path) and os.path.getsize(nodes_path) > 2)
+    # 检查文件是否存在且不为空（节点可能只存在于追加日志中）
+    is_complete = NodeJournal(memory_stream_dir).has_data()
     
     # 如果文件不存在，创建空的JSON文件
-    if not os.path.exists(embeddings_path):
-        with open(embeddings_path, 'w', encoding='utf-8') as f:
-            f.write('{}')
-    
     if not os.path.exists(nodes_path):
         with open(nodes_path, 'w', encoding='utf-8') as f:
             f.write('[]')
@@ -651,28 +407,28 @@ def load_agent_memory(agent, username=None):
         memory_dir = get_user_memory_dir(username)
         memory_stream_dir = os.path.join(memory_dir, "memory_stream")
         
-        # 加载nodes.json
-        nodes_path = os.path.join(memory_stream_dir, "nodes.json")
-        if os.path.exists(nodes_path) and os.path.getsize(nodes_path) > 2:  # 文件存在且不为空
-            with open(nodes_path, 'r', encoding='utf-8') as f:
-                nodes_data = json.load(f)
-                
-                # 清空当前的seq_nodes
-                agent.memory_stream.seq_nodes = []
-                agent.memory_stream.id_to_node = {}
-                
-                # 重新创建节点
-                for node_dict in nodes_data:
-                    new_node = ConceptNode(node_dict)
-                    agent.memory_stream.seq_nodes.append(new_node)
-                    agent.memory_stream.id_to_node[new_node.node_id] = new_node
+        # 加载节点：nodes.json快照 + 回放追加日志中的变更
+        journal = NodeJournal(memory_stream_dir)
+        if journal.has_data():
+            nodes_data = journal.load()
+            
+            # 清空当前的seq_nodes
+            agent.memory_stream.seq_nodes = []
+            agent.memory_stream.id_to_node = {}
+            agent.memory_stream.drain_journal()
+            
+            # 重新创建节点
+            for node_dict in nodes_data:
+                new_node = ConceptNode(node_dict)
+                agent.memory_stream.seq_nodes.append(new_node)
+                agent.memory_stream.id_to_node[new_node.node_id] = new_node
+            agent.memory_stream.journal = journal
+        
+        # 近似检索模式下加载已保存的ANN索引
+        agent.load_retrieval_mode(memory_stream_dir)
         
-        # 加载embeddings.json
-        embeddings_path = os.path.join(memory_stream_dir, "embeddings.json")
-        if os.path.exists(embeddings_path) and os.path.getsize(embeddings_path) > 2:  # 文件存在且不为空
-            with open(embeddings_path, 'r', encoding='utf-8') as f:
-                embeddings_data = json.load(f)
-                agent.memory_stream.embeddings = embeddings_data
+        # 加载embeddings（二进制存储，mmap方式打开；旧的embeddings.json会被一次性迁移）
+        agent.memory_stream.embeddings = open_embedding_store(memory_stream_dir)
         
         util.log(1, f"已加载代理记忆")
     except Exception as e:
@@ -702,48 +458,13 @@ def remember_conversation_thread(username, content, response_text):
     except Exception as e:
         util.log(1, f"记忆对话内容出错: {str(e)}")
 
-def question(content, username, observation=None):
+def _retrieve_context(agent, content, username):
     """
-    处理用户问题并返回回答
-    
-    参数:
-        content: 用户问题内容
-        username: 用户名
-        observation: 额外的观察信息，默认为空
-        
+    检索与问题相关的记忆和本地知识库信息
+
     返回:
-        response_text: 回答内容
+        (context, knowledge_context)
     """
-    global agents
-    
-    global current_username
-    current_username = username  # 记录当前会话用户名
-    full_response_text = ""
-    accumulated_text = ""
-    punctuation_marks = [",", "，","。", "！", "？", ".", "!", "?", "\n"]  
-    is_first_sentence = True
-    
-    # 创建代理
-    agent = create_agent(username)
-    
-    # 构建代理描述
-    agent_desc = {
-        "first_name": agent.scratch.get("first_name", "Fay"),
-        "last_name": agent.scratch.get("last_name", ""),
-        "age": agent.scratch.get("age", "成年"),
-        "sex": agent.scratch.get("sex", "女"),
-        "additional": agent.scratch.get("additional", "友好、乐于助人"),
-        "birthplace": agent.scratch.get("birthplace", ""),
-        "position": agent.scratch.get("position", ""),
-        "zodiac": agent.scratch.get("zodiac", ""),
-        "constellation": agent.scratch.get("constellation", ""),
-        "contact": agent.scratch.get("contact", ""),
-        "voice": agent.scratch.get("voice", ""),
-        "goal": agent.scratch.get("goal", ""),
-        "occupation": agent.scratch.get("occupation", "助手"),
-        "current_time": agent.scratch.get("current_time", datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-    }
-    
     # 获取相关记忆作为上下文
     context = ""
     if agent.memory_stream and len(agent.memory_stream.seq_nodes) > 0:
@@ -787,6 +508,99 @@ def question(content, username, observation=None):
     except Exception as e:
         util.log(1, f"搜索知识库时出错: {str(e)}")
 
+    return context, knowledge_context
+
+# 预取的上下文保留时长（秒）与最终问题至少被预取前缀覆盖的比例
+PREFETCH_TTL = 30
+PREFETCH_MIN_COVERAGE = 0.8
+_prefetch_lock = threading.Lock()
+_prefetched = {}  # username -> (规范化的前缀, 预取时间, context, knowledge_context, mcp_tools)
+
+def _normalize_query(text):
+    # 去掉空白和标点，中间结果与最终结果的标点常常不同
+    return re.sub(r"[\s\W_]+", "", text or "")
+
+def prefetch_context(username, text):
+    """
+    用流式识别的稳定前缀提前检索记忆、知识库并获取MCP工具，
+    最终识别结果与前缀一致时question直接复用，不必在识别结束后再检索
+    """
+    prefix = _normalize_query(text)
+    if not prefix:
+        return
+    agent = create_agent(username)
+    context, knowledge_context = _retrieve_context(agent, text, username)
+    mcp_tools = get_mcp_tools()
+    with _prefetch_lock:
+        _prefetched[username] = (prefix, time.time(), context, knowledge_context, mcp_tools)
+
+def _take_prefetched(username, content):
+    """
+    取出可用于本次问题的预取结果：未过期，且最终问题以预取前缀开头、前缀覆盖足够大的比例
+    """
+    with _prefetch_lock:
+        entry = _prefetched.pop(username, None)
+    if entry is None:
+        return None
+    prefix, prefetched_at, context, knowledge_context, mcp_tools = entry
+    final = _normalize_query(content)
+    if time.time() - prefetched_at > PREFETCH_TTL or not final.startswith(prefix):
+        return None
+    if len(prefix) < len(final) * PREFETCH_MIN_COVERAGE:
+        return None
+    return context, knowledge_context, mcp_tools
+
+def question(content, username, observation=None):
+    """
+    处理用户问题并返回回答
+    
+    参数:
+        content: 用户问题内容
+        username: 用户名
+        observation: 额外的观察信息，默认为空
+        
+    返回:
+        response_text: 回答内容
+    """
+    global agents
+    
+    global current_username
+    current_username = username  # 记录当前会话用户名
+    full_response_text = ""
+    accumulated_text = ""
+    punctuation_marks = [",", "，","。", "！", "？", ".", "!", "?", "\n"]  
+    is_first_sentence = True
+    
+    # 创建代理
+    agent = create_agent(username)
+    
+    # 构建代理描述
+    agent_desc = {
+        "first_name": agent.scratch.get("first_name", "Fay"),
+        "last_name": agent.scratch.get("last_name", ""),
+        "age": agent.scratch.get("age", "成年"),
+        "sex": agent.scratch.get("sex", "女"),
+        "additional": agent.scratch.get("additional", "友好、乐于助人"),
+        "birthplace": agent.scratch.get("birthplace", ""),
+        "position": agent.scratch.get("position", ""),
+        "zodiac": agent.scratch.get("zodiac", ""),
+        "constellation": agent.scratch.get("constellation", ""),
+        "contact": agent.scratch.get("contact", ""),
+        "voice": agent.scratch.get("voice", ""),
+        "goal": agent.scratch.get("goal", ""),
+        "occupation": agent.scratch.get("occupation", "助手"),
+        "current_time": agent.scratch.get("current_time", datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    }
+    
+    # 获取相关记忆和知识库作为上下文：流式识别已用稳定前缀预取过时直接复用
+    prefetched = _take_prefetched(username, content)
+    if prefetched is not None:
+        context, knowledge_context, mcp_tools = prefetched
+        util.log(1, "使用识别过程中预取的上下文")
+    else:
+        context, knowledge_context = _retrieve_context(agent, content, username)
+        mcp_tools = None
+
     # 使用文件开头定义的llm对象进行流式请求
     observation = "**还观察的情况**：" + observation + "\n"  if observation else "" 
     
@@ -813,7 +627,8 @@ def question(content, username, observation=None):
     # 构建消息列表
     messages = [SystemMessage(content=system_prompt), HumanMessage(content=content)]
     # 1. 获取mcp工具
-    mcp_tools = get_mcp_tools()
+    if mcp_tools is None:
+        mcp_tools = get_mcp_tools()
     # 2. 存在mcp工具，走react agent
     if mcp_tools:
 
@@ -1145,11 +960,12 @@ def save_agent_memory():
                                 
                             valid_nodes.append(node)
                         
-                        # 更新seq_nodes为有效节点列表
-                        agent.memory_stream.seq_nodes = valid_nodes
-                        
-                        # 重建id_to_node字典
-                        agent.memory_stream.id_to_node = {node.node_id: node for node in valid_nodes if hasattr(node, 'node_id')}
+                        # 有无效节点时才原地更新seq_nodes（保持同一个列表对象，检索引擎不必整体重建）
+                        if len(valid_nodes) != len(agent.memory_stream.seq_nodes):
+                            agent.memory_stream.seq_nodes[:] = valid_nodes
+                            
+                            # 重建id_to_node字典
+                            agent.memory_stream.id_to_node = {node.node_id: node for node in valid_nodes if hasattr(node, 'node_id')}
                     except Exception as e:
                         util.log(1, f"检查记忆完整性时出错: {str(e)}")
                     
@@ -1165,19 +981,10 @@ def save_agent_memory():
                             os.makedirs(memory_stream_dir, exist_ok=True)
                             
                             # 保存embeddings
-                            with open(os.path.join(memory_stream_dir, "embeddings.json"), "w", encoding='utf-8') as f:
-                                json.dump(agent.memory_stream.embeddings or {}, f, ensure_ascii=False, indent=2)
+                            agent.save_embeddings(memory_stream_dir)
                                 
-                            # 保存nodes
-                            with open(os.path.join(memory_stream_dir, "nodes.json"), "w", encoding='utf-8') as f:
-                                nodes_data = []
-                                for node in agent.memory_stream.seq_nodes:
-                                    if node is not None and hasattr(node, 'package'):
-                                        try:
-                                            nodes_data.append(node.package())
-                                        except Exception as node_e:
-                                            util.log(1, f"打包节点时出错: {str(node_e)}")
-                                json.dump(nodes_data, f, ensure_ascii=False, indent=2)
+                            # 保存nodes（写入完整快照并清空追加日志）
+                            save_memory_nodes(agent.memory_stream, memory_stream_dir, compact=True)
                             
                             # 保存meta
                             with open(os.path.join(memory_dir, "meta.json"), "w", encoding='utf-8') as f:
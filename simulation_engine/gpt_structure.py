@@ -3,6 +3,11 @@ import time
 import base64
 from typing import List, Dict, Any, Union, Optional
 import os
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
 from simulation_engine.settings import *
 from utils import config_util as cfg
 
@@ -255,27 +260,208 @@ def _create_mock_embedding(dimension=1536):
 # 创建模拟函数实例
 _mock_embedding_function = _create_mock_embedding(1536)
 
-def get_text_embedding(text: str, 
-                       model: str = "text-embedding-3-small") -> List[float]:
-  """生成文本的embedding向量，使用模拟函数"""
-  try:
-    # 确保输入是有效的字符串
+EMBEDDING_DIM = 1536
+EMBEDDING_LRU_SIZE = 4096
+EMBEDDING_CACHE_DB = f"{BASE_DIR}/cache_data/embedding_cache.db"
+# 模拟embedding的后端标识：模拟向量随时可以重新算出，不写入缓存
+MOCK_EMBEDDING_BACKEND = "mock-sha256"
+# 当前计算embedding的后端标识，参与缓存键：更换后端（例如接入真实接口）后旧结果不会再被命中
+EMBEDDING_BACKEND = MOCK_EMBEDDING_BACKEND
+
+
+def _normalize_embedding_text(text: str) -> str:
+  """标准化文本，替换换行符并去除首尾空格"""
+  return text.replace("\n", " ").strip()
+
+
+def _embedding_cache_key(text: str, model: str) -> str:
+  """(后端, model, text)的内容哈希，作为内存与磁盘缓存的键"""
+  return hashlib.sha256(f"{EMBEDDING_BACKEND}\0{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+  """
+  以(后端, model, text)内容哈希为键的两级embedding缓存：
+  进程内有界LRU + cache_data下的SQLite磁盘缓存（重启后仍然有效，连接由连接池复用）。
+  向量统一以float32精度保存和返回，无论命中的是LRU还是磁盘，结果都相同。
+  """
+  def __init__(self, db_path: str = EMBEDDING_CACHE_DB,
+               max_entries: int = EMBEDDING_LRU_SIZE):
+    self.db_path = db_path
+    self.max_entries = max_entries
+    self._lru = OrderedDict()
+    self._lock = threading.RLock()
+    self._pool = None
+    self._db_ready = False
+    self.stats = {"lru_hits": 0, "disk_hits": 0, "misses": 0}
+
+  def _ensure_table(self):
+    if self._pool is None:
+      # 第一次访问磁盘缓存时才打开数据库
+      from core.sqlite_pool import get_pool
+      self._pool = get_pool(self.db_path)
+    if not self._db_ready:
+      with self._pool.write() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS T_Embedding ("
+                     "key TEXT PRIMARY KEY, model TEXT, vector BLOB)")
+      self._db_ready = True
+
+  def _remember(self, key: str, vector: List[float]) -> None:
+    self._lru[key] = vector
+    self._lru.move_to_end(key)
+    while len(self._lru) > self.max_entries:
+      self._lru.popitem(last=False)
+
+  def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+    """查询一组键，返回命中的部分；先查LRU，再批量查磁盘"""
+    found = {}
+    with self._lock:
+      pending = []
+      for key in keys:
+        if key in self._lru:
+          self._lru.move_to_end(key)
+          found[key] = self._lru[key]
+          self.stats["lru_hits"] += 1
+        else:
+          pending.append(key)
+
+      if pending:
+        try:
+          self._ensure_table()
+          with self._pool.connection() as conn:
+            for i in range(0, len(pending), 500):
+              chunk = pending[i:i + 500]
+              rows = conn.execute(
+                "SELECT key, vector FROM T_Embedding WHERE key IN (%s)"
+                % ",".join("?" * len(chunk)), chunk).fetchall()
+              for key, blob in rows:
+                vector = array("f", blob).tolist()
+                found[key] = vector
+                self._remember(key, vector)
+                self.stats["disk_hits"] += 1
+        except sqlite3.Error as e:
+          print(f"读取embedding磁盘缓存时出错: {str(e)}")
+
+      self.stats["misses"] += len(keys) - len(found)
+    return found
+
+  def put_many(self, model: str, items: Dict[str, List[float]]) -> None:
+    """写入一批新计算的embedding（LRU + 磁盘，一个事务提交），调用方应先用to_float32转换"""
+    if not items:
+      return
+    with self._lock:
+      for key, vector in items.items():
+        self._remember(key, vector)
+      try:
+        self._ensure_table()
+        with self._pool.write() as conn:
+          conn.executemany(
+            "INSERT OR REPLACE INTO T_Embedding (key, model, vector) VALUES (?, ?, ?)",
+            [(key, f"{EMBEDDING_BACKEND}/{model}", array("f", vector).tobytes())
+             for key, vector in items.items()])
+      except sqlite3.Error as e:
+        print(f"写入embedding磁盘缓存时出错: {str(e)}")
+
+  def get_stats(self) -> Dict[str, Any]:
+    with self._lock:
+      stats = dict(self.stats)
+      lookups = stats["lru_hits"] + stats["disk_hits"] + stats["misses"]
+      stats["lru_size"] = len(self._lru)
+      stats["hit_rate"] = ((stats["lru_hits"] + stats["disk_hits"]) / lookups
+                           if lookups else 0.0)
+      return stats
+
+
+def to_float32(vector: List[float]) -> List[float]:
+  """把向量舍入到float32精度（与磁盘缓存中保存的精度一致）"""
+  return array("f", vector).tolist()
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def _get_embedding_cache() -> EmbeddingCache:
+  """embedding缓存在第一次使用时创建，导入本模块不会访问文件系统"""
+  global _embedding_cache
+  with _embedding_cache_lock:
+    if _embedding_cache is None:
+      _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
+def get_embedding_cache_stats() -> Dict[str, Any]:
+  """返回embedding缓存的命中/未命中统计"""
+  return _get_embedding_cache().get_stats()
+
+
+def _embed_batch(texts: List[str], model: str) -> List[List[float]]:
+  """
+  批量计算embedding的后端。目前使用模拟函数；接入真实接口时在这里一次性
+  请求整批文本（client.embeddings.create(input=texts, model=model)），
+  并同时修改EMBEDDING_BACKEND，避免命中模拟函数留下的缓存。
+  """
+  return [_mock_embedding_function(text) for text in texts]
+
+
+def get_text_embeddings(texts: List[str], 
+                        model: str = "text-embedding-3-small") -> List[List[float]]:
+  """
+  批量生成文本的embedding向量。
+
+  相同内容（按(model, text)哈希）只计算一次：先查进程内LRU和磁盘缓存，
+  未命中的文本去重后一次性交给后端计算，再写回缓存（模拟向量不经过缓存）。
+  返回的向量统一为float32精度。
+
+  参数:
+    texts: 文本列表
+    model: embedding模型名称
+  返回:
+    与texts一一对应的embedding列表
+  """
+  results = [None] * len(texts)
+  keyed = {}
+  for i, text in enumerate(texts):
+    # 非字符串或空字符串返回默认embedding，不进入缓存
     if not isinstance(text, str):
       print("Embedding错误: 输入必须是字符串类型")
-      return [0.0] * 1536  # 返回默认embedding
-    
-    # 处理空字符串
+      results[i] = [0.0] * EMBEDDING_DIM
+      continue
     if not text.strip():
       print("Embedding警告: 输入字符串为空")
-      return [0.0] * 1536  # 返回默认embedding
-    
-    # 标准化文本，替换换行符并去除首尾空格
-    text = text.replace("\n", " ").strip()
-    
-    # 使用模拟函数生成embedding
-    return _mock_embedding_function(text)
-  except Exception as e:
-    # 捕获所有异常，确保函数不会崩溃
-    print(f"生成embedding时出错: {str(e)}")
-    # 返回一个默认的embedding
-    return [0.0] * 1536
+      results[i] = [0.0] * EMBEDDING_DIM
+      continue
+    text = _normalize_embedding_text(text)
+    key = _embedding_cache_key(text, model)
+    keyed.setdefault(key, (text, []))[1].append(i)
+
+  if keyed:
+    try:
+      # 模拟向量不经过缓存：既不写入，也不必查询
+      cache = None if EMBEDDING_BACKEND == MOCK_EMBEDDING_BACKEND else _get_embedding_cache()
+      found = cache.get_many(list(keyed.keys())) if cache is not None else {}
+      missing = [key for key in keyed if key not in found]
+      if missing:
+        vectors = _embed_batch([keyed[key][0] for key in missing], model)
+        computed = {key: to_float32(vector) for key, vector in zip(missing, vectors)}
+        if cache is not None:
+          cache.put_many(model, computed)
+        found.update(computed)
+      for key, (text, positions) in keyed.items():
+        for i in positions:
+          results[i] = found[key]
+    except Exception as e:
+      # 捕获所有异常，确保函数不会崩溃
+      print(f"生成embedding时出错: {str(e)}")
+      for key, (text, positions) in keyed.items():
+        for i in positions:
+          if results[i] is None:
+            results[i] = [0.0] * EMBEDDING_DIM
+
+  return results
+
+
+def get_text_embedding(text: str, 
+                       model: str = "text-embedding-3-small") -> List[float]:
+  """生成文本的embedding向量（经过批量接口与缓存）"""
+  return get_text_embeddings([text], model)[0]
@@ -5,8 +5,10 @@ from aliyunsdkcore.client import AcsClient
 from aliyunsdkcore.request import CommonRequest
 from core.authorize_tb import Authorize_Tb
 import time
+import uuid
 from utils import util, config_util
 from utils import config_util as cfg
+from tts.tts_cache import get_tts_cache
 import wave
 
 class Speech:
@@ -16,17 +18,11 @@ class Speech:
         self.ali_nls_app_key = cfg.key_ali_tss_app_key
         self.token = None
         self.authorize_tb = Authorize_Tb()
-        self.__history_data = []
+        self.__cache = get_tts_cache()
 
     def connect(self):
         pass
 
-    def __get_history(self, voice_name, style, text):
-        for data in self.__history_data:
-            if data[0] == voice_name and data[1] == style and data[2] == text:
-                return data[3]
-        return None    
-
     def set_token(self):
         token = self.__check_token()
         if token is None or token == 'expired':
@@ -83,7 +79,8 @@ class Speech:
     def to_sample(self, text, style) :
         file_url = None
         try:
-            history = self.__get_history(config_util.config["attribute"]["voice"] if config_util.config["attribute"]["voice"] is not None and config_util.config["attribute"]["voice"].strip() != "" else "阿斌", style, text)
+            voice = config_util.config["attribute"]["voice"] if config_util.config["attribute"]["voice"] is not None and config_util.config["attribute"]["voice"].strip() != "" else "阿斌"
+            history = self.__cache.get('ali', voice, style, text)
             if history is not None:
                 return history
             self.set_token()
@@ -106,7 +103,7 @@ class Speech:
                 contentType = response.getheader('Content-Type')
                 body = response.read()
                 if 'audio/mpeg' == contentType :
-                    file_url = './samples/sample-' + str(int(time.time() * 1000)) + '.mp3'
+                    file_url = './samples/sample-' + str(int(time.time() * 1000)) + '-' + uuid.uuid4().hex[:8] + '.mp3'
                     with wave.open(file_url, 'wb') as wf:
                         wf.setnchannels(1)
                         wf.setsampwidth(2)
@@ -119,7 +116,7 @@ class Speech:
                     file_url = None
                     return file_url
                 conn.close() 
-                return file_url
+                return self.__cache.put('ali', voice, style, text, file_url)
             else:
                 util.log(1, "[x] 语音转换失败！")
                 util.log(1, "[x] 原因: 对接有误" )
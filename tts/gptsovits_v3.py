@@ -1,5 +1,6 @@
 import requests
 import time
+import uuid
 from utils import util
 import wave
 class Speech:
@@ -39,7 +40,7 @@ class Speech:
     }
         try:
             response = requests.post(url, json=data)
-            file_url = './samples/sample-' + str(int(time.time() * 1000)) + '.wav'
+            file_url = './samples/sample-' + str(int(time.time() * 1000)) + '-' + uuid.uuid4().hex[:8] + '.wav'
             if response.status_code == 200:
                 with wave.open(file_url, 'wb') as wf:
                         wf.setnchannels(1)
@@ -1,14 +1,23 @@
+import io
 import time
+import uuid
+import wave
 import asyncio
 import azure.cognitiveservices.speech as speechsdk
-import asyncio
 from tts import tts_voice
 from tts.tts_voice import EnumVoice
 from utils import util, config_util
 from utils import config_util as cfg
+from tts.tts_cache import get_tts_cache
 import edge_tts
 from pydub import AudioSegment
 
+# 微软TTS输出的原始PCM格式（16kHz 16bit 单声道）
+MS_SAMPLE_RATE = 16000
+# edge-tts输出mp3（24kHz），解码后与以前一样重采样为44.1kHz，播放端和数字人拿到的音频格式不变
+EDGE_SAMPLE_RATE = 44100
+PCM_CHUNK_BYTES = 3200
+
 class Speech:
     def __init__(self):
         self.ms_tts = False
@@ -20,18 +29,11 @@ class Speech:
             self.__speech_config = speechsdk.SpeechConfig(subscription=cfg.key_ms_tts_key, region=cfg.key_ms_tts_region)
             self.__speech_config.speech_recognition_language = "zh-CN"
             self.__speech_config.speech_synthesis_voice_name = voice_name
-            self.__speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat.Riff16Khz16BitMonoPcm)
+            self.__speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat.Raw16Khz16BitMonoPcm)
             self.__synthesizer = speechsdk.SpeechSynthesizer(speech_config=self.__speech_config, audio_config=None)
             self.ms_tts = True
         self.__connection = None
-        self.__history_data = []
-
-
-    def __get_history(self, voice_name, style, text):
-        for data in self.__history_data:
-            if data[0] == voice_name and data[1] == style and data[2] == text:
-                return data[3]
-        return None
+        self.__cache = get_tts_cache()
 
     def connect(self):
         if self.ms_tts:
@@ -43,19 +45,55 @@ class Speech:
         if self.__connection is not None:
             self.__connection.close()
 
-    #生成mp3音频
-    async def get_edge_tts(self,text,voice,file_url) -> None:
+    #边接收边收集edge-tts的mp3数据（不落盘）
+    async def get_edge_tts_bytes(self, text, voice):
         communicate = edge_tts.Communicate(text, voice)
-        await communicate.save(file_url)
+        data = bytearray()
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                data.extend(chunk["data"])
+        return bytes(data)
 
-    def convert_mp3_to_wav(self, mp3_filepath):
-        audio = AudioSegment.from_mp3(mp3_filepath)
-        # 使用 set_frame_rate 方法设置采样率
-        audio = audio.set_frame_rate(44100)
-        wav_filepath = mp3_filepath.rsplit(".", 1)[0] + ".wav"
-        audio.export(wav_filepath, format="wav")
-        return wav_filepath
+    def __get_voice_name(self, default_voice=None):
+        voice = config_util.config["attribute"]["voice"]
+        if default_voice is not None and (voice is None or voice.strip() == ""):
+            voice = default_voice
+        voice_type = tts_voice.get_voice_of(voice)
+        voice_name = EnumVoice.XIAO_XIAO.value["voiceName"]
+        if voice_type is not None:
+            voice_name = voice_type.value["voiceName"]
+        return voice_name
+
+    def __stream_ms(self, text):
+        result = self.__synthesizer.start_speaking_text_async(text).get()
+        audio_data_stream = speechsdk.AudioDataStream(result)
+        buffer = bytes(PCM_CHUNK_BYTES)
+        while True:
+            size = audio_data_stream.read_data(buffer)
+            if size == 0:
+                break
+            yield buffer[:size]
+        if audio_data_stream.status == speechsdk.StreamStatus.Canceled:
+            details = audio_data_stream.cancellation_details
+            raise RuntimeError(f"{details.reason} {details.error_details}")
 
+    def __stream_edge(self, text, voice_name):
+        mp3_data = asyncio.new_event_loop().run_until_complete(self.get_edge_tts_bytes(text, voice_name))
+        if not mp3_data:
+            raise RuntimeError("edge-tts未返回音频")
+        audio = AudioSegment.from_file(io.BytesIO(mp3_data), format="mp3").set_channels(1).set_sample_width(2)
+        pcm = audio.set_frame_rate(EDGE_SAMPLE_RATE).raw_data
+        for start in range(0, len(pcm), PCM_CHUNK_BYTES):
+            yield pcm[start:start + PCM_CHUNK_BYTES]
+
+    #合成16bit单声道PCM，返回(采样率, PCM数据块迭代器)
+    #微软TTS的数据块在合成过程中陆续产生；edge-tts只提供mp3，要等整段mp3收齐后一次解码
+    def __synthesize_pcm(self, text):
+        if self.ms_tts:
+            # 微软TTS边合成边返回
+            return MS_SAMPLE_RATE, self.__stream_ms(text)
+        # edge-tts只提供mp3，收集完成后在内存中解码一次
+        return EDGE_SAMPLE_RATE, self.__stream_edge(text, self.__get_voice_name())
 
     """
     文字转语音
@@ -65,59 +103,30 @@ class Speech:
     """
 
     def to_sample(self, text, style):
-        if self.ms_tts:
-            voice_type = tts_voice.get_voice_of(config_util.config["attribute"]["voice"] if config_util.config["attribute"]["voice"] is not None and config_util.config["attribute"]["voice"].strip() != "" else "晓晓(edge)")
-            voice_name = EnumVoice.XIAO_XIAO.value["voiceName"]
-            if voice_type is not None:
-                voice_name = voice_type.value["voiceName"]
-            history = self.__get_history(voice_name, style, text)
-            if history is not None:
-                return history
-            ssml = '<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xmlns:mstts="https://www.w3.org/2001/mstts" xml:lang="zh-CN">' \
-                   '<voice name="{}">' \
-                   '<mstts:express-as style="{}" styledegree="{}">' \
-                   '{}' \
-                   '</mstts:express-as>' \
-                   '</voice>' \
-                   '</speak>'.format(voice_name, style, 1.8, "<break time='0.2s'/>" + text)
-            result = self.__synthesizer.speak_text_async(text).get()
-            # result = self.__synthesizer.speak_ssml(ssml)#感觉使用sepak_text_async要快很多
-            audio_data_stream = speechsdk.AudioDataStream(result)
-            file_url = './samples/sample-' + str(int(time.time() * 1000)) + '.wav'
-            audio_data_stream.save_to_wav_file(file_url)
-            if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-                wav_url = file_url
-                self.__history_data.append((voice_name, style, text, wav_url))
-                return wav_url
-            else:
-                util.log(1, "[x] 语音转换失败！")
-                util.log(1, "[x] 原因: " + str(result.reason))
-                return None
-        else:
-            voice_type = tts_voice.get_voice_of(config_util.config["attribute"]["voice"])
-            voice_name = EnumVoice.XIAO_XIAO.value["voiceName"]
-            if voice_type is not None:
-                voice_name = voice_type.value["voiceName"]
-            history = self.__get_history(voice_name, style, text)
-            if history is not None:
-                return history
-            ssml = '<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xmlns:mstts="https://www.w3.org/2001/mstts" xml:lang="zh-CN">' \
-                   '<voice name="{}">' \
-                   '<mstts:express-as style="{}" styledegree="{}">' \
-                   '{}' \
-                   '</mstts:express-as>' \
-                   '</voice>' \
-                   '</speak>'.format(voice_name, style, 1.8, text)
-            try:
-                file_url = './samples/sample-' + str(int(time.time() * 1000)) + '.mp3'
-                asyncio.new_event_loop().run_until_complete(self.get_edge_tts(text,voice_name,file_url))
-                wav_url = self.convert_mp3_to_wav(file_url)
-                self.__history_data.append((voice_name, style, text, wav_url))
-            except Exception as e :
-                util.log(1, "[x] 语音转换失败！")
-                util.log(1, "[x] 原因: " + str(str(e)))
-                wav_url = None
-            return wav_url
+        engine = 'ms' if self.ms_tts else 'edge'
+        voice_name = self.__get_voice_name("晓晓(edge)" if self.ms_tts else None)
+        history = self.__cache.get(engine, voice_name, style, text)
+        if history is not None:
+            return history
+        try:
+            sample_rate, chunks = self.__synthesize_pcm(text)
+            # 需要文件地址的使用方（面板播放、数字人、远程设备）才落盘，直接写入wav，不再经过mp3中转
+            file_url = './samples/sample-' + str(int(time.time() * 1000)) + '-' + uuid.uuid4().hex[:8] + '.wav'
+            frames = 0
+            with wave.open(file_url, 'wb') as wf:
+                wf.setnchannels(1)
+                wf.setsampwidth(2)
+                wf.setframerate(sample_rate)
+                for chunk in chunks:
+                    wf.writeframes(chunk)
+                    frames += len(chunk) // 2
+            if frames == 0:
+                raise RuntimeError("未合成音频")
+            return self.__cache.put(engine, voice_name, style, text, file_url)
+        except Exception as e :
+            util.log(1, "[x] 语音转换失败！")
+            util.log(1, "[x] 原因: " + str(str(e)))
+            return None
 
 
 if __name__ == '__main__':
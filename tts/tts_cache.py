@@ -0,0 +1,181 @@
+"""
+TTS合成结果缓存
+
+按hash(引擎, 音色, 风格, 文本)缓存合成好的音频文件，索引保存在cache_data下的SQLite中，
+重启后仍然有效。缓存文件放在./samples下（文件名以tts-开头，不会被启动时的音频清理删除），
+总大小超过上限或长期未使用的文件按LRU淘汰。
+"""
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from utils import util
+
+TTS_CACHE_DB = os.path.join("cache_data", "tts_cache.db")
+TTS_CACHE_DIR = "./samples"
+# 缓存文件总大小上限（字节）
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+# 超过该时间（秒）未使用的缓存文件会被淘汰
+MAX_CACHE_AGE = 30 * 24 * 3600
+
+
+def tts_cache_key(engine, voice, style, text):
+    raw = "\x1f".join(str(part) for part in (engine, voice, style, text))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TtsCache:
+    """
+    TTS音频缓存
+
+    内存中保存按最近使用排序的索引（OrderedDict，O(1)查找与更新），
+    每次变化同步写入SQLite；启动时从SQLite恢复，并丢弃文件已不存在的记录。
+    """
+
+    def __init__(self, db_path=TTS_CACHE_DB, cache_dir=TTS_CACHE_DIR,
+                 max_bytes=MAX_CACHE_BYTES, max_age=MAX_CACHE_AGE):
+        self.db_path = db_path
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()  # key -> [path, size, last_used]，最久未使用的在前
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn = None
+        self._load()
+
+    def _db(self):
+        if self._conn is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS T_TtsCache ("
+                               "key TEXT PRIMARY KEY, path TEXT, size INTEGER, "
+                               "created REAL, last_used REAL)")
+            self._conn.commit()
+        return self._conn
+
+    def _load(self):
+        try:
+            with self.lock:
+                conn = self._db()
+                rows = conn.execute("SELECT key, path, size, last_used FROM T_TtsCache "
+                                    "ORDER BY last_used").fetchall()
+                missing = []
+                for key, path, size, last_used in rows:
+                    if os.path.exists(path):
+                        self.entries[key] = [path, size, last_used]
+                        self.total_bytes += size
+                    else:
+                        missing.append((key,))
+                if missing:
+                    conn.executemany("DELETE FROM T_TtsCache WHERE key = ?", missing)
+                    conn.commit()
+        except sqlite3.Error as e:
+            util.log(1, f"加载TTS缓存索引失败: {str(e)}")
+
+    def get(self, engine, voice, style, text):
+        """
+        查询缓存
+        :return: 缓存的音频文件路径，未命中返回None
+        """
+        key = tts_cache_key(engine, voice, style, text)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and not os.path.exists(entry[0]):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry[2] = time.time()
+            self.entries.move_to_end(key)
+            try:
+                self._db().execute("UPDATE T_TtsCache SET last_used = ? WHERE key = ?", (entry[2], key))
+                self._db().commit()
+            except sqlite3.Error as e:
+                util.log(1, f"更新TTS缓存索引失败: {str(e)}")
+            return entry[0]
+
+    def put(self, engine, voice, style, text, file_url):
+        """
+        把合成好的音频文件加入缓存。文件会被移动到以缓存键命名的位置
+        :return: 缓存后的文件路径（加入失败时返回原路径）
+        """
+        if file_url is None or not os.path.exists(file_url):
+            return file_url
+        key = tts_cache_key(engine, voice, style, text)
+        ext = os.path.splitext(file_url)[1]
+        path = os.path.join(self.cache_dir, f"tts-{key[:32]}{ext}")
+        try:
+            with self.lock:
+                if key in self.entries:
+                    self._remove(key)
+                os.replace(file_url, path)
+                size = os.path.getsize(path)
+                now = time.time()
+                self.entries[key] = [path, size, now]
+                self.total_bytes += size
+                self._db().execute("INSERT OR REPLACE INTO T_TtsCache (key, path, size, created, last_used) "
+                                   "VALUES (?, ?, ?, ?, ?)", (key, path, size, now, now))
+                self._db().commit()
+                self._evict()
+                return path
+        except (OSError, sqlite3.Error) as e:
+            util.log(1, f"写入TTS缓存失败: {str(e)}")
+            return path if os.path.exists(path) else file_url
+
+    def _remove(self, key, delete_file=False):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.total_bytes -= entry[1]
+        if delete_file:
+            try:
+                os.remove(entry[0])
+            except OSError:
+                pass
+        self._db().execute("DELETE FROM T_TtsCache WHERE key = ?", (key,))
+        self._db().commit()
+
+    def _evict(self):
+        # 调用方需持有self.lock；最近一次使用的条目永远保留
+        expire_before = time.time() - self.max_age
+        while len(self.entries) > 1:
+            key, (path, size, last_used) = next(iter(self.entries.items()))
+            if self.total_bytes <= self.max_bytes and last_used >= expire_before:
+                break
+            self._remove(key, delete_file=True)
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+
+__tts_cache = None
+__tts_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    global __tts_cache
+    with __tts_cache_lock:
+        if __tts_cache is None:
+            __tts_cache = TtsCache()
+        return __tts_cache
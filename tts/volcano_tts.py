@@ -5,6 +5,7 @@ import requests
 import time
 from utils import util, config_util
 from utils import config_util as cfg
+from tts.tts_cache import get_tts_cache
 import wave
 
 
@@ -13,24 +14,18 @@ class Speech:
         self.appid = cfg.volcano_tts_appid
         self.access_token = cfg.volcano_tts_access_token
         self.cluster = cfg.volcano_tts_cluster
-        self.__history_data = []
+        self.__cache = get_tts_cache()
 
     def connect(self):
         pass
 
-    def __get_history(self, voice_name, style, text):
-        for data in self.__history_data:
-            if data[0] == voice_name and data[1] == style and data[2] == text:
-                return data[3]
-        return None    
-
     def to_sample(self, text, style) :
         if cfg.volcano_tts_voice_type != None and cfg.volcano_tts_voice_type != '':
             voice = cfg.volcano_tts_voice_type
         else:
             voice = config_util.config["attribute"]["voice"] if config_util.config["attribute"]["voice"] is not None and config_util.config["attribute"]["voice"].strip() != "" else "爽快思思/Skye"
         try:
-            history = self.__get_history(voice, style, text)
+            history = self.__cache.get('volcano', voice, style, text)
             if history is not None:
                 return history           
             host = "openspeech.bytedance.com"
@@ -66,12 +61,13 @@ class Speech:
             response = requests.post(api_url, json.dumps(request_json), headers=header)
             if "data" in response.json():
                 data = response.json()["data"]
-                file_url = './samples/sample-' + str(int(time.time() * 1000)) + '.wav'
+                file_url = './samples/sample-' + str(int(time.time() * 1000)) + '-' + uuid.uuid4().hex[:8] + '.wav'
                 with wave.open(file_url, 'wb') as wf:
                         wf.setnchannels(1)
                         wf.setsampwidth(2)
                         wf.setframerate(24000)
                         wf.writeframes(base64.b64decode(data))
+                file_url = self.__cache.put('volcano', voice, style, text, file_url)
             else :
                 util.log(1, "[x] 语音转换失败！")
                 file_url = None
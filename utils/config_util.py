@@ -1,10 +1,13 @@
 import os
 import json
+import time
 import codecs
 from langsmith.schemas import Feedback
 import requests
 from configparser import ConfigParser
 import functools
+from collections import namedtuple
+from types import MappingProxyType
 from threading import Lock
 import threading
 from utils import util
@@ -54,6 +57,22 @@ fay_url = None
 system_conf_path = None
 config_json_path = None
 
+# 配置快照：每次重新加载生成一个新的快照对象并整体替换，读取方拿到的快照不会再变化
+#   version: 配置版本号，每次重新加载加1，热循环只需比较版本号即可判断配置是否变化
+#   config: 加载时config.json内容的只读副本（dict转为MappingProxyType、list转为tuple），之后修改全局config不影响快照
+#   system_config: 加载时的ConfigParser对象（与全局system_config共用，不要修改）
+#   values: 与load_config()返回的字典内容相同（只读）
+#   mtimes: 加载时system.conf与config.json的修改时间
+ConfigSnapshot = namedtuple('ConfigSnapshot', ['version', 'config', 'system_config', 'values', 'mtimes'])
+config_version = 0
+_snapshot = None
+_last_check_time = 0
+# get_snapshot()检查配置文件修改时间的最小间隔（秒），间隔内直接返回缓存的快照
+MTIME_CHECK_INTERVAL = 1.0
+_subscribers = []
+# 本机IP只解析一次（fay_url未配置时使用）
+_local_ip = None
+
 # config server中心配置，system.conf与config.json存在时不会使用配置中心
 CONFIG_SERVER = {
     'BASE_URL': 'http://219.135.170.56:5500',  # 默认API服务器地址
@@ -140,10 +159,18 @@ def load_config_from_api(project_id=None):
     
     return None
 
-@synchronized
-def load_config():
+def _config_mtimes():
+    mtimes = []
+    for path in (system_conf_path, config_json_path):
+        try:
+            mtimes.append(os.path.getmtime(path))
+        except (OSError, TypeError):
+            mtimes.append(None)
+    return tuple(mtimes)
+
+def _read_config():
     """
-    加载配置文件，如果本地文件不存在则直接使用API加载
+    读取并解析配置文件，如果本地文件不存在则直接使用API加载
     
     Returns:
         包含配置信息的字典
@@ -180,6 +207,7 @@ def load_config():
     global CONFIG_SERVER
     global system_conf_path
     global config_json_path
+    global _local_ip
 
     # 构建system.conf和config.json的完整路径
     if system_conf_path is None or config_json_path is None:
@@ -241,9 +269,10 @@ def load_config():
     fay_url = system_config.get('key', 'fay_url', fallback=None)
     # 如果fay_url为空或None，则动态获取本机IP地址
     if not fay_url:
-        from utils.util import get_local_ip
-        local_ip = get_local_ip()
-        fay_url = f"http://{local_ip}:5000"
+        if _local_ip is None:
+            from utils.util import get_local_ip
+            _local_ip = get_local_ip()
+        fay_url = f"http://{_local_ip}:5000"
         # 更新system_config中的值，但不写入文件
         if not system_config.has_section('key'):
             system_config.add_section('key')
@@ -290,6 +319,84 @@ def load_config():
     
     return config_dict
 
+def _freeze(value):
+    """
+    深拷贝并冻结配置数据：dict转为只读的MappingProxyType，list转为tuple
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def _refresh_config(force=False):
+    """
+    配置文件有变化（或force）时重新加载并生成新快照，调用方需持有lock
+    
+    Returns:
+        是否重新加载了配置
+    """
+    global _snapshot, config_version, _last_check_time
+    
+    _last_check_time = time.monotonic()
+    if not force and _snapshot is not None and _config_mtimes() == _snapshot.mtimes:
+        return False
+    config_dict = _read_config()
+    config_version += 1
+    _snapshot = ConfigSnapshot(config_version, _freeze(config), system_config,
+                               MappingProxyType(config_dict), _config_mtimes())
+    return True
+
+def _notify_subscribers(snapshot):
+    for callback in list(_subscribers):
+        try:
+            callback(snapshot)
+        except Exception as e:
+            util.log(1, f"配置变更通知出错: {str(e)}")
+
+def load_config(force=False):
+    """
+    加载配置。配置文件未变化时直接使用已解析的配置，不重新读取文件
+    
+    Args:
+        force: 是否强制重新读取
+    
+    Returns:
+        包含配置信息的字典
+    """
+    with lock:
+        reloaded = _refresh_config(force)
+        snapshot = _snapshot
+    if reloaded:
+        _notify_subscribers(snapshot)
+    return dict(snapshot.values)
+
+def get_snapshot():
+    """
+    获取当前配置快照。最多每MTIME_CHECK_INTERVAL秒检查一次配置文件，适合在热循环中调用
+    
+    Returns:
+        ConfigSnapshot
+    """
+    snapshot = _snapshot
+    if snapshot is None or time.monotonic() - _last_check_time >= MTIME_CHECK_INTERVAL:
+        load_config()
+        snapshot = _snapshot
+    return snapshot
+
+def subscribe(callback):
+    """
+    订阅配置变更，配置重新加载后以新的ConfigSnapshot调用callback
+    """
+    with lock:
+        if callback not in _subscribers:
+            _subscribers.append(callback)
+
+def unsubscribe(callback):
+    with lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
 def save_api_config_to_local(api_config, system_conf_path, config_json_path):
     """
     将API加载的配置保存到本地文件
@@ -316,23 +423,26 @@ def save_api_config_to_local(api_config, system_conf_path, config_json_path):
     except Exception as e:
         util.log(2, f"保存配置中心配置缓存到本地文件时出错: {str(e)}")
 
-@synchronized
 def save_config(config_data):
     """
-    保存配置到config.json文件
+    保存配置到config.json文件，并立即生成新的配置快照
     
     Args:
         config_data: 要保存的配置数据
-        config_dir: 配置文件目录，如果为None则使用当前目录
     """
     global config
     global config_json_path
     
-    config = config_data
-    
-    # 保存到文件
-    with codecs.open(config_json_path, mode='w', encoding='utf-8') as file:
-        file.write(json.dumps(config_data, sort_keys=True, indent=4, separators=(',', ': ')))
+    with lock:
+        config = config_data
+        
+        # 保存到文件
+        with codecs.open(config_json_path, mode='w', encoding='utf-8') as file:
+            file.write(json.dumps(config_data, sort_keys=True, indent=4, separators=(',', ': ')))
+        
+        _refresh_config(force=True)
+        snapshot = _snapshot
+    _notify_subscribers(snapshot)
 
 import configparser
 
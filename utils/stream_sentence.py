@@ -1,5 +1,12 @@
+import asyncio
 import threading
 import functools
+import time
+
+from utils import util
+
+# 丢弃句子的日志最多每隔这么多秒输出一次（附带期间丢弃的句数）
+DROP_LOG_INTERVAL = 5
 
 def synchronized(func):
     @functools.wraps(func)
@@ -8,44 +15,191 @@ def synchronized(func):
             return func(self, *args, **kwargs)
     return wrapper
 
+def _wake_future(future):
+    if not future.done():
+        future.set_result(None)
+
+class SentenceReader:
+    """
+    SentenceCache的一个消费者，拥有独立的读取位置。
+    多个消费者读取同一个缓存时，每句话每个消费者都会读到一次。
+    """
+    def __init__(self, cache, name=None):
+        self.cache = cache
+        self.name = name
+        self.position = cache.write_seq
+
+    def read(self, block=False, timeout=None):
+        """
+        读取下一句
+        :param block: 没有句子时是否阻塞等待
+        :param timeout: 阻塞等待的超时时间（秒），None表示一直等待
+        :return: 句子，没有可读句子（或超时、缓存已关闭）时返回None
+        """
+        return self.cache._read(self, block, timeout)
+
+    def pending(self):
+        """
+        未读取的句子数
+        """
+        return self.cache.write_seq - self.position
+
+    @property
+    def closed(self):
+        """
+        缓存已关闭（流被回收），之后不会再有新句子，读取循环应退出
+        """
+        return self.cache.closed
+
+    async def aread(self, timeout=None):
+        """
+        read的协程版本：等待期间不占用线程
+        """
+        return await self.cache._aread(self, timeout)
+
+    def write(self, sentence):
+        return self.cache.write(sentence)
+
+    def clear(self):
+        self.cache.clear()
+
+    def close(self):
+        self.cache.unsubscribe(self)
+
 class SentenceCache:
+    """
+    句子环形缓冲区
+
+    写入方写入后通过条件变量唤醒阻塞等待的读取方（协程读取方通过事件循环唤醒），
+    读取方空闲时不再需要轮询。
+    支持多个消费者（subscribe），缓冲区中每句话对每个消费者各投递一次。
+    缓冲区满时丢弃最慢消费者最旧的句子，不阻塞写入方。
+    """
     def __init__(self, max_sentences):
         self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
         self.buffer = [None] * max_sentences
         self.max_sentences = max_sentences
-        self.writeIndex = 0
-        self.readIndex = 0
-        self.idle = 0
+        self.write_seq = 0
+        self.closed = False
+        self.dropped = 0
+        self.__unlogged_drops = 0
+        self.__last_drop_log = 0
+        self.waiting = 0  # 正在阻塞等待的读取方数
+        self.readers = []
+        self._async_waiters = []
+        # 默认消费者，兼容原先的单消费者用法（read/idle）
+        self.default_reader = self.subscribe("default")
 
+    @property
+    def idle(self):
+        return self.default_reader.pending()
+
+    @synchronized
+    def subscribe(self, name=None):
+        """
+        新增一个消费者，从当前位置开始读取
+        :return: SentenceReader
+        """
+        reader = SentenceReader(self, name)
+        self.readers.append(reader)
+        return reader
+
+    @synchronized
+    def unsubscribe(self, reader):
+        if reader in self.readers:
+            self.readers.remove(reader)
+
+    def _notify(self):
+        # 调用方需持有self.lock
+        self.not_empty.notify_all()
+        for loop, future in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(_wake_future, future)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+        self._async_waiters = []
 
     @synchronized
     def write(self, sentence):
-        # 如果缓冲区已满，则无法写入
-        if self.idle == self.max_sentences:
-            print("缓存区不够用")
+        if self.closed:
             return False
-        self.buffer[self.writeIndex] = sentence
-        self.writeIndex = (self.writeIndex + 1) % self.max_sentences
-        self.idle += 1
+        # 缓冲区已满：落后的消费者丢弃最旧的一句
+        oldest = self.write_seq - self.max_sentences
+        for reader in self.readers:
+            if reader.position <= oldest:
+                reader.position = oldest + 1
+                self.dropped += 1
+                self.__unlogged_drops += 1
+        if self.__unlogged_drops and time.time() - self.__last_drop_log >= DROP_LOG_INTERVAL:
+            util.log(1, f"句子缓存已满，读取过慢的消费者丢弃了{self.__unlogged_drops}句最旧的句子")
+            self.__unlogged_drops = 0
+            self.__last_drop_log = time.time()
+        self.buffer[self.write_seq % self.max_sentences] = sentence
+        self.write_seq += 1
+        self._notify()
         return True
 
-    @synchronized
-    def read(self):
-        # 如果缓冲区为空，没有可读的句子
-        if self.idle == 0:
+    def _pop(self, reader):
+        # 调用方需持有self.lock
+        if reader.position >= self.write_seq:
             return None
-        sentence = self.buffer[self.readIndex]
-        self.buffer[self.readIndex] = None
-        self.readIndex = (self.readIndex + 1) % self.max_sentences
-        self.idle -= 1
+        sentence = self.buffer[reader.position % self.max_sentences]
+        reader.position += 1
         return sentence
 
+    def _read(self, reader, block, timeout):
+        with self.lock:
+            if block:
+                self.waiting += 1
+                try:
+                    self.not_empty.wait_for(lambda: self.closed or reader.position < self.write_seq, timeout)
+                finally:
+                    self.waiting -= 1
+            return self._pop(reader)
+
+    async def _aread(self, reader, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            with self.lock:
+                sentence = self._pop(reader)
+                if sentence is not None or self.closed:
+                    return sentence
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+                self.waiting += 1
+            remaining = None if deadline is None else deadline - loop.time()
+            try:
+                if remaining is not None and remaining <= 0:
+                    return None
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                with self.lock:
+                    self.waiting -= 1
+
+    def read(self, block=False, timeout=None):
+        return self.default_reader.read(block, timeout)
+
+    async def aread(self, timeout=None):
+        return await self.default_reader.aread(timeout)
+
     @synchronized
     def clear(self):
         self.buffer = [None] * self.max_sentences
-        self.writeIndex = 0
-        self.readIndex = 0
-        self.idle = 0
+        for reader in self.readers:
+            reader.position = self.write_seq
+
+    @synchronized
+    def close(self):
+        """
+        关闭缓存，唤醒所有等待中的读取方
+        """
+        self.closed = True
+        self._notify()
 
 if __name__ == '__main__':
     cache = SentenceCache(3)
@@ -1,4 +1,3 @@
-from io import BytesIO
 import threading
 import functools
 
@@ -9,59 +8,162 @@ def synchronized(func):
       return func(self, *args, **kwargs)
   return wrapper
 
+# read默认的阻塞等待时间（秒），数据不足时等待写入而不是让调用方空转
+READ_TIMEOUT = 0.1
+# 环形区初始分配的字节数（16kHz 16bit单声道约2秒），数据积压时按需倍增，最大到maxbytes
+INITIAL_BYTES = 64 * 1024
+
 class StreamCache:
+    """
+    音频字节环形缓冲区
+
+    环形区先分配INITIAL_BYTES，数据积压超过当前大小时倍增（最大maxbytes），读写只做切片拷贝，不再seek；
+    数据不足时read阻塞等待（可设置超时），达到maxbytes仍写不下时丢弃最旧的数据，并记录溢出/欠载统计。
+    """
     def __init__(self, maxbytes):
         self.lock = threading.Lock()
-        self.bytesio = BytesIO()
+        self.readable = threading.Condition(self.lock)
+        self.maxbytes = maxbytes
+        self.capacity = min(maxbytes, INITIAL_BYTES)  # 当前环形区大小
+        self.buffer = bytearray(self.capacity)
+        self.view = memoryview(self.buffer)
         self.writeSeek = 0
         self.readSeek = 0
-        self.maxbytes = maxbytes
-        self.idle = 0
-        
+        self.idle = 0  # 可读字节数
+        self.overflow_count = 0  # 写入时缓冲区已满的次数
+        self.overflow_bytes = 0  # 因缓冲区满而丢弃的字节数
+        self.underflow_count = 0  # 读取时数据不足（超时）的次数
+
     @synchronized
     def write(self, bs):
-        # print("写:{},{}".format(len(bs),bs), end=' ')
-        if self.idle >= self.maxbytes:
-            print("缓存区不够用")
-        self.bytesio.seek(self.writeSeek)
-        if self.writeSeek + len(bs) <= self.maxbytes:
-            self.bytesio.write(bs)
-        else:
-            self.bytesio.write(bs[0:self.maxbytes - self.writeSeek])
-            self.bytesio.seek(0)
-            self.bytesio.write(bs[self.maxbytes - self.writeSeek:])
-        self.idle += len(bs)
-        self.writeSeek = self.bytesio.tell()
-        if self.writeSeek >= self.maxbytes - 1:
-            self.writeSeek = 0
+        data = memoryview(bs).cast('B')
+        length = len(data)
+        if length == 0:
+            return
+        if length > self.maxbytes:
+            # 单次写入超过容量，只保留最新的部分
+            self.overflow_bytes += length - self.maxbytes
+            data = data[length - self.maxbytes:]
+            length = self.maxbytes
+        if self.idle + length > self.capacity and self.capacity < self.maxbytes:
+            self.__grow(self.idle + length)
+        free = self.capacity - self.idle
+        if length > free:
+            # 缓冲区不够用：丢弃最旧的数据，记录在溢出统计中
+            dropped = length - free
+            self.overflow_count += 1
+            self.overflow_bytes += dropped
+            self.readSeek = (self.readSeek + dropped) % self.capacity
+            self.idle -= dropped
 
-    
-    @synchronized
-    def read(self, length, exception_on_overflow = False):
+        first = min(length, self.capacity - self.writeSeek)
+        self.view[self.writeSeek:self.writeSeek + first] = data[:first]
+        if first < length:
+            self.view[0:length - first] = data[first:]
+        self.writeSeek = (self.writeSeek + length) % self.capacity
+        self.idle += length
+        self.readable.notify_all()
+
+    def __grow(self, needed):
+        # 换成更大的环形区并把未读数据移到开头；调用方需持有self.lock。
+        # 旧的bytearray不原地扩容（read_view返回的视图仍指向它），由垃圾回收释放
+        capacity = self.capacity
+        while capacity < needed and capacity < self.maxbytes:
+            capacity *= 2
+        capacity = min(capacity, self.maxbytes)
+        buffer = bytearray(capacity)
+        view = memoryview(buffer)
+        offset = 0
+        for part in self.__consume(self.idle):
+            view[offset:offset + len(part)] = part
+            offset += len(part)
+        self.buffer = buffer
+        self.view = view
+        self.capacity = capacity
+        self.readSeek = 0
+        self.writeSeek = offset
+        self.idle = offset
+
+    def __wait(self, length, block, timeout):
+        # 调用方需持有self.lock
+        if self.idle < length and block:
+            self.readable.wait_for(lambda: self.idle >= length, timeout)
         if self.idle < length:
-            return None
-        # print("读:{}".format(length), end=' ')
-        self.bytesio.seek(self.readSeek)
-        if self.readSeek + length <= self.maxbytes:
-            bs = self.bytesio.read(length)
-        else:
-            bs = self.bytesio.read(self.maxbytes - self.readSeek)
-            self.bytesio.seek(0)
-            bs.append(self.bytesio.read(self.readSeek + length - self.maxbytes))
+            self.underflow_count += 1
+            return False
+        return True
 
+    def __consume(self, length):
+        # 返回环形区内的一段或两段视图，并前移读位置；调用方需持有self.lock
+        first = min(length, self.capacity - self.readSeek)
+        parts = [self.view[self.readSeek:self.readSeek + first]]
+        if first < length:
+            parts.append(self.view[0:length - first])
+        self.readSeek = (self.readSeek + length) % self.capacity
         self.idle -= length
-        self.readSeek = self.bytesio.tell()
-        if self.readSeek >= self.maxbytes - 1:
-           self.readSeek = 0
-        return bs
+        return parts
+
+    @synchronized
+    def read(self, length, exception_on_overflow = False, block = True, timeout = READ_TIMEOUT):
+        """
+        读取length字节
+        :param block: 数据不足时是否等待
+        :param timeout: 等待超时（秒），None表示一直等待
+        :return: bytes，超时仍不足length字节时返回None
+        """
+        if not self.__wait(length, block, timeout):
+            return None
+        parts = self.__consume(length)
+        if len(parts) == 1:
+            return parts[0].tobytes()
+        return b''.join(parts)
+
+    @synchronized
+    def readinto(self, out, block = True, timeout = READ_TIMEOUT):
+        """
+        读取len(out)字节到调用方提供的缓冲区，不分配新对象
+        :return: 读取的字节数，超时返回0
+        """
+        out = memoryview(out).cast('B')
+        length = len(out)
+        if not self.__wait(length, block, timeout):
+            return 0
+        offset = 0
+        for part in self.__consume(length):
+            out[offset:offset + len(part)] = part
+            offset += len(part)
+        return length
+
+    @synchronized
+    def read_view(self, length, block = True, timeout = READ_TIMEOUT):
+        """
+        读取length字节，数据在环形区内连续时直接返回memoryview（不拷贝），跨越末尾时返回bytes。
+        返回的memoryview在后续写入覆盖该区域之前有效，调用方应尽快处理完。
+        """
+        if not self.__wait(length, block, timeout):
+            return None
+        parts = self.__consume(length)
+        if len(parts) == 1:
+            return parts[0]
+        return b''.join(parts)
 
     @synchronized
     def clear(self):
-        self.bytesio = BytesIO()
         self.writeSeek = 0
         self.readSeek = 0
         self.idle = 0
 
+    @synchronized
+    def stats(self):
+        return {
+            'capacity': self.maxbytes,
+            'allocated': self.capacity,
+            'buffered': self.idle,
+            'overflow_count': self.overflow_count,
+            'overflow_bytes': self.overflow_bytes,
+            'underflow_count': self.underflow_count
+        }
+
 if __name__ == '__main__':
     streamCache = StreamCache(5)
     streamCache.write(b'\x01\x02')
@@ -70,15 +172,6 @@ if __name__ == '__main__':
     print(streamCache.read(3))
     streamCache.write(b'\x05\x06')
     print(streamCache.read(2))
-    print(streamCache.read(2))
-    print(streamCache.read(3))
-
-
-    
-
-
-    
-
-
-
-        
\ No newline at end of file
+    print(streamCache.read(2, block=False))
+    print(streamCache.read(3, block=False))
+    print(streamCache.stats())
@@ -4,6 +4,7 @@ import sys
 import random
 import time
 import socket
+import wave
 
 from core import wsa_server
 from scheduler.thread_manager import MyThread
@@ -117,4 +118,24 @@ class DisablePrint:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         sys.stdout.close()
-        sys.stdout = self._original_stdout
\ No newline at end of file
+        sys.stdout = self._original_stdout
+
+
+def get_audio_length(file_url):
+    """
+    获取音频时长（秒）。wav文件直接由文件头中的采样数计算，不解码音频
+
+    返回:
+        float: 时长，无法获取时返回None
+    """
+    if file_url is None:
+        return None
+    if file_url.endswith('.wav'):
+        try:
+            with wave.open(file_url, 'rb') as wf:
+                return wf.getnframes() / float(wf.getframerate())
+        except (wave.Error, EOFError):
+            # 文件头与内容不符（例如wav头包着mp3数据），交给pydub解码
+            pass
+    from pydub import AudioSegment
+    return len(AudioSegment.from_file(file_url)) / 1000.0